@@ -7,20 +7,25 @@ This file handles all the infra-structure of running a Slack bot:
 
 All actual bot logic is in the Processor class
 """
+import atexit
 import json
 import os
 import logging
 import random
-import redis
 import sys
+import tempfile
+import threading
+import time
 
 from flask import Flask, request, make_response
 from slackeventsapi import SlackEventAdapter
-from slack import WebClient
 
-from processor import Processor
-from slack_client_wrapper import SlackClientWrapper
-import clippy_messages
+import metrics
+import structured_log
+from event_dedupe import EventDeduplicator
+from structured_log import StructuredLogger, event_context
+from toolbox import nested_get
+from work_queue import WorkQueue
 
 APP_NAME = "ChannelTellTale"
 VERSION = "1.4.3 2022-Jul-16"  # Update this manually on each release
@@ -28,54 +33,241 @@ VERSION = "1.4.3 2022-Jul-16"  # Update this manually on each release
 # Get environment settings 
 # getenv() is used for optional settings; os.environ[] is used for required settings
 DEBUG = bool(os.getenv("DEBUG"))
+LAZY_INIT = bool(os.getenv("LAZY_INIT"))  # don't connect to redis or slack until the first event arrives
 PORT = os.getenv("PORT") or 3000
 SLACK_BOT_TOKEN = os.environ["SLACK_BOT_TOKEN"]
 SLACK_VERIFICATION_TOKEN = os.environ["SLACK_VERIFICATION_TOKEN"]
 SLACK_SIGNING_SECRET = os.environ["SLACK_SIGNING_SECRET"]
 TARGET_CHANNEL_ID = os.environ["TARGET_CHANNEL_ID"]
 CHANNEL_PREFIXES = os.getenv("CHANNEL_PREFIXES", "")
+DIGEST_SECONDS = float(os.getenv("DIGEST_SECONDS", 0))  # coalesce bursts of announcements sent to TARGET_CHANNEL_ID
 REDIS_URL = os.getenv("REDIS_URL")
+IN_MEMORY_MAX_KEYS = int(os.getenv("IN_MEMORY_MAX_KEYS", 100000))  # only used if REDIS_URL is not given
 JIRA_URL = os.getenv("JIRA_URL")  # e.g. https://atlassian.mycompany.com
 FOMO_USERS = os.getenv("FOMO_USERS")  # "bug-im:fred.hole,joe.bloggs|approvals-:boss.man"
+FOMO_EMAIL_DOMAIN = os.getenv("FOMO_EMAIL_DOMAIN")  # e.g. mycompany.com, if user names are the same as email addresses
+# The list of all users is shared by the worker processes in this file. An empty value means each worker loads its own
+USER_TABLE_PATH = os.getenv("USER_TABLE_PATH", os.path.join(tempfile.gettempdir(), "telltale-users.table"))
+USER_SYNC_SECONDS = float(os.getenv("USER_SYNC_SECONDS", 0))  # stop loading users.list after this long (0: never)
+EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", 4))  # 0 means process events on the request thread
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 1000))
+ASYNC_EVENTS = bool(os.getenv("ASYNC_EVENTS"))  # process channel events on an asyncio event loop
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", 10))
+FAN_OUT_CONCURRENCY = int(os.getenv("FAN_OUT_CONCURRENCY", 8))  # max messages being sent at once
+DEFER_PURPOSE = bool(os.getenv("DEFER_PURPOSE"))  # announce immediately; fill in the purpose later
+PURPOSE_RECHECK_SECONDS = float(os.getenv("PURPOSE_RECHECK_SECONDS", 30))
+EVENT_ID_TTL_SECONDS = int(os.getenv("EVENT_ID_TTL_SECONDS", 60 * 60))  # how long to remember event ids
+SLACK_API_URL = os.getenv("SLACK_API_URL")  # e.g. http://localhost:3001/api/ to use fake_slack_server.py
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1))  # fraction of high volume log records that are written
 
 # Initialize logging
 FORMAT = "%(asctime)s | %(process)d | %(name)s | %(levelname)s | %(thread)d | %(message)s"
 logging.basicConfig(format=FORMAT, level=logging.DEBUG if DEBUG else logging.INFO)
+if LOG_FORMAT == "json":
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(structured_log.JsonFormatter())
+structured_log.configure(LOG_SAMPLE_RATE)
 _logger = logging.getLogger(APP_NAME)
+_log = StructuredLogger(_logger)
 
 # Log some settings
 _logger.info("STARTING %s (%s)", APP_NAME, VERSION)
 _logger.info("PYTHON VERSION: %s", sys.version)
 _logger.info("DEBUG: %s", DEBUG)
+_logger.info("LAZY_INIT: %s", LAZY_INIT)
 _logger.info("PORT: %s", PORT)
 _logger.info("CHANNEL_PREFIXES: %s", CHANNEL_PREFIXES)
 _logger.info("TARGET_CHANNEL_ID: %s", TARGET_CHANNEL_ID)
+_logger.info("DIGEST_SECONDS: %s", DIGEST_SECONDS)
 _logger.info("REDIS_URL: %s", REDIS_URL)
 _logger.info("JIRA_URL: %s", JIRA_URL)
+_logger.info("FOMO_EMAIL_DOMAIN: %s", FOMO_EMAIL_DOMAIN)
+_logger.info("EVENT_WORKERS: %s", EVENT_WORKERS)
+_logger.info("EVENT_QUEUE_SIZE: %s", EVENT_QUEUE_SIZE)
+_logger.info("ASYNC_EVENTS: %s", ASYNC_EVENTS)
+if ASYNC_EVENTS and not EVENT_WORKERS:
+    _logger.warning("ASYNC_EVENTS without EVENT_WORKERS: each event is processed on the event loop, on its own")
+_logger.info("DEFER_PURPOSE: %s", DEFER_PURPOSE)
+if DEFER_PURPOSE and not EVENT_WORKERS:
+    _logger.warning("DEFER_PURPOSE without EVENT_WORKERS: purposes are only filled in by channel_purpose events")
+_logger.info("SLACK_API_URL: %s", SLACK_API_URL)
+_logger.info("LOG_FORMAT: %s", LOG_FORMAT)
+_logger.info("LOG_SAMPLE_RATE: %s", LOG_SAMPLE_RATE)
 
 _logger.debug("*** This is a DEBUG build ***")
 
 # Load in any additional channel/prefix mappings
 additional_channels = {}
+digest_windows = {TARGET_CHANNEL_ID: DIGEST_SECONDS}
 for suffix in range(1, 10):
     channel = os.getenv(f"TARGET_CHANNEL_ID_{suffix}")
     if channel:
         prefixes = os.getenv(f"CHANNEL_PREFIXES_{suffix}", "")
+        digest_seconds = float(os.getenv(f"DIGEST_SECONDS_{suffix}", 0))
         _logger.info(f"TARGET_CHANNEL_ID_%d: %s", suffix, channel)
         _logger.info(f"CHANNEL_PREFIXES_%d: %s", suffix, prefixes)
+        _logger.info(f"DIGEST_SECONDS_%d: %s", suffix, digest_seconds)
         additional_channels[channel] = prefixes.split()
+        digest_windows[channel] = digest_seconds
+
+
+def _connect_store(url):
+    """
+    Connect to the store given by the url scheme:
+     - redis://... or rediss://... -- a real redis server
+     - sqlite:///path/to/file.db -- a SQLite database that survives restarts (sqlite:////tmp/x.db for an absolute path)
+     - nothing -- in memory only
+    """
+    if not url:
+        from in_memory_redis import InMemoryRedis
+        return InMemoryRedis(IN_MEMORY_MAX_KEYS)
+    if url.startswith("sqlite:///"):
+        from sqlite_redis import SqliteRedis
+        return SqliteRedis(url[len("sqlite:///"):])
+    import redis
+    return redis.from_url(url)
+
+
+def _create_processor():
+    """
+    Connect to redis and slack, and create the Processor that does all the real work
+    """
+    from slack import WebClient
+    from processor import Processor
+    from slack_client_wrapper import SlackClientWrapper
+
+    web_client = WebClient(SLACK_BOT_TOKEN, base_url=SLACK_API_URL) if SLACK_API_URL else WebClient(SLACK_BOT_TOKEN)
+    wrapper = SlackClientWrapper(web_client, _logger)
+    target_channel_to_prefixes_map = {
+        TARGET_CHANNEL_ID: CHANNEL_PREFIXES.split(),  # whitespace separated list
+        "jpp-notify-ttd-aws": ["jpp"],
+    }
+    target_channel_to_prefixes_map.update(additional_channels)
+    settings = dict(jira=JIRA_URL, fomo_users_as_string=FOMO_USERS, defer_purpose=DEFER_PURPOSE,
+                    on_pending_purpose=_schedule_purpose_recheck if EVENT_WORKERS else None,
+                    fomo_email_domain=FOMO_EMAIL_DOMAIN, fan_out_concurrency=FAN_OUT_CONCURRENCY,
+                    digest_windows=digest_windows, user_table_path=USER_TABLE_PATH or None,
+                    user_sync_seconds=USER_SYNC_SECONDS or None)
+    if ASYNC_EVENTS:
+        processor = _create_async_processor(target_channel_to_prefixes_map, wrapper, settings)
+    else:
+        processor = Processor(target_channel_to_prefixes_map, wrapper, get_store(), **settings)
+    processor.warm_up()
+    return processor
+
+
+def _schedule_purpose_recheck(channel_id):
+    """
+    The channel was announced before it had a purpose. Have another look a little later.
+    """
+    _work_queue.schedule(PURPOSE_RECHECK_SECONDS, _call_processor, "recheck_channel_purpose", channel_id)
+
+
+def _create_async_processor(target_channel_to_prefixes_map, wrapper, settings):
+    """
+    Create a Processor that processes channel events on an asyncio event loop, with asyncio clients for slack
+    and the store
+    """
+    from async_processor import AsyncProcessor, BackgroundLoop
+    from async_slack_client_wrapper import AsyncSlackClientWrapper
+    from async_store import connect_async_store
+    from slack_dispatcher import AsyncSlackDispatcher
+
+    loop = BackgroundLoop()
+    kwargs = {"base_url": SLACK_API_URL} if SLACK_API_URL else {}
+    try:
+        from slack_sdk.web.async_client import AsyncWebClient
+        async_web_client = AsyncWebClient(SLACK_BOT_TOKEN, **kwargs)
+    except ImportError:
+        from slack import WebClient
+        async_web_client = WebClient(SLACK_BOT_TOKEN, run_async=True, loop=loop.loop, **kwargs)
+    # Both wrappers call the same Slack app, so they share one budget for each method and channel
+    dispatcher = AsyncSlackDispatcher(_logger, rate_limits=wrapper.dispatcher.rate_limits)
+    async_wrapper = AsyncSlackClientWrapper(async_web_client, _logger, dispatcher)
+    store = get_store()
+    return AsyncProcessor(target_channel_to_prefixes_map, wrapper, async_wrapper, store,
+                          async_redis_client=connect_async_store(REDIS_URL, store), loop=loop, **settings)
+
+
+_store = None
+_event_deduplicator = None
+_processor = None
+_processor_lock = threading.Lock()
+_store_lock = threading.Lock()  # separate, because the store is created while the processor is being created
+
+
+def get_store():
+    """
+    Return the store (redis, or a stand-in) that is shared by everything, connecting to it on first use
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = metrics.InstrumentedStore(_connect_store(REDIS_URL))
+    return _store
+
+
+def get_event_deduplicator():
+    """
+    Return the EventDeduplicator that recognises repeated deliveries of events, creating it on first use
+    """
+    global _event_deduplicator
+    if _event_deduplicator is None:
+        store = get_store()
+        with _store_lock:
+            if _event_deduplicator is None:
+                _event_deduplicator = EventDeduplicator(store, _logger, EVENT_ID_TTL_SECONDS)
+    return _event_deduplicator
+
+
+def get_processor():
+    """
+    Return the Processor, creating it on first use
+    """
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                _processor = _create_processor()
+    return _processor
+
+
+def _call_processor(method_name, *args):
+    return getattr(get_processor(), method_name)(*args)
+
 
 # Initialize our web server and slack interfaces
 app = Flask(__name__)
 slack_events_adapter = SlackEventAdapter(SLACK_SIGNING_SECRET, "/slack/events", server=app)
-_redis = redis.from_url(REDIS_URL) if REDIS_URL else None
-_wrapper = SlackClientWrapper(WebClient(SLACK_BOT_TOKEN), _logger)
-target_channel_to_prefixes_map = {
-    TARGET_CHANNEL_ID: CHANNEL_PREFIXES.split(),  # whitespace separated list
-    "jpp-notify-ttd-aws": ["jpp"],
-}
-target_channel_to_prefixes_map.update(additional_channels)
-_processor = Processor(target_channel_to_prefixes_map, _wrapper, _redis, jira=JIRA_URL, fomo_users_as_string=FOMO_USERS)
+if not LAZY_INIT:
+    get_processor()
+
+# Events are acknowledged immediately, and then processed on these background threads
+_work_queue = WorkQueue(EVENT_WORKERS, EVENT_QUEUE_SIZE, _logger, name="EventWorker")
+
+
+def _shutdown():
+    """
+    Finish the events that have been accepted, for up to SHUTDOWN_DRAIN_SECONDS in all, then send the digests
+    """
+    deadline = time.time() + SHUTDOWN_DRAIN_SECONDS
+    _work_queue.shutdown(SHUTDOWN_DRAIN_SECONDS)
+    if _processor is None:
+        return
+    if ASYNC_EVENTS:
+        # The workers have handed their last events to the event loop. Wait for those too.
+        _processor.close(max(0.0, deadline - time.time()))
+        _processor.loop.stop()
+    # Only now, so that the announcements made while draining are in the digests
+    _processor.flush_digests()
+
+
+atexit.register(_shutdown)
+metrics.REGISTRY.gauge_callback("telltale_work_queue_depth", "Events waiting to be processed", _work_queue.depth)
+metrics.REGISTRY.gauge_callback("telltale_work_queue_rejected", "Events dropped because the work queue was full",
+                                lambda: _work_queue.rejected)
 
 
 # -------------------------
@@ -87,8 +279,7 @@ def handle_channel_created(event_data):
     """
     Event callback when a new channel is created
     """
-    _logger.info("received channel_created event: %s", json.dumps(event_data))
-    _processor.process_channel_event("create", event_data)
+    _submit_event(event_data, "channel_created", _process_channel_event, "create", event_data)
 
 
 @slack_events_adapter.on("channel_rename")
@@ -96,8 +287,73 @@ def handle_channel_renamed(event_data):
     """
     Event callback when a channel is renamed
     """
-    _logger.info("received channel_rename event: %s", json.dumps(event_data))
-    _processor.process_channel_event("rename", event_data)
+    _submit_event(event_data, "channel_rename", _process_channel_event, "rename", event_data)
+
+
+@slack_events_adapter.on("message")
+def handle_message(event_data):
+    """
+    Event callback when a message is posted. We are only interested in a channel's purpose being set.
+    """
+    if DEFER_PURPOSE and nested_get(event_data, "event", "subtype") == "channel_purpose":
+        _submit_event(event_data, "channel_purpose", _call_processor, "process_purpose_event", event_data)
+
+
+@slack_events_adapter.on("user_change")
+def handle_user_change(event_data):
+    """
+    Event callback when a user's profile changes
+    """
+    _submit_event(event_data, "user_change", _call_processor, "process_user_event", event_data)
+
+
+@slack_events_adapter.on("team_join")
+def handle_team_join(event_data):
+    """
+    Event callback when a new user joins the workspace
+    """
+    _submit_event(event_data, "team_join", _call_processor, "process_user_event", event_data)
+
+
+def _submit_event(event_data, event_type, fn, *args):
+    """
+    Queue the processing of an event, unless it is a repeated delivery of an event that has already been accepted.
+    Repeated deliveries are acknowledged straight away, without doing any work.
+    """
+    event_id = event_data.get("event_id")
+    with event_context(event_id):
+        retry_num = request.headers.get("X-Slack-Retry-Num")
+        retry_reason = request.headers.get("X-Slack-Retry-Reason")
+        if not get_event_deduplicator().is_first_delivery(event_id, retry_num, retry_reason):
+            return
+
+        _log_event(event_type, event_data)
+        if not _work_queue.submit(fn, *args):
+            # We couldn't do the work, so let Slack's retry of this event be processed
+            get_event_deduplicator().forget(event_id)
+
+
+def _log_event(event_type, event_data):
+    """
+    Log the arrival of an event. The whole event is only serialised if DEBUG logging is on.
+    """
+    channel = nested_get(event_data, "event", "channel")
+    _log.sample("received event", type=event_type, channel=channel.get("id") if isinstance(channel, dict) else channel)
+    _log.debug("event payload", event=event_data)
+
+
+def _process_channel_event(event_type, event_data):
+    if ASYNC_EVENTS and EVENT_WORKERS:
+        # Hand the event to the event loop, so this worker is free for the next one. When the loop already has as
+        # many events as it takes, this waits, so that further events wait in (and are bounded by) the work queue.
+        get_processor().submit_channel_event(event_type, event_data).add_done_callback(_log_failure)
+    else:
+        get_processor().process_channel_event(event_type, event_data)
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception():
+        _logger.error("processing of channel event failed", exc_info=future.exception())
 
 
 @app.route("/interactive", methods=["GET", "POST"])
@@ -115,9 +371,11 @@ def interactive_handler():
     if event_data.get("token") != SLACK_VERIFICATION_TOKEN:
         return make_response("Bad token.", 404)
 
-    _logger.info("received interactive event: %s", repr(event_data))
-    response = _processor.process_interactive_event(event_data)
-    _logger.info("process_interactive_event response: %s", repr(response))
+    _log.sample("received interactive event", channel=nested_get(event_data, "channel", "id"),
+                user=nested_get(event_data, "user", "id"))
+    _log.debug("interactive payload", payload=event_data)
+    response = get_processor().process_interactive_event(event_data)
+    _log.debug("process_interactive_event response", response=response)
 
     if response is None:
         return make_response("Bad response.", 500)
@@ -136,8 +394,9 @@ def slash_clippy_handler():
         return make_response("You still haven't found what you're looking for.", 404)
 
     event_data = json.loads(request.form["payload"])
-    _logger.info("received slash_clippy_handler: %s", json.dumps(event_data))
+    _log.sample("received slash command", text=event_data.get("text"))
 
+    import clippy_messages
     text = event_data.get("text") or ""
     blocks = clippy_messages.NEW_GROUP if text.startswith("1") else \
         clippy_messages.NEW_THREAD if text.startswith("2") else \
@@ -157,6 +416,23 @@ def slash_handler():
     return f'{APP_NAME} {VERSION}'
 
 
+@app.route("/queue")
+def queue_handler():
+    return make_response(json.dumps({
+        "workers": _work_queue.workers,
+        "depth": _work_queue.depth(),
+        "rejected": _work_queue.rejected,
+        "events": _event_deduplicator.stats() if _event_deduplicator else None,
+        "slack": _processor.slack_client.dispatcher.stats() if _processor else None,
+        "profiles": _processor.profile_cache.stats() if _processor else None
+    }), 200, [["Content-type", "application/json; charset=utf-8"]])
+
+
+@app.route("/metrics")
+def metrics_handler():
+    return make_response(metrics.REGISTRY.render(), 200, [["Content-type", metrics.CONTENT_TYPE]])
+
+
 @app.route("/ping")
 def ping_handler():
     channel = {
@@ -167,7 +443,7 @@ def ping_handler():
             "value": "Discuss home automation using Google Home and Amazon Alexa"
         }
     }
-    _processor._april_fools_day(channel)
+    get_processor()._april_fools_day(channel)
     return "pong"
 
 
@@ -207,10 +483,11 @@ def poke_handler():
         ]
     }
     _logger.info("sending message: %s", repr(fancy_message))
-    result = _wrapper.client.api_call("chat.postMessage", channel=hack_channel, unfurl_media=True,
-                                      text="I found this image based on these keywords: 'lesson', 'yeti', 'bidding'.\n\n"
-                                           "http://www.cutenessoverflow.com/wp-content/uploads/2016/06/a.jpg",
-                                      attachments=[fancy_message])
+    wrapper = get_processor().slack_client
+    result = wrapper.client.api_call("chat.postMessage", channel=hack_channel, unfurl_media=True,
+                                     text="I found this image based on these keywords: 'lesson', 'yeti', 'bidding'.\n\n"
+                                          "http://www.cutenessoverflow.com/wp-content/uploads/2016/06/a.jpg",
+                                     attachments=[fancy_message])
     _logger.info("result: %s", repr(result))
     return "sending poke message"
 
@@ -234,7 +511,8 @@ def poke2_handler():
         }
     ]
     _logger.info("sending message: %s", repr(fancy_message))
-    result = _wrapper.client.api_call(
+    wrapper = get_processor().slack_client
+    result = wrapper.client.api_call(
         "chat.postMessage",
         channel="UAKA6GKFF",
         as_user=True,
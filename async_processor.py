@@ -0,0 +1,286 @@
+"""
+Process channel events on an asyncio event loop, instead of one thread per event.
+
+Almost all the time spent on an event is spent waiting for Slack (and redis), so a single event loop can have
+far more events in flight than the pool of worker threads can. AsyncProcessor runs the announcement pipeline
+(dedupe, channel info, creator info, announcements) as coroutines, using the same steps as Processor for
+everything that doesn't wait. The rarer follow-up work (FOMO, JIRA, digests and pending purposes) reuses the
+synchronous Processor code, on threads.
+
+The loop runs on its own thread (BackgroundLoop), so the synchronous app can hand events to it.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import wait
+
+from async_store import AsyncStore
+from processor import (CHANNEL_INFO_TTL_IN_SECONDS, EVENTS_DROPPED, EVENTS_PROCESSED, PURPOSE_WAIT_SECONDS,
+                       STAGE_SECONDS, Processor)
+from profile_cache import AsyncProfileCache
+
+# Events beyond this many wait for one of the others to finish, so that a burst can't exhaust memory or sockets
+MAX_EVENTS_IN_FLIGHT = 1000
+
+
+class BackgroundLoop:
+    """
+    An asyncio event loop running on its own thread, that synchronous code can hand coroutines to
+    """
+
+    def __init__(self, name="EventLoop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine):
+        """
+        Start running the given coroutine on the loop, with the caller's context (e.g. the id of the event that is
+        being logged). Return a concurrent.futures.Future of its result.
+        """
+        return asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coroutine), self.loop)
+
+    def run(self, coroutine):
+        """
+        Run the given coroutine on the loop, and wait for its result
+        """
+        return self.submit(coroutine).result()
+
+    def stop(self):
+        """
+        Cancel whatever is still running on the loop, and stop it
+        """
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._cancel_all_and_stop)
+        self._thread.join()
+        self.loop.close()
+
+    def _cancel_all_and_stop(self):
+        tasks = asyncio.all_tasks(self.loop)
+        if not tasks:
+            self.loop.stop()
+            return
+        for task in tasks:
+            task.cancel()
+        asyncio.gather(*tasks, return_exceptions=True).add_done_callback(lambda _: self.loop.stop())
+
+
+async def _in_context(context, coroutine):
+    # Each task runs in its own copy of the context, so these values don't leak into other tasks
+    for (variable, value) in context.items():
+        variable.set(value)
+    return await coroutine
+
+
+class AsyncProcessor(Processor):
+    """
+    A Processor whose channel events are processed on an asyncio event loop.
+
+    It takes the same arguments as Processor, plus the asyncio versions of the slack client
+    (an AsyncSlackClientWrapper) and of the redis client (by default, the redis client run on threads).
+    """
+
+    def __init__(self, target_channel_to_prefixes_map, slack_client, async_slack_client, redis_client=None,
+                 async_redis_client=None, loop=None, max_in_flight=MAX_EVENTS_IN_FLIGHT, **kwargs):
+        super().__init__(target_channel_to_prefixes_map, slack_client, redis_client, **kwargs)
+        self.async_slack_client = async_slack_client
+        self.async_redis_client = async_redis_client if async_redis_client is not None \
+            else AsyncStore(self.redis_client, inline=redis_client is None)
+        self.async_profile_cache = AsyncProfileCache(self.profile_cache, async_slack_client, self.async_redis_client)
+        self._owns_loop = loop is None
+        self.loop = loop or BackgroundLoop()
+        self.max_in_flight = max_in_flight
+        self._in_flight = None  # created on the loop, when the first event arrives
+        self._submissions = threading.BoundedSemaphore(max_in_flight)
+        self._pending_lock = threading.Lock()
+        self._pending = set()  # futures of the submitted events that aren't done yet
+        self._all_done = None  # whether all the submitted events were done, once closed
+
+    def process_channel_event(self, event_type, event_data):
+        """
+        Process the event on the event loop, and wait for it to be done
+        """
+        return self.loop.run(self.process_channel_event_async(event_type, event_data))
+
+    def submit_channel_event(self, event_type, event_data):
+        """
+        Start processing the event on the event loop, without waiting for it to be done.
+        If max_in_flight submitted events are still in flight, wait for one of them to finish first, so that a burst
+        of events backs up into the caller's queue instead of piling up on the loop.
+
+        :return: a concurrent.futures.Future that is done when the event is
+        """
+        self._submissions.acquire()
+        try:
+            future = self.loop.submit(self.process_channel_event_async(event_type, event_data))
+        except BaseException:
+            self._submissions.release()
+            raise
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._submission_done)
+        return future
+
+    def _submission_done(self, future):
+        with self._pending_lock:
+            self._pending.discard(future)
+        self._submissions.release()
+
+    def close(self, timeout=None):
+        """
+        Wait (up to timeout seconds) for the submitted events to be done, then stop the event loop (if this processor
+        started it).
+
+        :return: True if all the submitted events were done
+        """
+        if self._all_done is not None:
+            return self._all_done
+        with self._pending_lock:
+            pending = list(self._pending)
+        (_, not_done) = wait(pending, timeout)
+        if not_done:
+            self.logger.error("%d channel events were still being processed at shutdown", len(not_done))
+        if self._owns_loop:
+            self.loop.stop()
+        self._all_done = not not_done
+        return self._all_done
+
+    async def process_channel_event_async(self, event_type, event_data):
+        """
+        The asyncio version of process_channel_event
+        """
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        async with self._in_flight:
+            EVENTS_PROCESSED.inc(event_type=event_type)
+            with STAGE_SECONDS.time(stage="total"):
+                reason = await self._process_channel_event_async(event_type, event_data)
+            if reason:
+                EVENTS_DROPPED.inc(reason=reason)
+
+    async def _process_channel_event_async(self, event_type, event_data):
+        """
+        :return: None if the channel was announced, otherwise the reason why it wasn't
+        """
+        (channel, reason) = self._wanted_channel(event_data)
+        if reason:
+            return reason
+
+        with STAGE_SECONDS.time(stage="remember_channel"):
+            is_duplicate = await self.remember_channel_async(channel)
+        reason = self._check_duplicate(channel, is_duplicate)
+        if reason:
+            return reason
+
+        # The creator is usually in the event, so start fetching their profile while the channel is fetched
+        speculative_creator_id = channel.get("creator")
+        speculative_creator_info = asyncio.ensure_future(
+            self.async_profile_cache.user_info(speculative_creator_id)) if speculative_creator_id else None
+        try:
+            with STAGE_SECONDS.time(stage="channel_info"):
+                if self.defer_purpose:
+                    channel_info = await self.get_channel_info_async(channel["id"])
+                else:
+                    channel_info = await self.insistent_get_channel_info_async(channel["id"])
+            (creator_id, reason) = self._creator_of(channel, channel_info)
+            if reason:
+                return reason
+
+            with STAGE_SECONDS.time(stage="creator_info"):
+                creator_info = await self._creator_info_async(creator_id, speculative_creator_id,
+                                                              speculative_creator_info)
+            reason = self._check_creator_info(creator_info)
+            if reason:
+                return reason
+        finally:
+            if speculative_creator_info is not None:
+                _discard(speculative_creator_info)
+
+        with STAGE_SECONDS.time(stage="send_notification"):
+            await self._send_pretty_notification_async(event_type, channel_info.get("channel"),
+                                                       creator_info.get("user"))
+
+        with STAGE_SECONDS.time(stage="post_notification"):
+            await self._in_thread(self._post_notification, event_type, channel_info.get("channel"),
+                                  creator_info.get("user"))
+        return None
+
+    async def remember_channel_async(self, channel):
+        """
+        The asyncio version of remember_channel
+        """
+        if self._is_seen_channel(channel):
+            return True
+
+        is_new = await self.async_redis_client.set(*self._channel_record(channel), ex=CHANNEL_INFO_TTL_IN_SECONDS,
+                                                   nx=True)
+        self.seen_channels.add(channel["id"])
+        return not is_new
+
+    async def get_channel_info_async(self, channel_id):
+        """
+        The asyncio version of get_channel_info
+        """
+        return self._checked_channel_info(channel_id, await self.async_slack_client.channel_info(channel_id))
+
+    async def insistent_get_channel_info_async(self, channel_id):
+        """
+        The asyncio version of insistent_get_channel_info. Other events carry on while this one waits.
+        """
+        attempts = 0
+        channel_info = await self.get_channel_info_async(channel_id)
+        while self._is_waiting_for_purpose(channel_id, channel_info, attempts):
+            attempts += 1
+            await asyncio.sleep(PURPOSE_WAIT_SECONDS)
+            channel_info = await self.get_channel_info_async(channel_id)
+
+        return channel_info
+
+    async def _creator_info_async(self, creator_id, speculative_creator_id, speculative_creator_info):
+        if speculative_creator_info is None:
+            return await self.async_profile_cache.user_info(creator_id)
+        if self._is_speculation_used(creator_id, speculative_creator_id):
+            return await speculative_creator_info
+
+        await asyncio.wait([speculative_creator_info])
+        return await self.async_profile_cache.user_info(creator_id)
+
+    async def _send_pretty_notification_async(self, event_type, channel, creator):
+        """
+        The asyncio version of _send_pretty_notification. All the target channels are sent to at once.
+        """
+        (color, fancy_message, target_channels) = self._prepare_announcement(event_type, channel, creator)
+
+        async def announce(target_channel):
+            digest = self.digests.get(target_channel)
+            if digest:
+                return await self._in_thread(digest.add, fancy_message)
+            self.log.debug("sending announcement", target=target_channel, attachment=fancy_message)
+            return await self.async_slack_client.post_chat_message(target_channel, None, [fancy_message])
+
+        responses = await asyncio.gather(*[announce(x) for x in target_channels], return_exceptions=True)
+        for (target_channel, response) in zip(target_channels, responses):
+            if isinstance(response, Exception):
+                self.logger.error("announcing to %s failed", target_channel, exc_info=response)
+        sent_messages = self._sent_messages(target_channels,
+                                            [None if isinstance(x, Exception) else x for x in responses])
+
+        if self._is_missing_purpose(channel, sent_messages):
+            await self._in_thread(self._remember_pending_purpose, event_type, channel, creator, color, sent_messages)
+
+    async def _in_thread(self, fn, *args):
+        """
+        Run synchronous code on a thread of the loop's default executor, with the current context
+        """
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+def _discard(task):
+    # Don't leave the task running if the event was dropped, or complain that its exception was never retrieved
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
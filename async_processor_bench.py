@@ -0,0 +1,163 @@
+"""
+Benchmark the threaded Processor and the asyncio AsyncProcessor side by side, against the same simulated Slack.
+
+    > python async_processor_bench.py [--events N] [--latency-ms N] [--jitter-ms N] [--rate-limit P]
+                                      [--workers N [N ...]] [--in-flight N [N ...]]
+
+The threaded Processor is driven by a pool of threads (like EVENT_WORKERS), so it has at most that many events
+in flight. The AsyncProcessor is driven by one event loop, with at most --in-flight events in flight at once.
+Both use the fake WebClient of processor_bench.py (the asyncio one sleeps without blocking the loop), the
+in-memory store, and the same synthetic events. Each run reports throughput and the p50/p95/p99 latency of
+processing one event.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+import uuid
+
+from async_processor import AsyncProcessor
+from async_slack_client_wrapper import AsyncSlackClientWrapper
+from in_memory_redis import InMemoryRedis
+from processor import Processor
+from processor_bench import (FakeWebClient, RateLimitedError, UnthrottledDispatcher, drive, load_templates,
+                             make_events, random_word, report)
+from slack_client_wrapper import SlackClientWrapper
+from slack_dispatcher import AsyncSlackDispatcher
+
+
+class AsyncFakeWebClient(FakeWebClient):
+    """
+    The same fake Slack, for asyncio: its calls are coroutines, and their latency doesn't block the event loop
+    """
+
+    async def conversations_info(self, channel):
+        await self._async_wait()
+        return super().conversations_info(channel)
+
+    async def users_info(self, user):
+        await self._async_wait()
+        return super().users_info(user)
+
+    async def users_lookupByEmail(self, email):
+        await self._async_wait()
+        return super().users_lookupByEmail(email)
+
+    async def api_call(self, api_method, json=None):
+        await self._async_wait()
+        return super().api_call(api_method, json)
+
+    def _wait(self):
+        pass  # the calls have already waited
+
+    async def _async_wait(self):
+        (delay, is_rate_limited) = self._next_call()
+        if delay:
+            await asyncio.sleep(delay)
+        if is_rate_limited:
+            raise RateLimitedError(self.retry_after)
+
+
+class AsyncUnthrottledDispatcher(UnthrottledDispatcher, AsyncSlackDispatcher):
+    """
+    The asyncio dispatcher, with bottomless buckets (see UnthrottledDispatcher)
+    """
+
+
+def drive_async(processor, events, in_flight):
+    """
+    Process all the events on the processor's event loop, with no more than in_flight of them at once.
+
+    :return: (elapsed seconds, sorted list of the latencies of each event)
+    """
+    async def run_all():
+        semaphore = asyncio.Semaphore(in_flight)
+
+        async def timed(event):
+            async with semaphore:
+                start = time.perf_counter()
+                await processor.process_channel_event_async(*event)
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*[timed(event) for event in events])
+
+    start = time.perf_counter()
+    latencies = sorted(processor.loop.run(run_all()))
+    return time.perf_counter() - start, latencies
+
+
+def make_clients(args, users, client_class, logger):
+    client = client_class(users, args.latency_ms / 1000.0, args.jitter_ms / 1000.0, args.rate_limit)
+    return client, SlackClientWrapper(client, logger, UnthrottledDispatcher(logger))
+
+
+def make_run(args, templates, prefixes, client):
+    rng = random.Random(len(prefixes))
+    (events, channels) = make_events(rng, templates, prefixes, args.events, args.duplicate_ratio,
+                                     uuid.uuid4().hex[:8])
+    client.remember_channels(channels)
+    return events
+
+
+def run_threaded(args, templates, prefixes, users, workers, logger):
+    (client, wrapper) = make_clients(args, users, FakeWebClient, logger)
+    store = InMemoryRedis()
+    processor = Processor({"#announcements": prefixes}, wrapper, store, logger, fan_out_concurrency=args.fan_out)
+    assert processor.redis_client is store, "the figures must measure the configured store"
+    events = make_run(args, templates, prefixes, client)
+    return drive(lambda event: processor.process_channel_event(*event), events, workers)
+
+
+def run_async(args, templates, prefixes, users, in_flight, logger):
+    (client, wrapper) = make_clients(args, users, AsyncFakeWebClient, logger)
+    async_wrapper = AsyncSlackClientWrapper(client, logger, AsyncUnthrottledDispatcher(logger))
+    store = InMemoryRedis()
+    processor = AsyncProcessor({"#announcements": prefixes}, wrapper, async_wrapper, store,
+                               logger=logger, fan_out_concurrency=args.fan_out, max_in_flight=in_flight)
+    assert processor.async_redis_client.store is store, "the figures must measure the configured store"
+    try:
+        events = make_run(args, templates, prefixes, client)
+        return drive_async(processor, events, in_flight)
+    finally:
+        processor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the threaded and asyncio Processors")
+    parser.add_argument("--events", type=int, default=1000, help="events per run")
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 16, 64],
+                        help="threads processing events in the threaded runs (like EVENT_WORKERS)")
+    parser.add_argument("--in-flight", type=int, nargs="+", default=[4, 16, 64, 1000],
+                        help="events in flight at once in the asyncio runs")
+    parser.add_argument("--fan-out", type=int, default=8, help="FAN_OUT_CONCURRENCY")
+    parser.add_argument("--prefixes", type=int, default=10, help="configured channel prefixes")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1, help="fraction of duplicate events")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="latency of each call to slack")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="random variation of the latency")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of calls answered with HTTP 429")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("async_processor_bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    templates = load_templates()
+    rng = random.Random(args.prefixes)
+    prefixes = ["%s-" % random_word(rng, rng.randint(2, 8)) for _ in range(args.prefixes)]
+    users = [{"id": "U000000", "name": "bench.user"}]
+    print("%d events per run, %d prefixes, %.0f%% duplicates, slack latency %.1f +/- %.1f ms, %.1f%% rate limited" % (
+        args.events, args.prefixes, args.duplicate_ratio * 100, args.latency_ms, args.jitter_ms,
+        args.rate_limit * 100))
+    print()
+    print("  %-28s %10s %10s %10s %10s" % ("", "events/s", "p50 ms", "p95 ms", "p99 ms"))
+    for workers in args.workers:
+        (elapsed, latencies) = run_threaded(args, templates, prefixes, users, workers, logger)
+        report("threaded, %d workers" % workers, elapsed, latencies)
+    for in_flight in args.in_flight:
+        (elapsed, latencies) = run_async(args, templates, prefixes, users, in_flight, logger)
+        report("asyncio, %d in flight" % in_flight, elapsed, latencies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import asyncio
+import copy
+import random
+import threading
+import unittest
+from mock import MagicMock
+
+from async_processor import AsyncProcessor
+from in_memory_redis import InMemoryRedis
+from processor_test import CHANNEL_INFO_SUCCESS, CREATE_EVENT, USER_INFO_SUCCESS
+
+
+def channel_event(channel_id):
+    event_data = copy.deepcopy(CREATE_EVENT)
+    event_data["event"]["channel"]["id"] = channel_id
+    return event_data
+
+
+class FakeAsyncSlackClient:
+    """
+    An AsyncSlackClientWrapper that answers with canned responses, and remembers what it was asked
+    """
+
+    def __init__(self, channel_info=CHANNEL_INFO_SUCCESS, user_info=USER_INFO_SUCCESS):
+        self.channel_info_response = channel_info
+        self.user_info_response = user_info
+        self.calls = []
+        self.failing_channels = set()
+        self.answer = threading.Event()  # channel_info waits for this
+        self.answer.set()
+
+    async def channel_info(self, channel_id):
+        self.calls.append(("channel_info", channel_id))
+        await asyncio.sleep(0)
+        while not self.answer.is_set():
+            await asyncio.sleep(0.001)
+        return dict(self.channel_info_response, channel=dict(self.channel_info_response["channel"], id=channel_id))
+
+    async def user_info(self, user_id):
+        self.calls.append(("user_info", user_id))
+        await asyncio.sleep(0)
+        return self.user_info_response
+
+    async def post_chat_message(self, channel_id, text=None, attachments=[], blocks=None, as_user=False):
+        self.calls.append(("post_chat_message", channel_id, attachments))
+        if channel_id in self.failing_channels:
+            raise ConnectionError("connection reset")
+        return {"ok": True, "channel": channel_id, "ts": "1537991036.000200"}
+
+    def posted(self):
+        return [call for call in self.calls if call[0] == "post_chat_message"]
+
+
+class TestAsyncProcessor(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)  # Make random behave the same each time
+        self.slack_client = MagicMock()
+        self.async_slack_client = FakeAsyncSlackClient()
+        self.logger = MagicMock()
+
+    def make_processor(self, target_channel_to_prefixes_map=None, **kwargs):
+        processor = AsyncProcessor(target_channel_to_prefixes_map or {"target": ["dev-"]}, self.slack_client,
+                                   self.async_slack_client, logger=self.logger, **kwargs)
+        self.addCleanup(processor.close)
+        return processor
+
+    def test_create(self):
+        processor = self.make_processor()
+
+        processor.process_channel_event("create", CREATE_EVENT)
+
+        self.assertFalse(self.logger.error.called)
+        self.assertIn(("channel_info", "CHANNELID1"), self.async_slack_client.calls)
+        self.assertIn(("user_info", "USERID1"), self.async_slack_client.calls)
+        [(_, posted_channel, posted_attachments)] = self.async_slack_client.posted()
+        self.assertEqual("target", posted_channel)
+        self.assertEqual("<#CHANNELID1>", posted_attachments[0]["title"])
+        self.assertEqual("TESTING THIS", posted_attachments[0]["text"])
+        self.assertFalse(self.slack_client.post_chat_message.called)
+
+    def test_empty_store_is_used(self):
+        redis = InMemoryRedis(5)
+        processor = self.make_processor(redis_client=redis)
+
+        processor.process_channel_event("create", CREATE_EVENT)
+
+        self.assertIs(redis, processor.redis_client)
+        self.assertIs(redis, processor.async_redis_client.store)
+        self.assertIsNotNone(redis.get("channel:CHANNELID1"))
+
+    def test_concurrent_duplicate_events_are_announced_once(self):
+        processor = self.make_processor()
+
+        async def process_both():
+            await asyncio.gather(processor.process_channel_event_async("create", CREATE_EVENT),
+                                 processor.process_channel_event_async("create", copy.deepcopy(CREATE_EVENT)))
+
+        processor.loop.run(process_both())
+
+        self.assertEqual(1, len(self.async_slack_client.posted()))
+        self.assertEqual(1, self.async_slack_client.calls.count(("channel_info", "CHANNELID1")))
+
+    def test_unwanted_channels_are_ignored(self):
+        processor = self.make_processor({"target": ["ops-"]})
+
+        processor.process_channel_event("create", CREATE_EVENT)
+
+        self.assertEqual([], self.async_slack_client.calls)
+        self.assertIsNone(processor.redis_client.get("channel:CHANNELID1"))
+
+    def test_wrong_speculative_creator_is_fetched_again(self):
+        processor = self.make_processor()
+
+        processor.process_channel_event("create", CREATE_EVENT)
+
+        # The event says CREATORID1 created the channel, but the channel info says USERID1
+        self.assertIn(("user_info", "CREATORID1"), self.async_slack_client.calls)
+        self.assertIn(("user_info", "USERID1"), self.async_slack_client.calls)
+        self.assertEqual(1, len(self.async_slack_client.posted()))
+
+    def test_submitted_events_are_processed_on_the_loop(self):
+        processor = self.make_processor()
+
+        future = processor.submit_channel_event("create", CREATE_EVENT)
+        future.result(timeout=5)
+
+        self.assertEqual(1, len(self.async_slack_client.posted()))
+
+    def test_submissions_wait_when_too_many_events_are_in_flight(self):
+        self.async_slack_client.answer.clear()
+        processor = self.make_processor(max_in_flight=1)
+        processor.submit_channel_event("create", CREATE_EVENT)
+        submitted = threading.Event()
+
+        def submit_another():
+            processor.submit_channel_event("create", channel_event("CHANNELID2"))
+            submitted.set()
+
+        threading.Thread(target=submit_another).start()
+
+        self.assertFalse(submitted.wait(0.05))
+        self.async_slack_client.answer.set()
+        self.assertTrue(submitted.wait(5))
+        self.assertTrue(processor.close(timeout=5))
+        self.assertEqual(2, len(self.async_slack_client.posted()))
+
+    def test_close_waits_for_submitted_events(self):
+        self.async_slack_client.answer.clear()
+        processor = self.make_processor()
+        processor.submit_channel_event("create", CREATE_EVENT)
+
+        self.assertFalse(processor.close(timeout=0.01))
+        self.assertTrue(self.logger.error.called)
+
+        processor = self.make_processor()
+        processor.submit_channel_event("create", CREATE_EVENT)
+        threading.Timer(0.05, self.async_slack_client.answer.set).start()
+
+        self.assertTrue(processor.close(timeout=5))
+        self.assertEqual(1, len(self.async_slack_client.posted()))
+
+    def test_failed_announcement_does_not_stop_the_others(self):
+        self.async_slack_client.failing_channels.add("target1")
+        processor = self.make_processor({"target1": ["dev-"], "target2": ["dev-"]})
+
+        processor.process_channel_event("create", CREATE_EVENT)
+
+        self.assertEqual(["target1", "target2"], [call[1] for call in self.async_slack_client.posted()])
+        self.assertTrue(self.logger.error.called)
+
+    def test_announcement_without_purpose_is_remembered(self):
+        channel_info = copy.deepcopy(CHANNEL_INFO_SUCCESS)
+        channel_info["channel"]["purpose"]["value"] = ""
+        self.async_slack_client.channel_info_response = channel_info
+        processor = self.make_processor(defer_purpose=True)
+
+        processor.process_channel_event("create", CREATE_EVENT)
+
+        self.assertEqual(1, len(self.async_slack_client.posted()))
+        self.assertIsNotNone(processor.redis_client.get("pending-purpose:CHANNELID1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import toolbox
+from singleflight import AsyncSingleFlight
+from slack_client_wrapper import post_message_body, update_message_body
+from slack_dispatcher import AsyncSlackDispatcher
+from structured_log import StructuredLogger
+
+
+class AsyncSlackClientWrapper:
+    """
+    The asyncio version of SlackClientWrapper, around a slack client whose calls return awaitables
+    (slack.WebClient with run_async=True, or slack_sdk's AsyncWebClient).
+
+    All calls go through a dispatcher that keeps them within Slack's rate limits, without blocking the event loop.
+    Concurrent requests for the info of the same channel or user are made only once, and share the response.
+    """
+
+    def __init__(self, client, logger=None, dispatcher=None):
+        self.client = client
+        self.logger = logger or toolbox.null_logger()
+        self.log = StructuredLogger(self.logger)
+        self.dispatcher = dispatcher or AsyncSlackDispatcher(logger)
+        self._flights = AsyncSingleFlight("slack")
+
+    async def channel_info(self, channel_id):
+        return await self._flights.do(("conversations.info", channel_id), self._channel_info, channel_id)
+
+    async def user_info(self, user_id):
+        return await self._flights.do(("users.info", user_id), self._user_info, user_id)
+
+    async def _channel_info(self, channel_id):
+        self.log.sample("calling slack", method="conversations.info", channel=channel_id)
+        resp = await self.dispatcher.call("conversations.info",
+                                          lambda: self.client.conversations_info(channel=channel_id))
+        return resp.data if resp else None
+
+    async def _user_info(self, user_id):
+        self.log.sample("calling slack", method="users.info", user=user_id)
+        resp = await self.dispatcher.call("users.info", lambda: self.client.users_info(user=user_id))
+        return resp.data if resp else None
+
+    async def user_by_email(self, email):
+        # Only the user name: the whole email address is personal data that doesn't belong in the logs
+        self.log.sample("calling slack", method="users.lookupByEmail", user=email.partition("@")[0])
+        resp = await self.dispatcher.call("users.lookupByEmail", lambda: self.client.users_lookupByEmail(email=email))
+        return resp.data if resp else None
+
+    async def post_chat_message(self, channel_id, text=None, attachments=[], blocks=None, as_user=False):
+        self.log.sample("calling slack", method="chat.postMessage", channel=channel_id, text=text,
+                        attachments=attachments, blocks=blocks)
+        body = post_message_body(channel_id, text, attachments, blocks, as_user)
+        return await self.dispatcher.call("chat.postMessage", lambda: self.client.api_call(
+            api_method="chat.postMessage", json=body), channel=channel_id)
+
+    async def update_chat_message(self, channel_id, ts, text=None, attachments=[], blocks=None):
+        self.log.sample("calling slack", method="chat.update", channel=channel_id, ts=ts, text=text,
+                        attachments=attachments, blocks=blocks)
+        body = update_message_body(channel_id, ts, text, attachments, blocks)
+        return await self.dispatcher.call("chat.update", lambda: self.client.api_call(
+            api_method="chat.update", json=body), channel=channel_id)
@@ -0,0 +1,79 @@
+"""
+Use the store (redis, or a stand-in) from asyncio code.
+
+The redis client that this app is pinned to (redis-py 3.5) has no asyncio support, and neither do InMemoryRedis
+and SqliteRedis. AsyncStore makes each command of any of them a coroutine, by running it on a small pool of
+threads, so the event loop is never blocked by a round trip. If redis-py 4.2 or later is installed,
+connect_async_store() uses its native asyncio client instead.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Commands are short, so a few threads can keep up with thousands of events in flight
+ASYNC_STORE_THREADS = 16
+
+
+def connect_async_store(url, store):
+    """
+    Return an asyncio interface to the store at the given url, which the given (synchronous) store is connected to
+    """
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis.asyncio
+            return redis.asyncio.from_url(url)
+        except ImportError:
+            pass  # redis-py is older than 4.2
+    # Without a url, the store is in memory, and its commands are quick enough to run on the event loop
+    return AsyncStore(store, inline=not url)
+
+
+class AsyncStore:
+    """
+    Wrap a store with the redis-py interface, so that each of its commands is a coroutine.
+
+    Commands run on a pool of threads, unless inline is true, in which case they run on the event loop.
+    Pipelines work like those of redis.asyncio: commands are queued as usual, and execute() is a coroutine.
+    """
+
+    def __init__(self, store, inline=False, max_threads=ASYNC_STORE_THREADS):
+        self.store = store
+        self._executor = None if inline else ThreadPoolExecutor(max_threads, thread_name_prefix="AsyncStore")
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        async def command(*args, **kwargs):
+            return await self._run(functools.partial(method, *args, **kwargs))
+
+        return command
+
+    def pipeline(self, transaction=True):
+        return AsyncPipeline(self, self.store.pipeline(transaction=transaction))
+
+    async def _run(self, fn):
+        if self._executor is None:
+            return fn()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn)
+
+
+class AsyncPipeline:
+    """
+    Queue commands on a pipeline of the wrapped store, and run them all when execute() is awaited
+    """
+
+    def __init__(self, async_store, pipeline):
+        self._async_store = async_store
+        self._pipeline = pipeline
+
+    def __getattr__(self, name):
+        method = getattr(self._pipeline, name)
+
+        def queue_command(*args, **kwargs):
+            method(*args, **kwargs)
+            return self
+
+        return queue_command
+
+    async def execute(self):
+        return await self._async_store._run(self._pipeline.execute)
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import unittest
+
+from async_store import AsyncStore, connect_async_store
+from in_memory_redis import InMemoryRedis
+
+
+class TestAsyncStore(unittest.TestCase):
+
+    def test_commands_run_on_threads(self):
+        threads = []
+
+        class Store(InMemoryRedis):
+            def get(self, key):
+                threads.append(threading.current_thread())
+                return super().get(key)
+
+        store = AsyncStore(Store())
+
+        async def set_and_get():
+            self.assertTrue(await store.set("k", "v", nx=True))
+            self.assertFalse(await store.set("k", "w", nx=True))
+            return await store.get("k")
+
+        self.assertEqual("v", asyncio.run(set_and_get()))
+        self.assertNotEqual([threading.current_thread()], threads)
+
+    def test_inline_commands_run_on_the_loop(self):
+        threads = []
+
+        class Store(InMemoryRedis):
+            def get(self, key):
+                threads.append(threading.current_thread())
+                return super().get(key)
+
+        store = AsyncStore(Store(), inline=True)
+
+        asyncio.run(store.get("k"))
+
+        self.assertEqual([threading.current_thread()], threads)
+
+    def test_pipeline(self):
+        store = AsyncStore(InMemoryRedis())
+
+        async def run_pipeline():
+            await store.set("k", "v")
+            return await store.pipeline().get("k").delete("k").execute()
+
+        self.assertEqual(["v", 1], asyncio.run(run_pipeline()))
+        self.assertIsNone(store.store.get("k"))
+
+    def test_without_a_redis_url_the_store_is_wrapped(self):
+        store = InMemoryRedis()
+
+        async_store = connect_async_store(None, store)
+
+        self.assertIsInstance(async_store, AsyncStore)
+        self.assertIs(store, async_store.store)
+
+
+if __name__ == '__main__':
+    unittest.main()
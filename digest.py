@@ -0,0 +1,81 @@
+"""
+Coalesce bursts of announcements to the same channel into a single message.
+"""
+import logging
+import threading
+import time
+
+# Slack recommends no more than 20 attachments per message
+DIGEST_MAX_ATTACHMENTS = 20
+
+
+class DigestBuffer:
+    """
+    Buffer the announcements sent to one target channel.
+
+    The first announcement after a quiet period is sent immediately, and starts a window of the given number
+    of seconds. Any other announcements that arrive during the window are held back, and are sent together
+    as one message when the window ends (or as soon as max_attachments are waiting). So a single channel
+    creation is announced promptly, and no announcement is delayed by more than the window.
+    """
+
+    def __init__(self, target_channel, send, window, max_attachments=DIGEST_MAX_ATTACHMENTS, logger=None,
+                 clock=time.monotonic, timer_factory=threading.Timer):
+        self.target_channel = target_channel
+        self.window = window
+        self.max_attachments = max_attachments
+        self.logger = logger or logging.getLogger("DigestBuffer")
+        self._send = send
+        self._clock = clock
+        self._timer_factory = timer_factory
+        self._lock = threading.Lock()
+        self._pending = []
+        self._window_ends = 0.0
+        self._timer = None
+
+    def add(self, attachment):
+        """
+        Send the given attachment now, or hold it back for the next digest.
+
+        :return: The response from slack if the attachment was sent immediately (on its own), otherwise None
+        """
+        with self._lock:
+            now = self._clock()
+            is_quiet = now >= self._window_ends and not self._pending
+            if is_quiet:
+                self._window_ends = now + self.window
+            else:
+                self._pending.append(attachment)
+                if len(self._pending) < self.max_attachments and not self._timer:
+                    self._timer = self._timer_factory(max(0.0, self._window_ends - now), self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+            is_full = len(self._pending) >= self.max_attachments
+
+        if is_quiet:
+            return self._send(self.target_channel, [attachment])
+        if is_full:
+            self.flush()
+        return None
+
+    def flush(self):
+        """
+        Send any announcements that are being held back
+        """
+        with self._lock:
+            attachments = self._take_pending()
+            if attachments:
+                # Keep coalescing if the burst continues
+                self._window_ends = self._clock() + self.window
+
+        if attachments:
+            self.logger.info("sending digest of %d announcements to %s", len(attachments), self.target_channel)
+            return self._send(self.target_channel, attachments)
+        return None
+
+    def _take_pending(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        (attachments, self._pending) = (self._pending, [])
+        return attachments
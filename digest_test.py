@@ -0,0 +1,70 @@
+import unittest
+from mock import MagicMock
+
+from digest import DigestBuffer
+
+
+class FakeTimer:
+
+    def __init__(self, delay, fn):
+        self.delay = delay
+        self.fn = fn
+        self.cancelled = False
+
+    def start(self):
+        pass
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TestDigestBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.timers = []
+        self.send = MagicMock(return_value={"ok": True, "ts": "1.1"})
+
+    def make_digest(self, window=10, max_attachments=20):
+        def timer_factory(delay, fn):
+            self.timers.append(FakeTimer(delay, fn))
+            return self.timers[-1]
+
+        return DigestBuffer("target", self.send, window, max_attachments, logger=MagicMock(),
+                            clock=lambda: self.now, timer_factory=timer_factory)
+
+    def test_single_announcement_is_sent_immediately(self):
+        digest = self.make_digest()
+
+        self.assertEqual({"ok": True, "ts": "1.1"}, digest.add("a"))
+        self.now += 10
+        self.assertIsNotNone(digest.add("b"))
+
+        self.assertEqual([(("target", ["a"]),), (("target", ["b"]),)], [x[:1] for x in self.send.call_args_list])
+        self.assertEqual([], self.timers)
+
+    def test_burst_is_coalesced(self):
+        digest = self.make_digest()
+        digest.add("a")
+        self.now += 1
+        self.assertIsNone(digest.add("b"))
+        self.assertIsNone(digest.add("c"))
+
+        self.assertEqual(1, len(self.timers))
+        self.assertEqual(9, self.timers[0].delay)  # held back until the window ends
+        self.timers[0].fn()
+        self.send.assert_called_with("target", ["b", "c"])
+        self.assertEqual(2, self.send.call_count)
+
+    def test_full_digest_is_sent_without_waiting(self):
+        digest = self.make_digest(max_attachments=3)
+        for x in "abcd":
+            digest.add(x)
+
+        self.send.assert_called_with("target", ["b", "c", "d"])
+        self.assertTrue(self.timers[0].cancelled)
+        self.assertIsNone(digest.flush())
+
+
+if __name__ == '__main__':
+    unittest.main()
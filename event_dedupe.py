@@ -0,0 +1,66 @@
+"""
+Recognise events that Slack delivers more than once.
+
+If Slack doesn't get a response to an event quickly enough, it delivers the event again (up to 3 times,
+over about 5 minutes), with the same event_id and an X-Slack-Retry-Num header. These retries should be
+acknowledged without doing any work.
+"""
+import logging
+import threading
+
+import metrics
+
+# Slack stops retrying an event after about 5 minutes, so we don't need to remember event ids for long
+EVENT_ID_TTL_IN_SECONDS = 60 * 60
+
+EVENT_DELIVERIES = metrics.REGISTRY.counter("telltale_event_deliveries_total",
+                                            "Events received, by whether they were processed or suppressed as a "
+                                            "repeated delivery", ["outcome"])
+
+
+class EventDeduplicator:
+    """
+    Remember the ids of the events that have been accepted, for a short time
+    """
+
+    def __init__(self, redis_client, logger=None, ttl=EVENT_ID_TTL_IN_SECONDS):
+        self.redis_client = redis_client
+        self.logger = logger or logging.getLogger("EventDeduplicator")
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.suppressed = 0
+        self.retries_processed = 0
+
+    def is_first_delivery(self, event_id, retry_num=None, retry_reason=None):
+        """
+        Return True if this is the first time that the event with the given id has arrived.
+        Events without an id are always processed.
+        """
+        if not event_id:
+            return True
+
+        is_new = self.redis_client.set("event:%s" % event_id, retry_num or "0", ex=self.ttl, nx=True)
+        if is_new:
+            EVENT_DELIVERIES.inc(outcome="processed")
+            if retry_num:
+                # We missed the original delivery (e.g. the process was restarted), so this retry is still useful
+                with self._lock:
+                    self.retries_processed += 1
+                self.logger.info("processing retry %s of event %s (%s)", retry_num, event_id, retry_reason)
+            return True
+
+        EVENT_DELIVERIES.inc(outcome="suppressed")
+        with self._lock:
+            self.suppressed += 1
+        self.logger.info("ignored... already received event %s (retry %s: %s)", event_id, retry_num, retry_reason)
+        return False
+
+    def forget(self, event_id):
+        """
+        Forget that the given event arrived (e.g. because it couldn't be processed), so a retry will be processed
+        """
+        if event_id:
+            self.redis_client.delete("event:%s" % event_id)
+
+    def stats(self):
+        return {"suppressed": self.suppressed, "retries_processed": self.retries_processed}
@@ -0,0 +1,54 @@
+import unittest
+from mock import MagicMock
+
+from event_dedupe import EventDeduplicator
+from in_memory_redis import InMemoryRedis
+
+
+class TestEventDeduplicator(unittest.TestCase):
+
+    def test_retries_are_suppressed(self):
+        deduplicator = EventDeduplicator(InMemoryRedis(), MagicMock())
+
+        self.assertTrue(deduplicator.is_first_delivery("Ev1"))
+        self.assertFalse(deduplicator.is_first_delivery("Ev1", "1", "http_timeout"))
+        self.assertFalse(deduplicator.is_first_delivery("Ev1", "2", "http_timeout"))
+        self.assertTrue(deduplicator.is_first_delivery("Ev2"))
+
+        self.assertEqual({"suppressed": 2, "retries_processed": 0}, deduplicator.stats())
+
+    def test_retry_of_unseen_event_is_processed(self):
+        deduplicator = EventDeduplicator(InMemoryRedis(), MagicMock())
+
+        self.assertTrue(deduplicator.is_first_delivery("Ev1", "1", "http_timeout"))
+
+        self.assertEqual({"suppressed": 0, "retries_processed": 1}, deduplicator.stats())
+
+    def test_forgotten_event_can_be_retried(self):
+        deduplicator = EventDeduplicator(InMemoryRedis(), MagicMock())
+        self.assertTrue(deduplicator.is_first_delivery("Ev1"))
+
+        deduplicator.forget("Ev1")
+
+        self.assertTrue(deduplicator.is_first_delivery("Ev1", "1", "http_timeout"))
+
+    def test_event_ids_expire(self):
+        now = [0.0]
+        deduplicator = EventDeduplicator(InMemoryRedis(clock=lambda: now[0]), MagicMock(), ttl=60)
+        self.assertTrue(deduplicator.is_first_delivery("Ev1"))
+
+        now[0] += 61
+
+        self.assertTrue(deduplicator.is_first_delivery("Ev1"))
+
+    def test_events_without_ids_are_processed(self):
+        redis = MagicMock()
+        deduplicator = EventDeduplicator(redis, MagicMock())
+
+        self.assertTrue(deduplicator.is_first_delivery(None))
+        self.assertTrue(deduplicator.is_first_delivery(None))
+        self.assertFalse(redis.set.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+"""
+A local stand-in for the parts of the Slack Web API that the app uses, for load testing without touching Slack.
+
+    > python fake_slack_server.py [--port 3001] [--latency-ms 20] [--jitter-ms 5] [--rate-scale 1.0]
+                                  [--users 5000] [--page-size 200] [--channel-prefix load-]
+
+Then point the app at it with SLACK_API_URL=http://localhost:3001/api/
+
+It implements conversations.info, users.info, users.lookupByEmail, users.list (paginated), chat.postMessage and
+chat.update. Every call waits for the given latency (plus or minus the jitter). Each method has a token bucket
+sized like Slack's rate limit tier (multiplied by --rate-scale, or unlimited if that is 0), and calls beyond the
+limit get HTTP 429 with a Retry-After header, just like the real thing.
+
+Channels don't need to be created first: the name of any channel is the channel prefix followed by its id in
+lower case. GET /stats returns the number of calls, and of rate limited calls, for each method.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from slack_dispatcher import METHOD_TIERS, SPECIAL_METHOD_RATES, TIER_3, TokenBucket
+
+
+class FakeSlack:
+    """
+    The state of the fake workspace, and the implementation of each API method
+    """
+
+    def __init__(self, users=5000, page_size=200, channel_prefix="load-", latency=0.0, jitter=0.0, rate_scale=1.0):
+        self.users = [{"id": "U%07d" % i, "name": "user.%d" % i, "deleted": False,
+                       "profile": {"real_name_normalized": "User %d" % i, "display_name": "user.%d" % i,
+                                   "image_32": ""}}
+                      for i in range(users)]
+        self.page_size = page_size
+        self.channel_prefix = channel_prefix
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_scale = rate_scale
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._ts = 0
+        self.calls = {}
+        self.rate_limited = {}
+        self.methods = {
+            "conversations.info": self.conversations_info,
+            "users.info": self.users_info,
+            "users.lookupByEmail": self.users_lookup_by_email,
+            "users.list": self.users_list,
+            "chat.postMessage": self.chat_post_message,
+            "chat.update": self.chat_update,
+        }
+
+    def call(self, method, args):
+        """
+        :return: (http status, headers, body)
+        """
+        fn = self.methods.get(method)
+        if not fn:
+            return 404, {}, {"ok": False, "error": "unknown_method"}
+
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            wait = self._bucket(method).take() if self.rate_scale else 0
+            if wait:
+                self.rate_limited[method] = self.rate_limited.get(method, 0) + 1
+        if wait:
+            return 429, {"Retry-After": str(max(1, int(round(wait))))}, {"ok": False, "error": "ratelimited"}
+
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        if delay:
+            time.sleep(delay)
+        return 200, {}, fn(args)
+
+    def stats(self):
+        with self._lock:
+            return {"calls": dict(self.calls), "rate_limited": dict(self.rate_limited)}
+
+    def conversations_info(self, args):
+        channel_id = args.get("channel", "")
+        return {"ok": True, "channel": {
+            "id": channel_id,
+            "name": self.channel_prefix + channel_id.lower(),
+            "creator": self.users[zlib.crc32(channel_id.encode()) % len(self.users)]["id"],
+            "created": int(time.time()),
+            "members": [],
+            "purpose": {"value": "Load testing %s" % channel_id},
+        }}
+
+    def users_info(self, args):
+        user = self._find_user(args.get("user"))
+        return {"ok": True, "user": dict(user, tz_offset=0)} if user else {"ok": False, "error": "user_not_found"}
+
+    def users_lookup_by_email(self, args):
+        name = (args.get("email") or "").split("@")[0]
+        user = next((x for x in self.users if x["name"] == name), None)
+        return {"ok": True, "user": user} if user else {"ok": False, "error": "users_not_found"}
+
+    def users_list(self, args):
+        start = int(args.get("cursor") or 0)
+        limit = min(int(args.get("limit") or self.page_size), self.page_size)
+        next_cursor = str(start + limit) if start + limit < len(self.users) else ""
+        return {"ok": True, "members": self.users[start:start + limit],
+                "response_metadata": {"next_cursor": next_cursor}}
+
+    def chat_post_message(self, args):
+        return {"ok": True, "channel": args.get("channel"), "ts": self._next_ts()}
+
+    def chat_update(self, args):
+        return {"ok": True, "channel": args.get("channel"), "ts": args.get("ts")}
+
+    def _find_user(self, user_id):
+        try:
+            return self.users[int((user_id or "")[1:])]
+        except (ValueError, IndexError):
+            return None
+
+    def _next_ts(self):
+        with self._lock:
+            self._ts += 1
+            return "%d.%06d" % (time.time(), self._ts % 1000000)
+
+    def _bucket(self, method):
+        bucket = self._buckets.get(method)
+        if bucket is None:
+            per_minute = (METHOD_TIERS.get(method) or SPECIAL_METHOD_RATES.get(method) or TIER_3) * self.rate_scale
+            bucket = self._buckets[method] = TokenBucket(per_minute / 60.0, max(1, per_minute))
+        return bucket
+
+
+def make_handler(fake_slack):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/stats":
+                self._respond(200, {}, fake_slack.stats())
+            else:
+                self._call(url.path, dict(parse_qsl(url.query)))
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode("utf-8") if length else ""
+            if (self.headers.get("Content-Type") or "").startswith("application/json"):
+                args = json.loads(body or "{}")
+            else:
+                args = dict(parse_qsl(body))
+            args.update(parse_qsl(url.query))
+            self._call(url.path, args)
+
+        def _call(self, path, args):
+            (status, headers, body) = fake_slack.call(path.rstrip("/").split("/")[-1], args)
+            self._respond(status, headers, body)
+
+        def _respond(self, status, headers, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for (name, value) in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A local stand-in for the Slack Web API")
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latency of each call")
+    parser.add_argument("--jitter-ms", type=float, default=5.0, help="random variation of the latency")
+    parser.add_argument("--rate-scale", type=float, default=1.0,
+                        help="multiply Slack's rate limits by this (0 means no rate limits)")
+    parser.add_argument("--users", type=int, default=5000, help="number of users in the workspace")
+    parser.add_argument("--page-size", type=int, default=200, help="maximum users in each page of users.list")
+    parser.add_argument("--channel-prefix", default="load-", help="the start of every channel's name")
+    args = parser.parse_args()
+
+    fake_slack = FakeSlack(args.users, args.page_size, args.channel_prefix, args.latency_ms / 1000.0,
+                           args.jitter_ms / 1000.0, args.rate_scale)
+    server = ThreadingHTTPServer(("localhost", args.port), make_handler(fake_slack))
+    print("fake slack listening on http://localhost:%d/api/" % args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,41 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+# The maximum number of expired keys that are swept away by each write. This spreads the cost
+# of expiring a large number of keys over many writes, rather than stalling a single one.
+PURGE_BATCH_SIZE = 100
+
+
 class InMemoryRedis:
     """
     This class like an in-memory version of Redis.
 
-    Useful for unit tests or if Redis isn't available
+    Useful for unit tests or if Redis isn't available.
+
+    It implements the subset of the redis-py interface that this app uses, so the rest of the code
+    can be written as if it is always talking to Redis, including pipelines.
+
+    Hashes are stored as dicts, so a key can't be used as both a string and a hash.
+
+    Keys with a time to live really do expire. Expired keys are removed when they are accessed, and
+    a min-heap of expiry times lets each write cheaply sweep away any keys that have expired since.
+    If max_entries is given, the least recently used keys are evicted to stay within that limit.
     """
 
-    def __init__(self):
-        self._cache = {}
+    def __init__(self, max_entries=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()  # key -> value, least recently used first
+        self._expiry = {}  # key -> time when the key expires
+        self._expiry_heap = []  # (time when the key expires, key). May contain stale entries
+
+    def __len__(self):
+        with self._lock:
+            self._purge_expired(limit=None)
+            return len(self._cache)
 
     def get(self, key):
         """
@@ -14,17 +43,49 @@ class InMemoryRedis:
         :param key:
         :return: The associated value or none
         """
-        return self._cache.get(key)
+        with self._lock:
+            if self._is_expired(key):
+                self._remove(key)
+                return None
+            value = self._cache.get(key)
+            if value is not None and self.max_entries:
+                self._cache.move_to_end(key)
+            return value
 
-    def set(self, key, value):
+    def mget(self, keys):
+        """
+        Return the values associated with each of the given keys (None for keys that don't exist)
+        :param keys:
+        :return: List of values, in the same order as the keys
+        """
+        with self._lock:
+            return [self.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
         """
         Set the given key to have the given value
         :param key:
         :param value:
-        :return: Return true if key is set to the value
+        :param ex: If given, the time to live for the key (in seconds)
+        :param nx: If true, only set the key if it doesn't already exist
+        :return: Return true if key is set to the value, None otherwise (just like redis)
         """
-        self._cache[key] = value
-        return True
+        with self._lock:
+            self._purge_expired()
+            if self._is_expired(key):
+                self._remove(key)  # the sweep above may not have reached it yet
+            if key in self._cache:
+                if nx:
+                    return None
+                self._cache.move_to_end(key)
+            self._cache[key] = value
+            self._expiry.pop(key, None)  # just like redis, setting a key clears its time to live
+            if ex:
+                self.expire(key, ex)
+            if self.max_entries:
+                while len(self._cache) > self.max_entries:
+                    self._remove(next(iter(self._cache)))
+            return True
 
     def setnx(self, key, value):
         """
@@ -33,10 +94,80 @@ class InMemoryRedis:
         :param value:
         :return: Return true if key is set to the value
         """
-        if key in self._cache:
-            return False
-        self._cache[key] = value
-        return True
+        return bool(self.set(key, value, nx=True))
+
+    def delete(self, *keys):
+        """
+        Remove the given keys
+        :param keys:
+        :return: The number of keys that were removed
+        """
+        with self._lock:
+            return len([key for key in keys if self.get(key) is not None and self._remove(key)])
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        """
+        Set fields of the hash stored at the given name (creating it if needed)
+        :param name:
+        :param key: If given, the field to set to value
+        :param value:
+        :param mapping: If given, a dict of more fields and their values
+        :return: The number of fields that were added (just like redis)
+        """
+        fields = dict(mapping or {})
+        if key is not None:
+            fields[key] = value
+        with self._lock:
+            fields_hash = self.get(name)
+            if fields_hash is None:
+                fields_hash = {}
+                self.set(name, fields_hash)
+            added = len([field for field in fields if field not in fields_hash])
+            fields_hash.update(fields)
+            return added
+
+    def hget(self, name, key):
+        """
+        Return the value of the given field of the hash stored at the given name, or None if it doesn't exist
+        """
+        return self.hmget(name, [key])[0]
+
+    def hmget(self, name, keys, *args):
+        """
+        Return the values of the given fields of the hash stored at the given name (None for fields that don't exist)
+        :param name:
+        :param keys: List of fields. More fields can be given as extra arguments (just like redis-py)
+        :return: List of values, in the same order as the fields
+        """
+        with self._lock:
+            fields_hash = self.get(name) or {}
+            return [fields_hash.get(key) for key in list(keys) + list(args)]
+
+    def hgetall(self, name):
+        """
+        Return a dict of all the fields of the hash stored at the given name (empty if it doesn't exist)
+        """
+        with self._lock:
+            return dict(self.get(name) or {})
+
+    def rename(self, src, dst):
+        """
+        Rename the key src to dst, replacing dst if it exists. The time to live of src goes with it (just like redis)
+        :param src:
+        :param dst:
+        :return: True, or raise KeyError if src doesn't exist
+        """
+        with self._lock:
+            value = self.get(src)
+            if value is None:
+                raise KeyError("no such key: %s" % src)
+            when = self._expiry.get(src)
+            self._remove(src)
+            self.set(dst, value)
+            if when is not None:
+                self._expiry[dst] = when
+                heapq.heappush(self._expiry_heap, (when, dst))
+            return True
 
     def expire(self, key, ttl):
         """
@@ -44,7 +175,94 @@ class InMemoryRedis:
 
         :param key:
         :param ttl:
-        :return: True to indicate success
+        :return: True if the key exists and its time to live was set
+        """
+        with self._lock:
+            if self.get(key) is None:
+                return False
+            when = self._clock() + ttl
+            self._expiry[key] = when
+            heapq.heappush(self._expiry_heap, (when, key))
+            return True
+
+    def ttl(self, key):
+        """
+        Return the number of seconds until the given key expires.
+        :param key:
+        :return: -2 if the key doesn't exist, -1 if it doesn't expire (just like redis)
+        """
+        with self._lock:
+            if self.get(key) is None:
+                return -2
+            when = self._expiry.get(key)
+            return -1 if when is None else max(0, int(round(when - self._clock())))
+
+    def pipeline(self, transaction=True):
         """
-        # This is a no-op
+        Return an object that queues commands and runs them all when execute() is called
+        """
+        return InMemoryPipeline(self)
+
+    def _transaction(self):
+        return self._lock
+
+    def _is_expired(self, key):
+        when = self._expiry.get(key)
+        return when is not None and when <= self._clock()
+
+    def _remove(self, key):
+        self._cache.pop(key, None)
+        self._expiry.pop(key, None)
         return True
+
+    def _purge_expired(self, limit=PURGE_BATCH_SIZE):
+        """
+        Remove (up to limit) keys whose time has come. Heap entries for keys that have been deleted,
+        or whose time to live has since changed, are just discarded.
+        """
+        heap = self._expiry_heap
+        now = self._clock()
+        while heap and heap[0][0] <= now and limit != 0:
+            (when, key) = heapq.heappop(heap)
+            if self._expiry.get(key) == when:
+                self._remove(key)
+                limit = limit - 1 if limit else limit
+
+        # Don't let stale entries make the heap grow without bound
+        if len(heap) > 2 * len(self._expiry) + 1024:
+            self._expiry_heap = [(when, key) for (key, when) in self._expiry.items()]
+            heapq.heapify(self._expiry_heap)
+
+
+class InMemoryPipeline:
+    """
+    Like a redis pipeline: commands are queued, and their results are returned by execute()
+    """
+
+    def __init__(self, redis_client):
+        self._redis_client = redis_client
+        self._commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._redis_client, name)
+
+        def queue_command(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+
+        return queue_command
+
+    def execute(self):
+        """
+        Run all the queued commands, as a single atomic step
+        :return: List of the results of each command
+        """
+        (commands, self._commands) = (self._commands, [])
+        with self._redis_client._transaction():
+            return [method(*args, **kwargs) for (method, args, kwargs) in commands]
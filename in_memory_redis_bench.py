@@ -0,0 +1,55 @@
+"""
+Benchmark the throughput of InMemoryRedis with a million keys.
+
+    > python in_memory_redis_bench.py [number_of_keys]
+"""
+import sys
+import time
+
+from in_memory_redis import InMemoryRedis
+
+CHANNEL_INFO_TTL_IN_SECONDS = 60 * (24 * 60 * 60)
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print("%-45s %10.0f ops/sec  (%.2f seconds)" % (label, count / elapsed, elapsed))
+
+
+def run(label, redis, keys):
+    print(label)
+    timed("  set(nx=True, ex=...) new keys", len(keys),
+          lambda: [redis.set(key, "1", ex=CHANNEL_INFO_TTL_IN_SECONDS, nx=True) for key in keys])
+    timed("  set(nx=True, ex=...) existing keys", len(keys),
+          lambda: [redis.set(key, "1", ex=CHANNEL_INFO_TTL_IN_SECONDS, nx=True) for key in keys])
+    timed("  setnx existing keys", len(keys), lambda: [redis.setnx(key, "1") for key in keys])
+    timed("  get", len(keys), lambda: [redis.get(key) for key in keys])
+    print("  keys held: %d" % len(redis))
+
+
+def run_expiry(keys):
+    now = [0.0]
+    redis = InMemoryRedis(clock=lambda: now[0])
+    for key in keys:
+        redis.set(key, "1", ex=60)
+    now[0] += 60
+    writes = len(keys) // 100
+    timed("  writes, each sweeping up to 100 expired keys", writes,
+          lambda: [redis.set("new:%d" % i, "1") for i in range(writes)])
+    timed("  len() purges all remaining expired keys", 1, lambda: len(redis))
+    print("  keys held: %d" % len(redis))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    keys = ["channel:C%08d" % i for i in range(count)]
+    run("unbounded", InMemoryRedis(), keys)
+    run("max_entries=%d" % (count // 10), InMemoryRedis(max_entries=count // 10), keys)
+    print("expiry")
+    run_expiry(keys)
+
+
+if __name__ == "__main__":
+    main()
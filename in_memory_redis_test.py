@@ -0,0 +1,121 @@
+import threading
+import unittest
+
+from in_memory_redis import PURGE_BATCH_SIZE, InMemoryRedis
+
+
+class TestInMemoryRedis(unittest.TestCase):
+
+    def test_set_nx(self):
+        redis = InMemoryRedis()
+
+        self.assertTrue(redis.set("key", "first", ex=10, nx=True))
+        self.assertIsNone(redis.set("key", "second", ex=10, nx=True))
+        self.assertEqual("first", redis.get("key"))
+        self.assertFalse(redis.setnx("key", "third"))
+
+    def test_pipeline(self):
+        redis = InMemoryRedis()
+        redis.set("a", "1")
+
+        pipeline = redis.pipeline()
+        pipeline.set("b", "2", ex=10)
+        pipeline.get("a").delete("a")
+
+        self.assertIsNone(redis.get("b"))  # nothing happens until the pipeline is executed
+        self.assertEqual([True, "1", 1], pipeline.execute())
+        self.assertEqual([None, "2", None], redis.mget(["a", "b", "c"]))
+        self.assertEqual([], pipeline.execute())
+
+    def test_hash(self):
+        now = [1000.0]
+        redis = InMemoryRedis(clock=lambda: now[0])
+
+        self.assertEqual(2, redis.hset("users", mapping={"fred.hole": "UFRED", "joe.bloggs": "UJOE"}))
+        self.assertEqual(0, redis.hset("users", "fred.hole", "UFRED2"))
+        self.assertEqual(["UFRED2", None, "UJOE"], redis.hmget("users", ["fred.hole", "no.body"], "joe.bloggs"))
+        self.assertEqual("UJOE", redis.hget("users", "joe.bloggs"))
+        self.assertEqual([None], redis.hmget("missing", ["fred.hole"]))
+
+        redis.expire("users", 10)
+        now[0] += 10
+        self.assertEqual([None], redis.hmget("users", ["fred.hole"]))
+        self.assertEqual(-2, redis.ttl("users"))
+
+    def test_keys_expire(self):
+        now = [1000.0]
+        redis = InMemoryRedis(clock=lambda: now[0])
+        redis.set("short", "1", ex=10)
+        redis.set("long", "2", ex=100)
+        redis.set("forever", "3")
+
+        self.assertEqual(10, redis.ttl("short"))
+        self.assertEqual(-1, redis.ttl("forever"))
+        now[0] += 10
+        self.assertIsNone(redis.get("short"))
+        self.assertEqual(-2, redis.ttl("short"))
+        self.assertTrue(redis.setnx("short", "again"))  # an expired key can be set again
+        self.assertEqual(3, len(redis))
+        now[0] += 90
+        self.assertEqual(["again", None, "3"], redis.mget(["short", "long", "forever"]))
+
+    def test_expired_keys_are_purged_without_being_accessed(self):
+        now = [1000.0]
+        redis = InMemoryRedis(clock=lambda: now[0])
+        for i in range(100):
+            redis.set("channel:%d" % i, "x", ex=60)
+        now[0] += 60
+        redis.set("new", "y")
+
+        self.assertEqual(1, len(redis._cache))
+
+    def test_expired_key_can_be_set_before_it_is_purged(self):
+        now = [1000.0]
+        redis = InMemoryRedis(clock=lambda: now[0])
+        for i in range(3 * PURGE_BATCH_SIZE):
+            redis.set("channel:%d" % i, "x", ex=1)
+        now[0] += 1
+        last = "channel:%d" % (3 * PURGE_BATCH_SIZE - 1)
+
+        self.assertTrue(redis.set(last, "new", ex=1, nx=True))
+        self.assertEqual("new", redis.get(last))
+
+    def test_setting_a_key_clears_its_ttl(self):
+        now = [1000.0]
+        redis = InMemoryRedis(clock=lambda: now[0])
+        redis.set("key", "1", ex=10)
+        redis.set("key", "2")
+        now[0] += 10
+
+        self.assertEqual("2", redis.get("key"))
+
+    def test_least_recently_used_keys_are_evicted(self):
+        redis = InMemoryRedis(max_entries=2)
+        redis.set("a", "1")
+        redis.set("b", "2")
+        redis.get("a")
+        redis.set("c", "3")
+
+        self.assertEqual(["1", None, "3"], redis.mget(["a", "b", "c"]))
+        self.assertEqual(2, len(redis))
+
+    def test_setnx_is_thread_safe(self):
+        redis = InMemoryRedis()
+        winners = []
+
+        def race(thread_id):
+            for i in range(1000):
+                if redis.setnx("channel:%d" % i, thread_id):
+                    winners.append(i)
+
+        threads = [threading.Thread(target=race, args=(x,)) for x in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(list(range(1000)), sorted(winners))
+
+
+if __name__ == '__main__':
+    unittest.main()
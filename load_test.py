@@ -0,0 +1,219 @@
+"""
+Load test the whole app over HTTP: signature checking of events, the work queue, the Processor, and the calls
+to Slack (which go to fake_slack_server.py rather than the real Slack).
+
+    > python fake_slack_server.py --port 3001 &
+    > SLACK_API_URL=http://localhost:3001/api/ CHANNEL_PREFIXES=load- SLACK_SIGNING_SECRET=load-test \\
+      SLACK_VERIFICATION_TOKEN=load-test SLACK_BOT_TOKEN=xoxb-load-test TARGET_CHANNEL_ID=#load-test \\
+      gunicorn app:app --bind localhost:3000 --workers 2 --threads 4 &
+    > python load_test.py --url http://localhost:3000 --rate 50 --seconds 30
+
+Requests are sent at the target rate (an open loop: a slow response doesn't delay the next request), in the
+given mix of channel events, /interactive button clicks and /clippyslashcmd slash commands. Channel events are
+signed with SLACK_SIGNING_SECRET, and a fraction of them repeat a channel that was already sent (as Slack does).
+
+The report shows, for each endpoint, the throughput, the error rate and the latency percentiles, followed by the
+calls that reached the fake Slack (if --slack-url is given).
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+DEFAULT_MIX = "events=8,interactive=1,slash=1"
+
+
+def sign(signing_secret, timestamp, body):
+    """
+    Sign a request in the same way as Slack: https://api.slack.com/authentication/verifying-requests-from-slack
+    """
+    base = ("v0:%s:%s" % (timestamp, body)).encode("utf-8")
+    return "v0=" + hmac.new(signing_secret.encode("utf-8"), base, hashlib.sha256).hexdigest()
+
+
+class RequestFactory:
+    """
+    Makes the requests for each endpoint, as (path, body, headers)
+    """
+
+    def __init__(self, signing_secret, verification_token, channel_prefix, duplicate_ratio, seed=42):
+        self.signing_secret = signing_secret
+        self.verification_token = verification_token
+        self.channel_prefix = channel_prefix
+        self.duplicate_ratio = duplicate_ratio
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._run_id = uuid.uuid4().hex[:6].upper()
+        self._channels = []
+
+    def events(self):
+        with self._lock:
+            if self._channels and self._rng.random() < self.duplicate_ratio:
+                channel_id = self._rng.choice(self._channels)
+            else:
+                channel_id = "C%s%06d" % (self._run_id, len(self._channels))
+                self._channels.append(channel_id)
+        now = int(time.time())
+        body = json.dumps({
+            "token": self.verification_token,
+            "type": "event_callback",
+            "event_id": "Ev" + uuid.uuid4().hex[:10].upper(),
+            "event_time": now,
+            "event": {
+                "type": "channel_created",
+                "event_ts": "%d.000100" % now,
+                "channel": {"id": channel_id, "name": self.channel_prefix + channel_id.lower(), "created": now,
+                            "creator": "U0000001", "is_channel": True},
+            },
+        })
+        timestamp = str(now)
+        headers = {
+            "Content-Type": "application/json",
+            "X-Slack-Request-Timestamp": timestamp,
+            "X-Slack-Signature": sign(self.signing_secret, timestamp, body),
+        }
+        return "/slack/events", body, headers
+
+    def interactive(self):
+        with self._lock:
+            action = self._rng.choice(["click_gtw", "click_chess", "click_civ", "click_die", "click_um"])
+        payload = {
+            "token": self.verification_token,
+            "actions": [{"value": action}],
+            "channel": {"id": "CLOADTEST"},
+            "container": {"message_ts": "%.6f" % time.time()},
+            "user": {"id": "U0000001", "name": "user.1"},
+        }
+        return "/interactive", urlencode({"payload": json.dumps(payload)}), \
+            {"Content-Type": "application/x-www-form-urlencoded"}
+
+    def slash(self):
+        with self._lock:
+            text = self._rng.choice(["1", "2", ""])
+        payload = {"token": self.verification_token, "text": text}
+        return "/clippyslashcmd", urlencode({"payload": json.dumps(payload)}), \
+            {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+class Results:
+    """
+    The outcome of every request, for each endpoint
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, endpoint, latency, is_error):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            if is_error:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self, elapsed):
+        print("%-18s %8s %10s %8s %10s %10s %10s" % ("endpoint", "requests", "req/s", "errors", "p50 ms", "p95 ms",
+                                                     "p99 ms"))
+        for (endpoint, latencies) in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            errors = self.errors.get(endpoint, 0)
+            print("%-18s %8d %10.1f %7.1f%% %10.1f %10.1f %10.1f" % (
+                endpoint, len(latencies), len(latencies) / elapsed, 100.0 * errors / len(latencies),
+                percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))]
+
+
+def parse_mix(mix):
+    """
+    Parse "events=8,interactive=1" into a list of (endpoint, weight)
+    """
+    weights = []
+    for part in mix.split(","):
+        (endpoint, weight) = part.split("=")
+        weights.append((endpoint.strip(), float(weight)))
+    return weights
+
+
+def send(base_url, endpoint, request, results, timeout):
+    (path, body, headers) = request
+    start = time.perf_counter()
+    try:
+        with urlopen(Request(base_url + path, data=body.encode("utf-8"), headers=headers, method="POST"),
+                     timeout=timeout) as response:
+            response.read()
+            is_error = response.status >= 400
+    except HTTPError as e:
+        is_error = True
+        e.read()
+    except Exception:
+        is_error = True
+    results.record(endpoint, time.perf_counter() - start, is_error)
+
+
+def run(args):
+    factory = RequestFactory(args.signing_secret, args.verification_token, args.channel_prefix, args.duplicate_ratio)
+    mix = parse_mix(args.mix)
+    (endpoints, weights) = zip(*mix)
+    rng = random.Random(1)
+    results = Results()
+    total = int(args.rate * args.seconds)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for i in range(total):
+            # Open loop: each request is sent at its scheduled time, however long the earlier ones are taking
+            delay = start + i / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint = rng.choices(endpoints, weights)[0]
+            request = getattr(factory, endpoint)()
+            executor.submit(send, args.url.rstrip("/"), endpoint, request, results, args.timeout)
+    elapsed = time.perf_counter() - start
+
+    print("%d requests in %.1f seconds (target %.1f req/s)" % (total, elapsed, args.rate))
+    print()
+    results.report(elapsed)
+
+    if args.slack_url:
+        with urlopen(args.slack_url.rstrip("/") + "/stats", timeout=args.timeout) as response:
+            stats = json.loads(response.read())
+        print()
+        print("%-22s %8s %12s" % ("slack method", "calls", "rate limited"))
+        for (method, calls) in sorted(stats["calls"].items()):
+            print("%-22s %8d %12d" % (method, calls, stats["rate_limited"].get(method, 0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the app over HTTP")
+    parser.add_argument("--url", default="http://localhost:3000", help="where the app is running")
+    parser.add_argument("--slack-url", default="http://localhost:3001",
+                        help="where fake_slack_server.py is running, to report its stats ('' to skip)")
+    parser.add_argument("--rate", type=float, default=20.0, help="requests per second")
+    parser.add_argument("--seconds", type=float, default=30.0, help="how long to send requests for")
+    parser.add_argument("--concurrency", type=int, default=64, help="maximum requests in flight")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="relative weights of the endpoints")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1,
+                        help="fraction of channel events that repeat an earlier channel")
+    parser.add_argument("--channel-prefix", default="load-", help="must match CHANNEL_PREFIXES of the app")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for each response")
+    parser.add_argument("--signing-secret", default=os.getenv("SLACK_SIGNING_SECRET", "load-test"))
+    parser.add_argument("--verification-token", default=os.getenv("SLACK_VERIFICATION_TOKEN", "load-test"))
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Message templates that are parsed once, when they are registered, rather than every time a message is made.
+
+A template is a dict of message attachment fields whose values are str.format() style strings, e.g.
+{"title": "<#{channel_id}>", "footer": "..."}. Compiling it splits each string into its literal text and
+its placeholders, and fields without any placeholders are kept as they are. Rendering then just joins the
+pieces, and messages rendered from the same template and values share all their strings.
+
+    ANNOUNCEMENT = register("announcement", {"title": "<#{channel_id}>", ...})
+    message = ANNOUNCEMENT.render(values, color="#ff1744")
+"""
+from string import Formatter
+
+_registry = {}
+
+
+class CompiledTemplate:
+    """
+    A message template, parsed into the pieces needed to render it
+    """
+
+    def __init__(self, name, template):
+        self.name = name
+        self.fields = []  # list of (key, constant string or None, list of pieces)
+        self.placeholders = set()
+        for (key, value) in template.items():
+            pieces = list(_parse(value))
+            if all(field_name is None for (_, field_name, _, _) in pieces):
+                self.fields.append((key, value, None))
+            else:
+                self.fields.append((key, None, pieces))
+                self.placeholders.update(field_name for (_, field_name, _, _) in pieces if field_name is not None)
+
+    def render(self, values, **overrides):
+        """
+        Make a message from the template, with the given values for its placeholders.
+        Any overrides (e.g. a color) are added to the message as they are.
+        """
+        message = {}
+        for (key, constant, pieces) in self.fields:
+            if pieces is None:
+                message[key] = constant
+            elif len(pieces) == 1 and not pieces[0][0]:
+                (_, field_name, spec, conversion) = pieces[0]
+                message[key] = _format(values[field_name], spec, conversion)
+            else:
+                message[key] = "".join(literal if field_name is None else literal + _format(values[field_name],
+                                                                                             spec, conversion)
+                                       for (literal, field_name, spec, conversion) in pieces)
+        if overrides:
+            message.update(overrides)
+        return message
+
+
+def _parse(value):
+    """
+    Split a str.format() string into (literal, field name, format spec, conversion) pieces.
+    The field name is None for a trailing literal.
+    """
+    for (literal, field_name, spec, conversion) in Formatter().parse(value):
+        yield (literal, field_name, spec or "", conversion)
+
+
+def _format(value, spec, conversion):
+    if conversion == "r":
+        value = repr(value)
+    elif conversion == "s":
+        value = str(value)
+    elif conversion == "a":
+        value = ascii(value)
+    return value if type(value) is str and not spec else format(value, spec)
+
+
+def register(name, template):
+    """
+    Compile the given template, and remember it under the given name
+    """
+    compiled = CompiledTemplate(name, template)
+    _registry[name] = compiled
+    return compiled
+
+
+def get(name):
+    """
+    Return the compiled template that was registered with the given name
+    """
+    return _registry[name]
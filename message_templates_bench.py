@@ -0,0 +1,89 @@
+"""
+Micro-benchmark comparing the compiled message templates with building the template dict and running
+str.format over every field, for every message (which is what the Processor used to do).
+
+    > python message_templates_bench.py [number_of_fomo_users]
+
+The FOMO direct messages are the interesting case: every recipient gets the same message, apart from its color.
+The old way built and formatted it again for each recipient. The compiled way renders it once per channel and
+gives each recipient a shallow copy.
+"""
+import random
+import sys
+import timeit
+import tracemalloc
+
+from processor import COLORS, FOMO_DIRECT_MESSAGE
+from toolbox import nested_get
+
+CHANNEL = {"id": "CD1USGKT7", "name": "dev-so-trial-notify", "purpose": {"value": "Discuss the trial notifications"}}
+CREATOR = {"id": "U0BPCEYR4", "profile": {"real_name_normalized": "Fred Hole", "display_name": "fred.hole",
+                                          "image_32": "https://example.com/fred.png"}}
+
+
+def message_values(channel, creator, event_type):
+    return {
+        "creator_id": nested_get(creator, "enterprise_user", "id") or nested_get(creator, "id"),
+        "creator_name": nested_get(creator, "profile", "real_name_normalized"),
+        "creator_image": nested_get(creator, "profile", "image_32"),
+        "creator_display_name": nested_get(creator, "profile", "display_name"),
+        "channel_id": nested_get(channel, "id"),
+        "channel_name": nested_get(channel, "name"),
+        "channel_purpose": nested_get(channel, "purpose", "value"),
+        "rename_msg": "(via renaming)" if event_type == "rename" else ""
+    }
+
+
+def formatted_every_time(recipients):
+    messages = []
+    for _ in range(recipients):
+        message = {
+            "color": random.choice(COLORS),
+            "pretext": "*FOMO sufferers of the world rejoice!* :tada: \n<@{creator_display_name}> has created a group that you might want to join",
+            "title": "<#{channel_id}|{channel_name}>",
+            "text": "{channel_purpose}",
+            "footer": "If you don't want to be notified about these, please message <@phillip.piper> and he will remove you",
+            "footer_icon": "https://qresolve.files.wordpress.com/2015/02/information-icon.png"
+        }
+        values = message_values(CHANNEL, CREATOR, "")
+        fancy_message = {key: value.format(**values) for (key, value) in message.items()}
+        text = fancy_message.pop("pretext")
+        messages.append((text, [fancy_message]))
+    return messages
+
+
+def compiled_once(recipients):
+    direct_message = FOMO_DIRECT_MESSAGE.render(message_values(CHANNEL, CREATOR, ""))
+    text = direct_message.pop("pretext")
+    return [(text, [dict(direct_message, color=random.choice(COLORS))]) for _ in range(recipients)]
+
+
+def allocations(fn, recipients):
+    """
+    Return the peak number of bytes allocated by fn (including temporary objects), and the number of bytes
+    and of blocks that are still held by the messages it returns
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    (start, _) = tracemalloc.get_traced_memory()
+    result = fn(recipients)
+    (_, peak) = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    del result
+    return peak - start, sum(x.size_diff for x in stats), sum(x.count_diff for x in stats)
+
+
+def main():
+    recipients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print("FOMO direct messages to %d recipients" % recipients)
+    print("%-24s %12s %12s %12s %12s" % ("", "us/channel", "peak bytes", "bytes held", "blocks held"))
+    for (label, fn) in [("formatted every time", formatted_every_time), ("compiled once", compiled_once)]:
+        seconds = min(timeit.repeat(lambda: fn(recipients), number=200, repeat=3)) / 200
+        (peak, size, count) = allocations(fn, recipients)
+        print("%-24s %12.1f %12d %12d %12d" % (label, seconds * 1e6, peak, size, count))
+
+
+if __name__ == "__main__":
+    main()
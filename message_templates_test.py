@@ -0,0 +1,53 @@
+import unittest
+
+import message_templates
+from message_templates import CompiledTemplate
+from processor import ANNOUNCEMENT_TEMPLATE
+
+VALUES = {
+    "creator_id": "U1",
+    "creator_name": "Fred Hole",
+    "creator_image": "https://example.com/fred.png",
+    "creator_display_name": "fred.hole",
+    "channel_id": "C1",
+    "channel_name": "dev-something",
+    "channel_purpose": None,
+    "rename_msg": "(via renaming)",
+}
+
+
+class TestMessageTemplates(unittest.TestCase):
+
+    def test_render_matches_str_format(self):
+        template = dict(ANNOUNCEMENT_TEMPLATE, braces="{{literal}} {channel_id!r:>8}", number="{count:03d}")
+        values = dict(VALUES, count=7)
+
+        message = CompiledTemplate("test", template).render(values)
+
+        self.assertDictEqual({key: value.format(**values) for (key, value) in template.items()}, message)
+
+    def test_constant_fields_are_shared(self):
+        template = CompiledTemplate("test", {"footer": "no placeholders", "text": "{channel_purpose}"})
+
+        first = template.render(VALUES)
+        second = template.render(dict(VALUES, channel_purpose="Something"))
+
+        self.assertIs(first["footer"], second["footer"])
+        self.assertEqual("Something", second["text"])
+        self.assertEqual({"channel_purpose"}, template.placeholders)
+
+    def test_overrides_are_added(self):
+        template = CompiledTemplate("test", {"title": "<#{channel_id}>"})
+        self.assertEqual({"title": "<#C1>", "color": "#ff1744"}, template.render(VALUES, color="#ff1744"))
+
+    def test_registry(self):
+        compiled = message_templates.register("registry_test", {"title": "{channel_name}"})
+        self.assertIs(compiled, message_templates.get("registry_test"))
+
+    def test_missing_value_is_an_error(self):
+        with self.assertRaises(KeyError):
+            CompiledTemplate("test", {"title": "{unknown}"}).render(VALUES)
+
+
+if __name__ == '__main__':
+    unittest.main()
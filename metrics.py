@@ -0,0 +1,230 @@
+"""
+A tiny, dependency free, metrics library that can be scraped by Prometheus.
+
+Recording a value only takes a short lock and a couple of additions. All the formatting work is done
+when /metrics is scraped, so the metrics cost almost nothing if nobody is looking at them.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets (in seconds) suitable for calls to Slack and Redis
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                             for (name, value) in pairs)
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A value that only goes up, e.g. the number of calls made
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(x, "") for x in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(x, "") for x in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for (key, value) in sorted(values)]
+
+
+class Histogram:
+    """
+    Counts observations (e.g. latencies) in buckets, so that percentiles can be calculated by Prometheus
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [count per bucket (plus one for +Inf), sum of observations]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(x, "") for x in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe how long the body of the with statement takes
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(labels.get(x, "") for x in self.labelnames))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for (key, (counts, total)) in self._values.items()]
+        samples = []
+        for (key, counts, total) in sorted(values):
+            cumulative = 0
+            for (bound, count) in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((self.name + "_bucket", _format_labels(self.labelnames, key, [("le", le)]), cumulative))
+            samples.append((self.name + "_sum", _format_labels(self.labelnames, key), total))
+            samples.append((self.name + "_count", _format_labels(self.labelnames, key), cumulative))
+        return samples
+
+
+class GaugeCallback:
+    """
+    A value that is only calculated when the metrics are scraped, e.g. the depth of a queue
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, fn):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+
+    def samples(self):
+        return [(self.name, "", self.fn())]
+
+
+class Registry:
+    """
+    The collection of all metrics, which can be rendered in the Prometheus text format
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(name, lambda: Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(name, lambda: Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name, documentation, fn):
+        """
+        Register a gauge whose value is given by calling fn. Registering the same name again replaces the function.
+        """
+        with self._lock:
+            self._metrics[name] = GaugeCallback(name, documentation, fn)
+            return self._metrics[name]
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            for (name, labels, value) in metric.samples():
+                lines.append("%s%s %s" % (name, labels, _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+    def _register(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+
+# The registry that is scraped by /metrics
+REGISTRY = Registry()
+
+REDIS_ROUND_TRIPS = REGISTRY.counter("telltale_redis_round_trips_total", "Round trips to redis, by command",
+                                     ["command"])
+REDIS_SECONDS = REGISTRY.histogram("telltale_redis_seconds", "Latency of round trips to redis, by command",
+                                   ["command"])
+
+
+class InstrumentedStore:
+    """
+    Wrap a redis client (or InMemoryRedis or SqliteRedis), counting and timing every round trip
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getattr__(self, name):
+        attribute = getattr(self._store, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        def instrumented(*args, **kwargs):
+            REDIS_ROUND_TRIPS.inc(command=name)
+            with REDIS_SECONDS.time(command=name):
+                return attribute(*args, **kwargs)
+
+        return instrumented
+
+    def pipeline(self, transaction=True):
+        return _InstrumentedPipeline(self._store.pipeline(transaction=transaction))
+
+
+class _InstrumentedPipeline:
+    """
+    Commands that are queued on a pipeline don't cost a round trip. Executing the pipeline does.
+    """
+
+    def __init__(self, pipeline):
+        self._pipeline = pipeline
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._pipeline.__exit__(exc_type, exc_val, exc_tb)
+
+    def __getattr__(self, name):
+        method = getattr(self._pipeline, name)
+
+        def queue_command(*args, **kwargs):
+            method(*args, **kwargs)
+            return self
+
+        return queue_command
+
+    def execute(self):
+        REDIS_ROUND_TRIPS.inc(command="pipeline")
+        with REDIS_SECONDS.time(command="pipeline"):
+            return self._pipeline.execute()
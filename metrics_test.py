@@ -0,0 +1,99 @@
+import unittest
+from mock import MagicMock
+
+import metrics
+from in_memory_redis import InMemoryRedis
+from processor import Processor, STAGE_SECONDS, EVENTS_DROPPED, DEDUPE_CHECKS
+from slack_dispatcher import SlackDispatcher, SLACK_CALLS
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter_renders_labels(self):
+        registry = metrics.Registry()
+        counter = registry.counter("calls_total", "Some calls", ["method"])
+        counter.inc(method="users.info")
+        counter.inc(2, method="users.info")
+        counter.inc(method='odd"name')
+
+        text = registry.render()
+
+        self.assertIn("# TYPE calls_total counter", text)
+        self.assertIn('calls_total{method="users.info"} 3', text)
+        self.assertIn('calls_total{method="odd\\"name"} 1', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = metrics.Registry()
+        histogram = registry.histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1.0))
+        for value in [0.05, 0.5, 0.5, 5.0]:
+            histogram.observe(value, stage="x")
+
+        text = registry.render()
+
+        self.assertIn('latency_seconds_bucket{stage="x",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{stage="x",le="1.0"} 3', text)
+        self.assertIn('latency_seconds_bucket{stage="x",le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_count{stage="x"} 4', text)
+        self.assertIn('latency_seconds_sum{stage="x"} 6.05', text)
+
+    def test_registering_twice_returns_same_metric(self):
+        registry = metrics.Registry()
+        self.assertIs(registry.counter("a_total", "A"), registry.counter("a_total", "A"))
+
+    def test_gauge_callback_is_only_called_when_rendered(self):
+        registry = metrics.Registry()
+        fn = MagicMock(return_value=7)
+        registry.gauge_callback("depth", "Depth", fn)
+        fn.assert_not_called()
+
+        self.assertIn("depth 7", registry.render())
+
+    def test_instrumented_store_counts_round_trips(self):
+        store = metrics.InstrumentedStore(InMemoryRedis())
+        before_get = metrics.REDIS_ROUND_TRIPS.value(command="get")
+        before_pipeline = metrics.REDIS_ROUND_TRIPS.value(command="pipeline")
+
+        store.set("x", "1")
+        self.assertEqual("1", store.get("x"))
+        (value, deleted) = store.pipeline().get("x").delete("x").execute()
+
+        self.assertEqual(("1", 1), (value, deleted))
+        self.assertEqual(before_get + 1, metrics.REDIS_ROUND_TRIPS.value(command="get"))
+        self.assertEqual(before_pipeline + 1, metrics.REDIS_ROUND_TRIPS.value(command="pipeline"))
+
+    def test_dispatcher_counts_calls_by_outcome(self):
+        dispatcher = SlackDispatcher(MagicMock(), sleep=MagicMock())
+        before_ok = SLACK_CALLS.value(method="test.method", outcome="ok")
+        before_error = SLACK_CALLS.value(method="test.method", outcome="error")
+
+        dispatcher.call("test.method", lambda: "ok")
+        with self.assertRaises(ValueError):
+            dispatcher.call("test.method", MagicMock(side_effect=ValueError()))
+
+        self.assertEqual(before_ok + 1, SLACK_CALLS.value(method="test.method", outcome="ok"))
+        self.assertEqual(before_error + 1, SLACK_CALLS.value(method="test.method", outcome="error"))
+
+    def test_processor_records_stages_and_drops(self):
+        slack_client = MagicMock()
+        slack_client.channel_info.return_value = {"ok": True, "channel": {
+            "id": "C1", "name": "fun-metrics", "creator": "U1", "purpose": {"value": "testing"}}}
+        slack_client.user_info.return_value = {"ok": True, "user": {"id": "U1", "profile": {}}}
+        processor = Processor({"#announce": ["fun-"]}, slack_client, logger=MagicMock(), fan_out_concurrency=1)
+        event = {"event": {"channel": {"id": "C1", "name": "fun-metrics"}}}
+        before_sends = STAGE_SECONDS.count(stage="send_notification")
+        before_new = DEDUPE_CHECKS.value(result="new")
+        before_duplicates = EVENTS_DROPPED.value(reason="duplicate")
+        before_prefix = EVENTS_DROPPED.value(reason="prefix")
+
+        processor.process_channel_event("create", event)
+        processor.process_channel_event("create", event)
+        processor.process_channel_event("create", {"event": {"channel": {"id": "C2", "name": "other"}}})
+
+        self.assertEqual(before_sends + 1, STAGE_SECONDS.count(stage="send_notification"))
+        self.assertEqual(before_new + 1, DEDUPE_CHECKS.value(result="new"))
+        self.assertEqual(before_duplicates + 1, EVENTS_DROPPED.value(reason="duplicate"))
+        self.assertEqual(before_prefix + 1, EVENTS_DROPPED.value(reason="prefix"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+A character trie that finds all the registered prefixes of a name in a single pass over the name.
+
+Looking up a name costs O(len(name)), no matter how many prefixes have been registered.
+"""
+
+
+class _Node:
+    __slots__ = ("children", "prefix", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.prefix = None
+        self.values = None
+
+
+class PrefixIndex:
+    """
+    Map string prefixes to values, and find every (prefix, values) pair that matches a given name.
+    """
+
+    def __init__(self, items=()):
+        self._root = _Node()
+        self._size = 0
+        for (prefix, value) in items:
+            self.add(prefix, value)
+
+    def __len__(self):
+        """
+        Return the number of distinct prefixes in the index
+        """
+        return self._size
+
+    def add(self, prefix, value):
+        """
+        Associate the given value with the given prefix. A prefix can have any number of values.
+        """
+        node = self._root
+        for ch in prefix:
+            child = node.children.get(ch)
+            if child is None:
+                child = node.children[ch] = _Node()
+            node = child
+        if node.values is None:
+            node.prefix = prefix
+            node.values = []
+            self._size += 1
+        node.values.append(value)
+
+    def matches(self, name):
+        """
+        Return a list of (prefix, values) for every prefix of the given name, shortest prefix first
+        """
+        node = self._root
+        found = [(node.prefix, node.values)] if node.values is not None else []
+        for ch in name:
+            node = node.children.get(ch)
+            if node is None:
+                break
+            if node.values is not None:
+                found.append((node.prefix, node.values))
+        return found
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark comparing the routing index with linear `startswith` scans over the prefixes.
+
+    > python prefix_index_bench.py
+
+The cost of a linear scan grows with the number of configured prefixes.
+The cost of an index lookup depends only on the length of the channel name.
+"""
+import random
+import string
+import timeit
+
+from prefix_index import PrefixIndex
+
+PREFIX_COUNTS = [10, 100, 1000, 10000]
+LOOKUPS = 10000
+
+
+def random_word(rng, length):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def make_prefixes(rng, count):
+    return ["%s-" % random_word(rng, rng.randint(2, 8)) for _ in range(count)]
+
+
+def make_names(rng, prefixes, count):
+    # Half the names match one of the prefixes, half match nothing
+    return [(rng.choice(prefixes) if i % 2 else "zz-") + random_word(rng, 12) for i in range(count)]
+
+
+def main():
+    rng = random.Random(42)
+    print("%10s %16s %16s %10s" % ("prefixes", "linear (us/op)", "index (us/op)", "speedup"))
+    for count in PREFIX_COUNTS:
+        prefix_targets = [(prefix, "target%d" % (i % 10)) for (i, prefix) in enumerate(make_prefixes(rng, count))]
+        names = make_names(rng, [x[0] for x in prefix_targets], LOOKUPS)
+        index = PrefixIndex(prefix_targets)
+
+        def linear():
+            for name in names:
+                [target for (prefix, target) in prefix_targets if name.startswith(prefix)]
+
+        def indexed():
+            for name in names:
+                [target for (_, targets) in index.matches(name) for target in targets]
+
+        linear_us = min(timeit.repeat(linear, number=1, repeat=3)) * 1e6 / LOOKUPS
+        indexed_us = min(timeit.repeat(indexed, number=1, repeat=3)) * 1e6 / LOOKUPS
+        print("%10d %16.2f %16.2f %9.1fx" % (count, linear_us, indexed_us, linear_us / indexed_us))
+
+
+if __name__ == "__main__":
+    main()
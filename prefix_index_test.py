@@ -0,0 +1,32 @@
+import unittest
+
+from prefix_index import PrefixIndex
+
+
+class TestPrefixIndex(unittest.TestCase):
+
+    def test_matches_all_prefixes_shortest_first(self):
+        index = PrefixIndex([("fun-", "a"), ("fun-d", "b"), ("fun-dog", "c"), ("fun-dogs-", "d"), ("x-", "e")])
+
+        self.assertEqual([("fun-", ["a"]), ("fun-d", ["b"]), ("fun-dog", ["c"])], index.matches("fun-dogs"))
+        self.assertEqual([], index.matches("dev-test"))
+        self.assertEqual([], index.matches("fun"))
+        self.assertEqual(5, len(index))
+
+    def test_prefix_with_several_values(self):
+        index = PrefixIndex()
+        index.add("dev-", "target1")
+        index.add("dev-", "target2")
+
+        self.assertEqual([("dev-", ["target1", "target2"])], index.matches("dev-test"))
+        self.assertEqual(1, len(index))
+
+    def test_empty_prefix_matches_everything(self):
+        index = PrefixIndex([("", "all")])
+
+        self.assertEqual([("", ["all"])], index.matches("anything"))
+        self.assertEqual([("", ["all"])], index.matches(""))
+
+
+if __name__ == '__main__':
+    unittest.main()
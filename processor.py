@@ -1,15 +1,23 @@
+import contextvars
 import datetime
 import json
 import logging
 import random
 import re
 import time
-import itertools
+from concurrent.futures import ThreadPoolExecutor, wait
 from collections import namedtuple
 
+import message_templates
+import metrics
+from digest import DigestBuffer
 from in_memory_redis import InMemoryRedis
-from toolbox import nested_get
-import clippy_messages
+from prefix_index import PrefixIndex
+from structured_log import StructuredLogger
+from ttl_cache import RotatingSet
+from profile_cache import ProfileCache, project_profile
+from toolbox import fan_out, nested_get, ordered_distinct
+from user_directory import UserDirectory
 
 COLORS = ["#ff1744", "#f50057", "#d500f9", "#651fff", "#3d5afe", "#2979ff", "#00b0ff", "#00e5ff",
           "#1de9b6", "#00e676", "#76ff03", "#ffea00", "#ffc400", "#ff9100", "#ff3d00"]
@@ -23,13 +31,89 @@ APRIL_FOOL_ONLY_CHANNELS = ["fun-", "test-"]
 
 KnownUser = namedtuple('KnownUser', ['display_name', 'user_id'])
 
+# Everything that the configuration says about a channel name
+#  - prefixes: the configured channel prefixes that the name starts with (longest first)
+#  - target_channels: the channels where the channel should be announced
+#  - interested_users: the names of the FOMO users who want to hear about the channel
+Route = namedtuple('Route', ['prefixes', 'target_channels', 'interested_users'])
+
+# The kinds of values that are stored against each prefix in the routing index
+_ROUTE_PREFIX = "prefix"
+_ROUTE_TARGET = "target"
+_ROUTE_FOMO = "fomo"
+
 # How long do we want to keep information about channels? Default is 60 days.
 # During this period we will not report the same channel a second time.
 # If a rename happens outside of this period, we will announce the same channel a second time.
 CHANNEL_INFO_TTL_IN_SECONDS = 60 * (24 * 60 * 60)
 
-REDIS_KEY_USER_MAP = "map_user_name_to_id"
-USER_MAP_TTL_IN_SECONDS = 24 * 60 * 60
+# Channels that this process has already recorded as seen are also remembered in memory, so that duplicate events
+# can be ignored without asking redis. Redis remembers channels for much longer, and decides which event is first.
+# 100k channel ids use about 10MB (see seen_channels_bench.py).
+SEEN_CHANNELS_MAX_SIZE = 100000
+SEEN_CHANNELS_TTL_IN_SECONDS = 24 * 60 * 60
+
+# Slack sometimes sets the purpose of a channel a moment after creating it. Fetch the channel again (up to this
+# many times, this far apart) to see the purpose, unless the announcement can be updated later.
+PURPOSE_ATTEMPTS = 3
+PURPOSE_WAIT_SECONDS = 1
+
+# When the announcement is sent before the channel has a purpose, we remember where it was sent
+# so that it can be updated when the purpose is set. Don't wait forever for that to happen.
+PENDING_PURPOSE_TTL_IN_SECONDS = 60 * 60
+
+# Use templates for all fields in the message (even though some don't need complex substitutions).
+# The messages use the attachments format: https://api.slack.com/docs/message-attachments
+ANNOUNCEMENT_TEMPLATE = {
+    "fallback": "{creator_name} just created a new channel {rename_msg} :tada:\n"
+                "<#{channel_id}|{channel_name}>\n"
+                "Its purpose is: {channel_purpose} ",
+    "pretext": "A new channel has been created {rename_msg} :tada:",
+    "author_name": "{creator_name} <@{creator_display_name}>",
+    "author_icon": "{creator_image}",
+    "title": "<#{channel_id}>",
+    "text": "{channel_purpose}"
+}
+ANNOUNCEMENT = message_templates.register("announcement", ANNOUNCEMENT_TEMPLATE)
+
+FOMO_INVITE = message_templates.register("fomo_invite", {
+    "title": "People who suffer from FOMO",
+    "text": "These people would like to be invited to this group. Copy and paste the following command to invite them:\n\nDo you want join? {people_to_invite}",
+})
+FOMO_DIRECT_MESSAGE = message_templates.register("fomo_direct_message", {
+    "pretext": "*FOMO sufferers of the world rejoice!* :tada: \n<@{creator_display_name}> has created a group that you might want to join",
+    "title": "<#{channel_id}|{channel_name}>",
+    "text": "{channel_purpose}",
+    "footer": "If you don't want to be notified about these, please message <@phillip.piper> and he will remove you",
+    "footer_icon": "https://qresolve.files.wordpress.com/2015/02/information-icon.png"
+})
+JIRA_LINK = message_templates.register("jira_link", {
+    "fallback": "This channel is related to this JIRA issue: {jira_link}",
+    "title": "Related JIRA Issue",
+    "text": "{jira_link}"
+})
+JIRA_NAME_REMINDER = message_templates.register("jira_name_reminder", {
+    "fallback": "It's normally best to name a channel with more than just the JIRA issue number",
+    "title": "Friendly reminder about channel names",
+    "text": "<@{creator_display_name}> It's normally better to have more descriptive channel names.\n\n"
+            "Renaming this channel to something like *#{channel_name}-what-went-wrong* will prevent the *Powers That Be* from descending in wrath upon your head :smile:\n",
+    "footer": "To rename this channel, click the 'down arrow' icon at the top-left of this channel (next to the channel name), then click the 'Settings' tab, then hover over the 'Channel name' section, and click the 'Edit' button that appears.\n",
+    "footer_icon": "https://qresolve.files.wordpress.com/2015/02/information-icon.png"
+})
+
+STAGE_SECONDS = metrics.REGISTRY.histogram("telltale_stage_seconds",
+                                           "Time spent in each stage of processing a channel event", ["stage"])
+EVENTS_PROCESSED = metrics.REGISTRY.counter("telltale_channel_events_total", "Channel events received, by type",
+                                            ["event_type"])
+EVENTS_DROPPED = metrics.REGISTRY.counter("telltale_channel_events_dropped_total",
+                                          "Channel events that were not announced, by reason", ["reason"])
+DEDUPE_CHECKS = metrics.REGISTRY.counter("telltale_dedupe_checks_total",
+                                         "Checks for channels that have already been announced, by result", ["result"])
+SPECULATIVE_FETCHES = metrics.REGISTRY.counter("telltale_speculative_fetches_total",
+                                               "Creator profiles fetched before the channel info said who the creator "
+                                               "was, by whether they were used", ["result"])
+SEEN_CHANNEL_CACHE_HITS = metrics.REGISTRY.counter("telltale_seen_channel_cache_hits_total",
+                                                   "Duplicate channel events that were recognised without redis")
 
 class Processor:
     """
@@ -37,12 +121,36 @@ class Processor:
     """
 
     def __init__(self, target_channel_to_prefixes_map, slack_client, redis_client=None, logger=None, jira=None,
-                 fomo_users_as_string=None):
+                 fomo_users_as_string=None, defer_purpose=False, fomo_email_domain=None, fan_out_concurrency=8,
+                 digest_windows=None, user_table_path=None,
+                 user_sync_seconds=None, on_pending_purpose=None):
         self.slack_client = slack_client
-        self.redis_client = redis_client or InMemoryRedis()
+        self.redis_client = redis_client if redis_client is not None else InMemoryRedis()
         self.logger = logger or logging.getLogger("Processor")
+        self.log = StructuredLogger(self.logger)
+        self.user_directory = UserDirectory(slack_client, self.redis_client, self.logger, email_domain=fomo_email_domain,
+                                            user_table_path=user_table_path, sync_seconds=user_sync_seconds)
+        self.profile_cache = ProfileCache(slack_client, self.redis_client, self.logger)
+        self.seen_channels = RotatingSet(SEEN_CHANNELS_MAX_SIZE, SEEN_CHANNELS_TTL_IN_SECONDS)
         self.logger.info("target_channel_to_prefixes_map: %r", target_channel_to_prefixes_map)
 
+        # If true, don't wait for the channel to have a purpose before announcing it.
+        # Instead, update the announcement once the purpose is known.
+        self.defer_purpose = defer_purpose
+
+        # Called with the channel id whenever an announcement is sent without a purpose (e.g. to check again later)
+        self.on_pending_purpose = on_pending_purpose
+
+        # Messages to several channels or users are sent concurrently, using this many threads
+        self._fan_out_executor = ThreadPoolExecutor(fan_out_concurrency, thread_name_prefix="FanOut") \
+            if fan_out_concurrency > 1 else None
+
+        # Announcements to these target channels are coalesced into digests during bursts of channel creation
+        self.digests = {
+            target_channel: DigestBuffer(target_channel, self._send_digest, window, logger=self.logger)
+            for (target_channel, window) in (digest_windows or {}).items() if window
+        }
+
         # Make sure that, if there is a jira prefix, it ends with "/jira/browse/"
         self.jira_prefix = jira if not jira or jira.endswith("/jira/browse/") else jira + "/jira/browse/"
 
@@ -59,9 +167,35 @@ class Processor:
         # Create a collection of all known prefixes so we can easily test if we are interested in a channel
         self.all_channel_prefixes = set(x[0] for x in self.all_channel_prefixes_with_target_channel).union(APRIL_FOOL_ONLY_CHANNELS)
 
+        # Compile all the prefixes into a single index, so one lookup can answer every question about a channel name
+        self.routing_index = self._build_routing_index()
+
+    def _build_routing_index(self):
+        routing_index = PrefixIndex()
+        for prefix in self.all_channel_prefixes:
+            routing_index.add(prefix, (_ROUTE_PREFIX, prefix))
+        for (prefix, channel) in self.all_channel_prefixes_with_target_channel:
+            routing_index.add(prefix, (_ROUTE_TARGET, channel))
+        for (prefix, users) in self.fomo_users.items():
+            for user in users:
+                routing_index.add(prefix, (_ROUTE_FOMO, user))
+        return routing_index
+
+    def route(self, channel_name):
+        """
+        Find the prefixes, target channels and interested users for the given channel name
+        """
+        matches = self.routing_index.matches(channel_name)
+        values = [value for (_, values_for_prefix) in matches for value in values_for_prefix]
+        return Route(
+            prefixes=[value for (kind, value) in reversed(values) if kind == _ROUTE_PREFIX],
+            target_channels=ordered_distinct(value for (kind, value) in values if kind == _ROUTE_TARGET),
+            interested_users=ordered_distinct(value for (kind, value) in values if kind == _ROUTE_FOMO)
+        )
+
     def _parse_fomo_users(self, fomo_users_as_string):
         """
-        Parse a list of channel prefixes and users from the given string.
+        Parse a list of channel prefixes and user names from the given string.
         The format is:
          - <channel_definition>[|<channel_definition>]*
         and <channel_definition> is:
@@ -72,70 +206,81 @@ class Processor:
         if not fomo_users_as_string:
             return {}
 
-        # Map all display names to user ids
-        map_name_to_id = self._fetch_slack_users()
-
         fomo_definitions = {}
         for channel_definition in fomo_users_as_string.split("|"):
-            (channels, users_for_channels) = self._parse_one_fomo_channel(channel_definition, map_name_to_id)
+            (channels, users_for_channels) = self._parse_one_fomo_channel(channel_definition)
             for channel in channels:
                 fomo_definitions[channel] = users_for_channels
 
-        self.logger.debug("fomo users: %s", json.dumps(fomo_definitions, indent=2))
+        self.log.debug("fomo users", fomo_users=fomo_definitions)
         return fomo_definitions
 
-    def _fetch_slack_users(self):
-        """
-        Fetch a map of slack usernames to user ids
-        """
-        start = time.time()
-
-        # Try to fetch cache value from redis
-        cached_map = self.redis_client.get(REDIS_KEY_USER_MAP)
-        if cached_map:
-            try:
-                user_map = json.loads(cached_map)
-                self.logger.info("loaded %d users from redis in %.2f seconds", len(user_map), time.time() - start)
-                return user_map
-            except:
-                self.logger.exception("failed to load user_map from redis", exc_info=True)
-
-        # The cache has failed us. Spend the time to fetch the list of users from slack
-        user_map = {user.get("name"): user.get("id") for user in self.slack_client.users()}
-        self.logger.info("loaded %d users from slack in %.2f seconds", len(user_map), time.time() - start)
-
-        # Cache the user map for 24 hours
-        self.redis_client.set(REDIS_KEY_USER_MAP, json.dumps(user_map))
-        self.redis_client.expire(REDIS_KEY_USER_MAP, USER_MAP_TTL_IN_SECONDS)
-        return user_map
-
-    def _parse_one_fomo_channel(self, channel_definition, map_name_to_id):
+    def _parse_one_fomo_channel(self, channel_definition):
         (channel_prefixes, users) = channel_definition.split(":")
         channels = channel_prefixes.split(',')
         display_names = [x.strip(",@") for x in users.split()]
+        return channels, display_names
+
+    def warm_up(self, background=True):
+        """
+        Resolve the ids of all the FOMO users now, rather than when they are first needed
+        """
+        names = ordered_distinct(name for names in self.fomo_users.values() for name in names)
+        if names:
+            self.user_directory.warm_up(names, background)
+
+    def _find_known_users(self, channel_name, display_names):
+        """
+        Convert the given display names into KnownUsers
+        """
+        map_name_to_id = self.user_directory.resolve(display_names)
         bad_names = [x for x in display_names if x not in map_name_to_id]
         if bad_names:
-            self.logger.error("For channel %s, these users can't be found: %s", channel_prefixes, bad_names)
-        names_with_ids = [(x, map_name_to_id.get(x)) for x in display_names if x not in bad_names]
-        known_users = [KnownUser(name, user_id) for (name, user_id) in names_with_ids]
-        return channels, known_users
+            self.logger.error("For channel %s, these users can't be found: %s", channel_name, bad_names)
+        return [KnownUser(name, map_name_to_id[name]) for name in display_names if name in map_name_to_id]
+
+    def process_user_event(self, event_data):
+        """
+        When a user joins or changes, keep our directory of users up to date
+        """
+        user = nested_get(event_data, "event", "user")
+        if isinstance(user, dict) and user.get("id"):
+            self.profile_cache.invalidate(user.get("id"))
+        return self.user_directory.update_user(user)
 
     def remember_channel(self, channel):
         """
         Remember the given channel. Return a bool indicating if we've already seen it
         """
-        redis_channel_key = "channel:%s" % channel["id"]
-        is_new = self.redis_client.setnx(redis_channel_key, channel.get("created", "0"))
-        if is_new:
-            # We don't want our redis instance to just continue growing, so delete the key after 60 days
-            self.redis_client.expire(redis_channel_key, CHANNEL_INFO_TTL_IN_SECONDS)
+        if self._is_seen_channel(channel):
+            return True
+
+        # We don't want our redis instance to just continue growing, so delete the key after 60 days.
+        # Setting the value and its expiry in one command means the key can never be left without a TTL.
+        is_new = self.redis_client.set(*self._channel_record(channel), ex=CHANNEL_INFO_TTL_IN_SECONDS, nx=True)
+        self.seen_channels.add(channel["id"])
         return not is_new
 
+    def _is_seen_channel(self, channel):
+        # Duplicates of channels that this process has already seen don't need a round trip to redis
+        if channel["id"] in self.seen_channels:
+            SEEN_CHANNEL_CACHE_HITS.inc()
+            return True
+        return False
+
+    def _channel_record(self, channel):
+        """
+        Return the key and value that record in redis that the channel has been seen
+        """
+        return "channel:%s" % channel["id"], channel.get("created", "0")
+
     def get_channel_info(self, channel_id):
         """
         Fetch information about the given channel from slack
         """
-        channel_info = self.slack_client.channel_info(channel_id)
+        return self._checked_channel_info(channel_id, self.slack_client.channel_info(channel_id))
+
+    def _checked_channel_info(self, channel_id, channel_info):
         if channel_info and channel_info.get("ok"):
             return channel_info
 
@@ -153,14 +298,22 @@ class Processor:
         """
         attempts = 0
         channel_info = self.get_channel_info(channel_id)
-        while attempts < 3 and not nested_get(channel_info, "channel", "purpose", "value"):
+        while self._is_waiting_for_purpose(channel_id, channel_info, attempts):
             attempts += 1
-            self.logger.info("attempt %d: waiting for channel %s to find its purpose in life", attempts, channel_id)
-            time.sleep(1)
+            time.sleep(PURPOSE_WAIT_SECONDS)
             channel_info = self.get_channel_info(channel_id)
 
         return channel_info
 
+    def _is_waiting_for_purpose(self, channel_id, channel_info, attempts):
+        """
+        Should the channel be fetched again, in case it has found its purpose since?
+        """
+        if attempts >= PURPOSE_ATTEMPTS or nested_get(channel_info, "channel", "purpose", "value"):
+            return False
+        self.logger.info("attempt %d: waiting for channel %s to find its purpose in life", attempts + 1, channel_id)
+        return True
+
     def process_channel_event(self, event_type, event_data):
         """
         When a channel is created or renamed, send a notification message to the target channel, if required.
@@ -168,6 +321,66 @@ class Processor:
         For the same channel, we will only send one notification message, even if we receive multiple
         created notifications, or if it is renamed multiple times.
         """
+        EVENTS_PROCESSED.inc(event_type=event_type)
+        with STAGE_SECONDS.time(stage="total"):
+            reason = self._process_channel_event(event_type, event_data)
+        if reason:
+            EVENTS_DROPPED.inc(reason=reason)
+
+    def _process_channel_event(self, event_type, event_data):
+        """
+        :return: None if the channel was announced, otherwise the reason why it wasn't
+        """
+        (channel, reason) = self._wanted_channel(event_data)
+        if reason:
+            return reason
+
+        # Have we already processed this channel?
+        with STAGE_SECONDS.time(stage="remember_channel"):
+            is_duplicate = self.remember_channel(channel)
+        reason = self._check_duplicate(channel, is_duplicate)
+        if reason:
+            return reason
+
+        # The creator is usually in the event, so start fetching their profile while the channel is fetched
+        speculative_creator_id = channel.get("creator")
+        speculative_creator_info = self._fan_out_executor.submit(
+            contextvars.copy_context().run, self.profile_cache.user_info, speculative_creator_id) \
+            if speculative_creator_id and self._fan_out_executor else None
+
+        # Try hard to fetch the full info about the channel (unless the purpose can be filled in later)
+        with STAGE_SECONDS.time(stage="channel_info"):
+            if self.defer_purpose:
+                channel_info = self.get_channel_info(channel["id"])
+            else:
+                channel_info = self.insistent_get_channel_info(channel["id"])
+        (creator_id, reason) = self._creator_of(channel, channel_info)
+        if reason:
+            return reason
+
+        # Fetch the full info about the creator of the channel
+        with STAGE_SECONDS.time(stage="creator_info"):
+            creator_info = self._creator_info(creator_id, speculative_creator_id, speculative_creator_info)
+        reason = self._check_creator_info(creator_info)
+        if reason:
+            return reason
+
+        # We now have all the information that we need to send the creation notification
+        with STAGE_SECONDS.time(stage="send_notification"):
+            self._send_pretty_notification(event_type, channel_info.get("channel"), creator_info.get("user"))
+
+        # Do any post notification processing
+        with STAGE_SECONDS.time(stage="post_notification"):
+            self._post_notification(event_type, channel_info.get("channel"), creator_info.get("user"))
+        return None
+
+    # The steps of processing a channel event that don't wait for anything, shared with AsyncProcessor.
+    # Each returns the reason why the channel isn't announced, or None.
+
+    def _wanted_channel(self, event_data):
+        """
+        :return: (the channel in the event, None), or (None, the reason why it isn't wanted)
+        """
         channel = nested_get(event_data, "event", "channel")
 
         # Make sure the event structure is sensible
@@ -175,78 +388,195 @@ class Processor:
                 "id" not in channel or \
                 "name" not in channel:
             self.logger.error("ignored... event was missing required attributes. channel=%r", channel)
-            return
-
-        channel_id = channel["id"]
-        channel_name = channel["name"]
+            return None, "malformed"
 
         # Is the new channel one of the ones that we want to report?
-        if self.all_channel_prefixes and \
-                not any(channel_name.startswith(x) for x in self.all_channel_prefixes):
-            self.logger.info("ignored... channel name doesn't start with the appropriate prefix: %s", channel_name)
-            return
-
-        # Have we already processed this channel?
-        if self.remember_channel(channel):
-            self.logger.info("ignored... we've already processed this channel: %s/%s", channel_id, channel_name)
-            return
+        with STAGE_SECONDS.time(stage="prefix_filter"):
+            is_wanted = not self.all_channel_prefixes or self.route(channel["name"]).prefixes
+        if not is_wanted:
+            self.log.sample("ignored... channel name doesn't start with the appropriate prefix", channel=channel["id"],
+                            name=channel["name"])
+            return None, "prefix"
+        return channel, None
+
+    def _check_duplicate(self, channel, is_duplicate):
+        DEDUPE_CHECKS.inc(result="duplicate" if is_duplicate else "new")
+        if is_duplicate:
+            self.log.sample("ignored... we've already processed this channel", channel=channel["id"],
+                            name=channel["name"])
+            return "duplicate"
+        return None
 
-        # Try hard to fetch the full info about the channel
-        channel_info = self.insistent_get_channel_info(channel_id)
+    def _creator_of(self, channel, channel_info):
+        """
+        :return: (the id of the creator of the channel, None), or (None, the reason why it isn't known)
+        """
         if not channel_info:
-            self.logger.error("ignored.... failed to get information about channel (%s/%s)", channel_id, channel_name)
-            return
+            self.logger.error("ignored.... failed to get information about channel (%s/%s)", channel["id"],
+                              channel["name"])
+            return None, "channel_info"
 
-        # Fetch the full info about the creator of the channel
         creator_id = nested_get(channel_info, "channel", "creator")
         if not creator_id:
             self.logger.error("ignored... channel did not contain creator: %s", repr(channel_info))
-            return
-        creator_info = self.slack_client.user_info(creator_id)
+            return None, "no_creator"
+        return creator_id, None
+
+    def _check_creator_info(self, creator_info):
         if not creator_info or not creator_info.get("ok"):
             self.logger.error("ignored... fetching of creator failed: %s", repr(creator_info))
-            return
+            return "creator_info"
+        return None
 
-        # We now have all the information that we need to send the creation notification
-        self._send_pretty_notification(event_type, channel_info.get("channel"), creator_info.get("user"))
+    def _creator_info(self, creator_id, speculative_creator_id, speculative_creator_info):
+        """
+        Return the info about the creator of the channel, from the speculative fetch if it was for the same user
+        """
+        if speculative_creator_info is None:
+            return self.profile_cache.user_info(creator_id)
+        if self._is_speculation_used(creator_id, speculative_creator_id):
+            return speculative_creator_info.result()
 
-        # Do any post notification processing
-        self._post_notification(event_type, channel_info.get("channel"), creator_info.get("user"))
+        # The event was wrong about the creator. Let the wasted fetch finish first, so the two don't compete
+        wait([speculative_creator_info])
+        return self.profile_cache.user_info(creator_id)
+
+    def _is_speculation_used(self, creator_id, speculative_creator_id):
+        is_used = creator_id == speculative_creator_id
+        SPECULATIVE_FETCHES.inc(result="used" if is_used else "wasted")
+        return is_used
 
-    # noinspection PyPep8Naming
     def _send_pretty_notification(self, event_type, channel, creator):
         """
         Send a channel creation notification to the given target channel
         """
-        # Log for debugging if needed
-        self.logger.info("channel: %s", json.dumps(channel))
-        self.logger.info("creator: %s", json.dumps(creator))
-
-        # Use templates for all fields in the message (even though some don't need complex substitutions).
-        # The messages use the attachments format: https://api.slack.com/docs/message-attachments
-        MESSAGE_TEMPLATE = {
-            "fallback": "{creator_name} just created a new channel {rename_msg} :tada:\n"
-                        "<#{channel_id}|{channel_name}>\n"
-                        "Its purpose is: {channel_purpose} ",
-            "color": random.choice(COLORS),
-            "pretext": "A new channel has been created {rename_msg} :tada:",
-            "author_name": "{creator_name} <@{creator_display_name}>",
-            "author_icon": "{creator_image}",
-            "title": "<#{channel_id}>",
-            "text": "{channel_purpose}"
-        }
-        # Make a nicely formatted notification from the above template
-        fancy_message = self._make_formatted_message(MESSAGE_TEMPLATE, channel, creator, event_type)
+        (color, fancy_message, target_channels) = self._prepare_announcement(event_type, channel, creator)
 
         # Announce the new channel in any matching announcement channels
-        channel_name = channel.get("name")
-        target_channels = [target for (prefix, target) in self.all_channel_prefixes_with_target_channel if channel_name.startswith(prefix)]
-        for target_channel in set(target_channels):
-            self.logger.info("sending to %s: %s", target_channel, json.dumps(fancy_message))
-            self.slack_client.post_chat_message(target_channel, None, [fancy_message])
+        def announce(target_channel):
+            digest = self.digests.get(target_channel)
+            if digest:
+                return digest.add(fancy_message)
+            self.log.debug("sending announcement", target=target_channel, attachment=fancy_message)
+            return self.slack_client.post_chat_message(target_channel, None, [fancy_message])
+
+        sent_messages = self._sent_messages(target_channels, self._fan_out(announce, target_channels))
+
+        # If the channel doesn't have a purpose yet, remember the messages so they can be updated later
+        if self._is_missing_purpose(channel, sent_messages):
+            self._remember_pending_purpose(event_type, channel, creator, color, sent_messages)
+
+    def _prepare_announcement(self, event_type, channel, creator):
+        """
+        :return: (the color of the announcement, the announcement, the channels to send it to)
+        """
+        # Only log the ids. The full payloads are large, and include things like email addresses
+        self.log.info("announcing channel", channel=channel.get("id"), name=channel.get("name"),
+                      creator=creator.get("id"))
+
+        # Make a nicely formatted notification
+        color = random.choice(COLORS)
+        fancy_message = self._make_announcement(event_type, channel, creator, color)
+        return color, fancy_message, self.route(channel.get("name")).target_channels
+
+    def _sent_messages(self, target_channels, responses):
+        """
+        :return: (target channel, ts) of each announcement that was sent
+        """
+        return [
+            (target_channel, response.get("ts"))
+            for (target_channel, response) in zip(target_channels, responses) if response and response.get("ok")
+        ]
+
+    def _is_missing_purpose(self, channel, sent_messages):
+        return self.defer_purpose and sent_messages and not nested_get(channel, "purpose", "value")
+
+    def _send_digest(self, target_channel, attachments):
+        text = "%d new channels have been created :tada:" % len(attachments) if len(attachments) > 1 else None
+        self.logger.info("sending to %s: %d announcements", target_channel, len(attachments))
+        return self.slack_client.post_chat_message(target_channel, text, attachments)
+
+    def flush_digests(self):
+        """
+        Send any announcements that are being held back for a digest
+        """
+        for digest in self.digests.values():
+            digest.flush()
+
+    def _fan_out(self, fn, items):
+        """
+        Call fn for each item, concurrently, but with no more than fan_out_concurrency calls in flight at once
+        """
+        return fan_out(self._fan_out_executor, fn, items, self.logger)
+
+    def _make_announcement(self, event_type, channel, creator, color):
+        return ANNOUNCEMENT.render(self._message_values(channel, creator, event_type), color=color)
 
-    def _make_formatted_message(self, message_template, channel, creator, event_type):
-        # Setup all the values that will be needed for the messages
+    def _remember_pending_purpose(self, event_type, channel, creator, color, sent_messages):
+        """
+        Remember enough about the announcement of a channel without a purpose that
+        we can rebuild the announcement when the purpose is finally set
+        """
+        pending = {
+            "event_type": event_type,
+            "channel": {"id": channel.get("id"), "name": channel.get("name")},
+            "creator": project_profile(creator),
+            "color": color,
+            "messages": sent_messages
+        }
+        redis_key = "pending-purpose:%s" % channel.get("id")
+        self.logger.info("waiting for purpose of channel %s: %r", channel.get("id"), sent_messages)
+        self.redis_client.set(redis_key, json.dumps(pending), ex=PENDING_PURPOSE_TTL_IN_SECONDS)
+        if self.on_pending_purpose:
+            self.on_pending_purpose(channel.get("id"))
+
+    def update_channel_purpose(self, channel_id, purpose):
+        """
+        If the announcement for the given channel was sent without a purpose, update it to show the given purpose.
+
+        :return: True if any announcements were updated
+        """
+        if not purpose:
+            return False
+
+        redis_key = "pending-purpose:%s" % channel_id
+        # Fetch and delete in one round trip, so only one caller can claim the pending announcements
+        (pending, _) = self.redis_client.pipeline().get(redis_key).delete(redis_key).execute()
+        if not pending:
+            return False
+
+        pending = json.loads(pending)
+        channel = dict(pending["channel"], purpose={"value": purpose})
+        fancy_message = self._make_announcement(pending["event_type"], channel, pending["creator"], pending["color"])
+        for (target_channel, ts) in pending["messages"]:
+            self.logger.info("updating purpose of %s in %s/%s", channel_id, target_channel, ts)
+            self.slack_client.update_chat_message(target_channel, ts, attachments=[fancy_message])
+        return True
+
+    def recheck_channel_purpose(self, channel_id):
+        """
+        If the announcement for the given channel is still waiting for a purpose, ask Slack if it has one now.
+        """
+        if not self.redis_client.get("pending-purpose:%s" % channel_id):
+            return False
+
+        channel_info = self.get_channel_info(channel_id)
+        return self.update_channel_purpose(channel_id, nested_get(channel_info, "channel", "purpose", "value"))
+
+    def process_purpose_event(self, event_data):
+        """
+        When the purpose of a channel is set, update the announcement of that channel if it was sent without one.
+        """
+        event = event_data.get("event") or {}
+        if event.get("subtype") != "channel_purpose":
+            return False
+        return self.update_channel_purpose(event.get("channel"), event.get("purpose"))
+
+    def _message_values(self, channel, creator, event_type, **extra_values):
+        """
+        Return the values that the message templates need. Calculate these once, and use them for every
+        message about the channel.
+        """
         values = {
             "creator_id": nested_get(creator, "enterprise_user", "id") or nested_get(creator, "id"),
             "creator_name": nested_get(creator, "profile", "real_name_normalized"),
@@ -257,8 +587,8 @@ class Processor:
             "channel_purpose": nested_get(channel, "purpose", "value"),
             "rename_msg": "(via renaming)" if event_type == "rename" else ""
         }
-        fancy_message = {key: value.format(**values) for (key, value) in message_template.items()}
-        return fancy_message
+        values.update(extra_values)
+        return values
 
     def _post_notification(self, event_type, channel, user):
         """
@@ -282,8 +612,7 @@ class Processor:
         channel_name = channel.get("name")
 
         # Calculate list of users interested in this channel
-        list_of_users = [users for (prefix, users) in self.fomo_users.items() if channel_name.startswith(prefix)]
-        interested_users = set(itertools.chain.from_iterable(list_of_users))
+        interested_users = self._find_known_users(channel_name, self.route(channel_name).interested_users)
         self.logger.info("Users interested in this group: %r" % interested_users)
 
         # Remove the users that are already in the group
@@ -295,30 +624,25 @@ class Processor:
         if not interested_users:
             return
 
-        people_to_invite = ["<@%s>" % x.display_name for x in interested_users]
-        message = {
-            "color": random.choice(COLORS),
-            "title": "People who suffer from FOMO",
-            "text": "These people would like to be invited to this group. Copy and paste the following command to invite them:\n\nDo you want join? " + " ".join(
-                people_to_invite),
-        }
+        people_to_invite = " ".join("<@%s>" % x.display_name for x in interested_users)
+        values = self._message_values(channel, creator, "", people_to_invite=people_to_invite)
+        message = FOMO_INVITE.render(values, color=random.choice(COLORS))
         channel_id = channel.get("id")
-        self.slack_client.post_chat_message(channel_id, None, [message])
+        messages_to_send = [(channel_id, None, [message], False)]
 
-        # Send direct messages to the invited users
+        # Send direct messages to the invited users. Every message is the same, apart from its color,
+        # so render it once and share it.
+        direct_message = FOMO_DIRECT_MESSAGE.render(values)
+        text = direct_message.pop("pretext")
         for user in interested_users:
-            message = {
-                "color": random.choice(COLORS),
-                "pretext": "*FOMO sufferers of the world rejoice!* :tada: \n<@{creator_display_name}> has created a group that you might want to join",
-                "title": "<#{channel_id}|{channel_name}>",
-                "text": "{channel_purpose}",
-                "footer": "If you don't want to be notified about these, please message <@phillip.piper> and he will remove you",
-                "footer_icon": "https://qresolve.files.wordpress.com/2015/02/information-icon.png"
-            }
-            fancy_message = self._make_formatted_message(message, channel, creator, "")
-            text = fancy_message.get("pretext")
-            del fancy_message["pretext"]
-            self.slack_client.post_chat_message(user.user_id, text, [fancy_message], as_user=True)
+            fancy_message = dict(direct_message, color=random.choice(COLORS))
+            messages_to_send.append((user.user_id, text, [fancy_message], True))
+
+        def send(message_to_send):
+            (target_id, text, attachments, as_user) = message_to_send
+            return self.slack_client.post_chat_message(target_id, text, attachments, as_user=as_user)
+
+        self._fan_out(send, messages_to_send)
 
     def _april_fools_day(self, channel, user):
 
@@ -341,6 +665,7 @@ class Processor:
             self.logger.info("We've already annoyed user '%s'. Skip them now" % creator_id)
             return
 
+        import clippy_messages  # only needed one day a year, so don't load it until then
         channel_id = channel.get("id")
         blocks = random.choice([clippy_messages.NEW_GROUP, clippy_messages.NEW_THREAD])
         self.slack_client.post_chat_message(channel_id, None, blocks=blocks)
@@ -348,8 +673,7 @@ class Processor:
 
     def _set_user_feature(self, user_id, feature_id):
         redis_key = "user-feature:%s:%s" % (user_id, feature_id)
-        self.redis_client.set(redis_key, "true")
-        self.redis_client.expire(redis_key, 60 * 60 * 24)  # only keep this info for 24 hours
+        self.redis_client.set(redis_key, "true", ex=60 * 60 * 24)  # only keep this info for 24 hours
 
     def _get_user_feature(self, user_id, feature_id):
         redis_key = "user-feature:%s:%s" % (user_id, feature_id)
@@ -373,30 +697,16 @@ class Processor:
         if not jira_id:
             return
 
-        link = self.jira_prefix + jira_id
-        message = {
-            "fallback": "This channel is related to this JIRA issue: %s" % link,
-            "color": random.choice(COLORS),
-            "title": "Related JIRA Issue",
-            "text": link
-        }
+        values = self._message_values(channel, user, "", jira_link=self.jira_prefix + jira_id)
+        message = JIRA_LINK.render(values, color=random.choice(COLORS))
         channel_id = channel.get("id")
         self.slack_client.post_chat_message(channel_id, None, [message])
 
         # Warn the author if the channel is just a jira ticket number
         self.logger.debug("%s -> %s" % (channel_name, channel_name_without_prefix))
         if channel_name_without_prefix == jira_id:
-            message = {
-                "fallback": "It's normally best to name a channel with more than just the JIRA issue number",
-                "color": random.choice(COLORS),
-                "title": "Friendly reminder about channel names",
-                "text": "<@{creator_display_name}> It's normally better to have more descriptive channel names.\n\n"
-                        "Renaming this channel to something like *#{channel_name}-what-went-wrong* will prevent the *Powers That Be* from descending in wrath upon your head :smile:\n",
-                "image_url": random.choice(AVALANCHES),
-                "footer": "To rename this channel, click the 'down arrow' icon at the top-left of this channel (next to the channel name), then click the 'Settings' tab, then hover over the 'Channel name' section, and click the 'Edit' button that appears.\n",
-                "footer_icon": "https://qresolve.files.wordpress.com/2015/02/information-icon.png"
-            }
-            fancy_message = self._make_formatted_message(message, channel, user, "")
+            fancy_message = JIRA_NAME_REMINDER.render(values, color=random.choice(COLORS),
+                                                      image_url=random.choice(AVALANCHES))
             self.slack_client.post_chat_message(channel_id, None, [fancy_message])
 
     def _extract_jira_id(self, channel_name):
@@ -417,12 +727,11 @@ class Processor:
         :param channel_name:
         :return: Tuple with (The jira id related to the name or None, the channel name without prefix)
         """
-        for prefix in self.all_channel_prefixes:
-            if channel_name.startswith(prefix):
-                channel_name_without_prefix = channel_name[len(prefix):]
-                match = re.match("([A-Za-z][A-Za-z0-9_]{1,32}-[0-9]{1,32})", channel_name_without_prefix)
-                if match:
-                    return match.group(1), channel_name_without_prefix
+        for prefix in self.route(channel_name).prefixes:
+            channel_name_without_prefix = channel_name[len(prefix):]
+            match = re.match("([A-Za-z][A-Za-z0-9_]{1,32}-[0-9]{1,32})", channel_name_without_prefix)
+            if match:
+                return match.group(1), channel_name_without_prefix
         return None, None
 
     def process_interactive_event(self, event_data):
@@ -446,6 +755,7 @@ class Processor:
         clicked_action = actions[0].get("value", "???")
         self.logger.info("interactive. clicked_action=%s" % clicked_action)
 
+        import clippy_messages
         response = clippy_messages.RESPONSES.get(clicked_action, "unknown action: %s" % clicked_action)
         self.slack_client.update_chat_message(channel_id, ts=message_ts, blocks=response)
 
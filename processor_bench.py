@@ -0,0 +1,306 @@
+"""
+Benchmark how many channel events a Processor can handle, and how its latency behaves when Slack is slow.
+
+    > python processor_bench.py [--events N] [--workers N] [--latency-ms N] [--jitter-ms N] [--rate-limit P]
+                                [--redis-url redis://localhost:6379/15]
+
+Slack is simulated by a fake WebClient (under the real SlackClientWrapper and SlackDispatcher) that adds the
+given latency and jitter to every call, and answers a fraction of calls with HTTP 429. The synthetic events are
+derived from the samples in test-messages.
+
+Starting from a baseline configuration, the benchmark varies one dimension at a time: the number of configured
+prefixes, the number of FOMO users (who are interested in the first 3 prefixes), and the fraction of duplicate
+events. Each run reports throughput and the p50/p95/p99 latency of process_channel_event.
+The interactive (button click) events are reported separately.
+
+Every run uses the in-memory store, and also a real redis if --redis-url is given. The benchmark only adds
+keys with unique channel ids, so it doesn't need to clear the database, but it is best to use a spare one.
+"""
+import argparse
+import copy
+import glob
+import json
+import logging
+import os
+import random
+import string
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from in_memory_redis import InMemoryRedis
+from processor import Processor
+from slack_client_wrapper import SlackClientWrapper
+from slack_dispatcher import RateLimits, SlackDispatcher, TokenBucket
+
+TEST_MESSAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-messages")
+BASELINE = {"prefixes": 10, "fomo_users": 5, "duplicate_ratio": 0.1}
+PREFIX_COUNTS = [1, 10, 100, 1000]
+FOMO_SIZES = [0, 5, 50]
+DUPLICATE_RATIOS = [0.0, 0.5, 0.9]
+
+
+class FakeResponse(dict):
+    """
+    Looks enough like slack's SlackResponse for the SlackClientWrapper
+    """
+
+    @property
+    def data(self):
+        return self
+
+
+class RateLimitedError(Exception):
+    """
+    Looks enough like slack's SlackApiError, for a response with HTTP status 429
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("ratelimited")
+        self.response = type("Response", (), {"status_code": 429, "headers": {"Retry-After": str(retry_after)}})()
+
+
+class FakeWebClient:
+    """
+    A stand-in for slack's WebClient that knows about a workspace of users, and is as slow as we ask it to be
+    """
+
+    def __init__(self, users, latency=0.0, jitter=0.0, rate_limit_probability=0.0, retry_after=0.05, seed=42):
+        self.users = users
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ts = 0
+        self._channel_names = {}
+        self._channel_creators = {}
+
+    def conversations_info(self, channel):
+        self._wait()
+        name = self._channel_names.get(channel, "unknown-" + channel)
+        return FakeResponse(ok=True, channel={
+            "id": channel, "name": name, "creator": self._channel_creators.get(channel) or self.users[0]["id"],
+            "members": [],
+            "purpose": {"value": "Benchmarking %s" % name}
+        })
+
+    def users_info(self, user):
+        self._wait()
+        return FakeResponse(ok=True, user={
+            "id": user, "tz_offset": 0,
+            "profile": {"real_name_normalized": "Bench User", "display_name": "bench.user", "image_32": ""}
+        })
+
+    def users_lookupByEmail(self, email):
+        self._wait()
+        return FakeResponse(ok=False, error="users_not_found")
+
+    def users_list(self, cursor=None, limit=None):
+        self._wait()
+        return FakeResponse(ok=True, members=self.users, response_metadata={"next_cursor": ""})
+
+    def api_call(self, api_method, json=None):
+        self._wait()
+        with self._lock:
+            self._ts += 1
+            ts = "%d.%06d" % (time.time(), self._ts)
+        return FakeResponse(ok=True, channel=json.get("channel"), ts=ts)
+
+    def remember_channels(self, channels):
+        self._channel_names = {channel["id"]: channel["name"] for channel in channels}
+        self._channel_creators = {channel["id"]: channel.get("creator") for channel in channels}
+
+    def _wait(self):
+        (delay, is_rate_limited) = self._next_call()
+        if delay:
+            time.sleep(delay)
+        if is_rate_limited:
+            raise RateLimitedError(self.retry_after)
+
+    def _next_call(self):
+        """
+        :return: (how long the next call takes, whether it is rate limited)
+        """
+        with self._lock:
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            is_rate_limited = self._rng.random() < self.rate_limit_probability
+        return delay, is_rate_limited
+
+
+class UnthrottledRateLimits(RateLimits):
+    """
+    Rate limits whose buckets are bottomless
+    """
+
+    def _bucket(self, name):
+        with self._lock:
+            return self._buckets.setdefault(name, TokenBucket(1e9, 1e9, self._clock))
+
+
+class UnthrottledDispatcher(SlackDispatcher):
+    """
+    The real dispatcher would hold the benchmark to Slack's published rate limits (e.g. 50 conversations.info
+    per minute), which would hide everything else. Keep its retry handling, but make its buckets bottomless.
+    """
+
+    def __init__(self, logger=None, **kwargs):
+        super().__init__(logger, rate_limits=UnthrottledRateLimits(), **kwargs)
+
+
+def load_templates(directory=TEST_MESSAGES):
+    """
+    Load the sample channel events, as (event_type, event_data)
+    """
+    templates = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path) as f:
+            # Some samples have notes after the json, so only read the first document
+            (event_data, _) = json.JSONDecoder().raw_decode(f.read())
+        event_type = {"channel_created": "create", "channel_rename": "rename"}.get(
+            event_data.get("event", {}).get("type"))
+        if event_type:
+            templates.append((event_type, event_data))
+    return templates
+
+
+def random_word(rng, length):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def make_events(rng, templates, prefixes, count, duplicate_ratio, run_id):
+    """
+    Make events for channels whose names start with one of the prefixes.
+    Roughly duplicate_ratio of the events repeat a channel that has already been seen.
+    """
+    events = []
+    channels = []
+    for i in range(count):
+        (event_type, template) = rng.choice(templates)
+        if channels and rng.random() < duplicate_ratio:
+            channel = rng.choice(channels)
+        else:
+            channel = {"id": "C%s%06d" % (run_id, i), "name": rng.choice(prefixes) + random_word(rng, 10)}
+            # Channels are created by many different people, whose profiles aren't cached yet.
+            # Channel created events say who the creator is (rename events might not)
+            if template["event"]["channel"].get("creator"):
+                channel["creator"] = "U%s%06d" % (run_id, i)
+            channels.append(channel)
+        event_data = copy.deepcopy(template)
+        event_data["event"]["channel"].update(channel, created=int(time.time()))
+        events.append((event_type, event_data))
+    return events, channels
+
+
+def make_interactive_events(count):
+    actions = ["click_gtw", "click_chess", "click_civ", "click_die", "click_um", "click_enough"]
+    return [{
+        "actions": [{"value": actions[i % len(actions)]}],
+        "channel": {"id": "CBENCH"},
+        "container": {"message_ts": "1.%06d" % i},
+        "user": {"id": "U%06d" % i, "name": "bench.user"}
+    } for i in range(count)]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))]
+
+
+def drive(fn, items, workers):
+    """
+    Call fn for each item on the given number of threads (like the app's work queue).
+
+    :return: (elapsed seconds, sorted list of the latencies of each call)
+    """
+    def timed(item):
+        start = time.perf_counter()
+        fn(item)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as executor:
+        latencies = sorted(executor.map(timed, items))
+    return time.perf_counter() - start, latencies
+
+
+def report(label, elapsed, latencies):
+    print("  %-28s %10.0f %10.2f %10.2f %10.2f" % (
+        label, len(latencies) / elapsed, percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+        percentile(latencies, 99) * 1000))
+
+
+def make_processor(args, store, prefixes, fomo_users, logger):
+    users = [{"id": "U%06d" % i, "name": "fomo.user%d" % i} for i in range(max(1, fomo_users))]
+    client = FakeWebClient(users, args.latency_ms / 1000.0, args.jitter_ms / 1000.0, args.rate_limit)
+    wrapper = SlackClientWrapper(client, logger, UnthrottledDispatcher(logger))
+    fomo = "%s:%s" % (",".join(prefixes[:3]), " ".join(x["name"] for x in users[:fomo_users])) if fomo_users else None
+    processor = Processor({"#announcements": prefixes}, wrapper, store, logger, fomo_users_as_string=fomo,
+                          fan_out_concurrency=args.fan_out)
+    assert processor.redis_client is store, "the figures must measure the configured store"
+    processor.warm_up(background=False)
+    return processor, client
+
+
+def run_channel_events(args, store, templates, logger, prefix_count, fomo_users, duplicate_ratio):
+    rng = random.Random(prefix_count * 1000 + fomo_users)
+    prefixes = ["%s-" % random_word(rng, rng.randint(2, 8)) for _ in range(prefix_count)]
+    (processor, client) = make_processor(args, store, prefixes, fomo_users, logger)
+    (events, channels) = make_events(rng, templates, prefixes, args.events, duplicate_ratio, uuid.uuid4().hex[:8])
+    client.remember_channels(channels)
+    return drive(lambda event: processor.process_channel_event(*event), events, args.workers)
+
+
+def run_store(args, label, store, templates, logger):
+    print("%s" % label)
+    print("  %-28s %10s %10s %10s %10s" % ("", "events/s", "p50 ms", "p95 ms", "p99 ms"))
+    sweeps = [
+        ("prefixes", PREFIX_COUNTS),
+        ("fomo_users", FOMO_SIZES),
+        ("duplicate_ratio", DUPLICATE_RATIOS),
+    ]
+    for (dimension, values) in sweeps:
+        for value in values:
+            settings = dict(BASELINE, **{dimension: value})
+            (elapsed, latencies) = run_channel_events(args, store, templates, logger, settings["prefixes"],
+                                                      settings["fomo_users"], settings["duplicate_ratio"])
+            report("%s=%s" % (dimension, value), elapsed, latencies)
+
+    (processor, _) = make_processor(args, store, ["bench-"], 0, logger)
+    (elapsed, latencies) = drive(processor.process_interactive_event, make_interactive_events(args.events),
+                                 args.workers)
+    report("interactive events", elapsed, latencies)
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Processor against a simulated Slack")
+    parser.add_argument("--events", type=int, default=500, help="events per run")
+    parser.add_argument("--workers", type=int, default=4, help="threads processing events (like EVENT_WORKERS)")
+    parser.add_argument("--fan-out", type=int, default=8, help="FAN_OUT_CONCURRENCY")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="latency of each call to slack")
+    parser.add_argument("--jitter-ms", type=float, default=2.0, help="random variation of the latency")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of calls answered with HTTP 429")
+    parser.add_argument("--redis-url", help="also run against this redis (e.g. redis://localhost:6379/15)")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("processor_bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    templates = load_templates()
+    print("%d events per run, %d workers, slack latency %.1f +/- %.1f ms, %.1f%% rate limited" % (
+        args.events, args.workers, args.latency_ms, args.jitter_ms, args.rate_limit * 100))
+    print("baseline: %s" % BASELINE)
+    print()
+    run_store(args, "InMemoryRedis", InMemoryRedis(), templates, logger)
+    if args.redis_url:
+        import redis
+        run_store(args, "redis (%s)" % args.redis_url, redis.from_url(args.redis_url), templates, logger)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import random
+import threading
 import unittest
 from mock import MagicMock
 
@@ -235,6 +236,49 @@ class TestProcessor(unittest.TestCase):
         self.assertEqual(["target1", "target2", "target3"],
                          sorted(x.args[0] for x in slack_client.post_chat_message.call_args_list))
 
+    def test_failed_announcement_does_not_stop_others(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO_SUCCESS
+        slack_client.channel_info.return_value = CHANNEL_INFO_SUCCESS_FUN
+        slack_client.post_chat_message.side_effect = \
+            lambda channel, *args, **kwargs: 1 / 0 if channel == "target2" else {"ok": True}
+        logger = MagicMock()
+        prefixes = {"target1": ["fun-"], "target2": ["fun-"], "target3": ["fun-"]}
+
+        processor = Processor(prefixes, slack_client, logger=logger)
+        processor.process_channel_event("create", CREATE_EVENT_FUN)
+
+        self.assertEqual(["target1", "target2", "target3"],
+                         sorted(x.args[0] for x in slack_client.post_chat_message.call_args_list))
+        self.assertEqual(1, logger.exception.call_count)
+
+    def test_create_in_digest_mode(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO_SUCCESS
+        slack_client.channel_info.side_effect = [
+            CHANNEL_INFO_SUCCESS_FUN,
+            {"ok": True, "channel": dict(CHANNEL_INFO_SUCCESS_FUN["channel"], id="CHANNELID3", name="fun-cats")},
+            {"ok": True, "channel": dict(CHANNEL_INFO_SUCCESS_FUN["channel"], id="CHANNELID4", name="fun-birds")},
+        ]
+        events = [
+            CREATE_EVENT_FUN,
+            {"event": {"channel": {"id": "CHANNELID3", "name": "fun-cats"}}},
+            {"event": {"channel": {"id": "CHANNELID4", "name": "fun-birds"}}},
+        ]
+        logger = MagicMock()
+
+        processor = Processor({"target": ["fun-"]}, slack_client, logger=logger, digest_windows={"target": 60})
+        for event in events:
+            processor.process_channel_event("create", event)
+
+        self.assertEqual(1, slack_client.post_chat_message.call_count)  # the rest are held back...
+        processor.flush_digests()
+        self.assertEqual(2, slack_client.post_chat_message.call_count)  # ...and sent together
+        ((posted_channel, posted_text, posted_attachments), _) = slack_client.post_chat_message.call_args
+        self.assertEqual("target", posted_channel)
+        self.assertEqual("2 new channels have been created :tada:", posted_text)
+        self.assertEqual(2, len(posted_attachments))
+
     def test_create_post_notify(self):
         expected_message = {
             "fallback": "This channel is related to this JIRA issue: https://something/jira/browse/PROJ-1234",
@@ -299,8 +343,9 @@ class TestProcessor(unittest.TestCase):
         processor = Processor({"target": ["only-", "accept-", "these-"]}, slack_client, logger=logger)
         processor.process_channel_event("rename", event)
 
-        logger.info.assert_called_with("ignored... channel name doesn't start with the appropriate prefix: %s",
-                                       "dev-so-trial-notify")
+        self.assertEqual("ignored... channel name doesn't start with the appropriate prefix "
+                         "channel=%s name=dev-so-trial-notify" % event["event"]["channel"]["id"],
+                         str(logger.info.call_args[0][0]))
         self.assertFalse(logger.error.called)
         self.assertFalse(slack_client.post_chat_message.called)
 
@@ -320,8 +365,167 @@ class TestProcessor(unittest.TestCase):
 
         self.assertFalse(logger.error.called)
         self.assertFalse(slack_client.post_chat_message.called)
-        logger.info.assert_called_with("ignored... we've already processed this channel: %s/%s", channel_id,
-                                       channel_name)
+        self.assertEqual("ignored... we've already processed this channel channel=%s name=%s" % (
+            channel_id, channel_name), str(logger.info.call_args[0][0]))
+
+    def test_duplicate_event_does_not_touch_redis(self):
+        slack_client = MagicMock()
+        slack_client.channel_info.return_value = {"ok": True, "channel": {
+            "id": "C1", "name": "dev-one", "creator": "U1", "purpose": {"value": "testing"}}}
+        slack_client.user_info.return_value = {"ok": True, "user": {"id": "U1", "profile": {}}}
+        redis = MagicMock(wraps=InMemoryRedis())
+        processor = Processor({"target": ["dev-"]}, slack_client, redis_client=redis, logger=MagicMock())
+        event = {"event": {"channel": {"id": "C1", "name": "dev-one"}}}
+
+        processor.process_channel_event("create", event)
+        processor.process_channel_event("rename", event)
+
+        channel_writes = [x for x in redis.set.call_args_list if x[0][0] == "channel:C1"]
+        self.assertEqual(1, len(channel_writes))
+        self.assertEqual(1, slack_client.post_chat_message.call_count)
+
+    def test_create_with_deferred_purpose(self):
+        channel_info_without_purpose = {
+            "ok": True,
+            "channel": dict(CHANNEL_INFO_SUCCESS["channel"], purpose={"creator": "", "value": ""})
+        }
+        purpose_event = {
+            "type": "event_callback",
+            "event": {
+                "type": "message",
+                "subtype": "channel_purpose",
+                "channel": "CHANNELID1",
+                "purpose": "TESTING THIS",
+                "ts": "1537991037.000200",
+            }
+        }
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO_SUCCESS
+        slack_client.channel_info.return_value = channel_info_without_purpose
+        slack_client.post_chat_message.return_value = {"ok": True, "ts": "1537991036.000300"}
+        logger = MagicMock()
+
+        on_pending_purpose = MagicMock()
+
+        processor = Processor({"target": ["dev-"]}, slack_client, logger=logger, defer_purpose=True,
+                              on_pending_purpose=on_pending_purpose)
+        processor.process_channel_event("create", CREATE_EVENT)
+
+        # The announcement is sent immediately, without waiting for the purpose
+        self.assertFalse(logger.error.called)
+        on_pending_purpose.assert_called_once_with("CHANNELID1")
+        self.assertEqual(1, slack_client.channel_info.call_count)
+        ((_, _, posted_attachments), _) = slack_client.post_chat_message.call_args
+        self.assertEqual("", posted_attachments[0]["text"])
+
+        # When the purpose arrives, the announcement is updated (once only)
+        self.assertTrue(processor.process_purpose_event(purpose_event))
+        self.assertFalse(processor.process_purpose_event(purpose_event))
+        ((updated_channel, updated_ts), updated_kwargs) = slack_client.update_chat_message.call_args
+        self.assertEqual("target", updated_channel)
+        self.assertEqual("1537991036.000300", updated_ts)
+        updated_attachment = updated_kwargs["attachments"][0]
+        self.assertEqual("TESTING THIS", updated_attachment["text"])
+        self.assertEqual(posted_attachments[0]["color"], updated_attachment["color"])
+        self.assertEqual(posted_attachments[0]["author_name"], updated_attachment["author_name"])
+
+    def test_empty_store_is_used(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO_SUCCESS
+        slack_client.channel_info.return_value = CHANNEL_INFO_SUCCESS
+        redis = InMemoryRedis(5)
+
+        processor = Processor({"target": ["dev-"]}, slack_client, redis, logger=MagicMock())
+        processor.process_channel_event("create", CREATE_EVENT)
+
+        self.assertIs(redis, processor.redis_client)
+        self.assertIsNotNone(redis.get("channel:CHANNELID1"))
+
+    def test_only_announcements_without_purpose_are_pending(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO_SUCCESS
+        slack_client.channel_info.return_value = CHANNEL_INFO_SUCCESS
+        slack_client.post_chat_message.return_value = {"ok": True, "ts": "1537991036.000300"}
+        on_pending_purpose = MagicMock()
+
+        processor = Processor({"target": ["dev-"]}, slack_client, logger=MagicMock(), defer_purpose=True,
+                              on_pending_purpose=on_pending_purpose)
+        processor.process_channel_event("create", CREATE_EVENT)  # has a purpose
+        processor.process_channel_event("create", CREATE_EVENT)  # duplicate
+        processor.process_channel_event("create", CREATE_EVENT_FUN)  # unwanted prefix
+
+        self.assertFalse(on_pending_purpose.called)
+
+    def test_create_notifies_fomo_users(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO_SUCCESS
+        slack_client.channel_info.return_value = CHANNEL_INFO_SUCCESS
+        slack_client.users_pages.return_value = [([
+            {"name": "fred.hole", "id": "UFRED"},
+            {"name": "phillip.piper", "id": "USERID1"},
+        ], None)]
+        logger = MagicMock()
+
+        processor = Processor({"target": ["dev-"]}, slack_client, logger=logger,
+                              fomo_users_as_string="dev-,ops-:fred.hole phillip.piper|other-:boss.man")
+        self.assertFalse(slack_client.users_pages.called)  # users are only fetched when needed
+        processor.process_channel_event("create", CREATE_EVENT)
+
+        self.assertFalse(logger.error.called)
+        self.assertEqual(1, slack_client.users_pages.call_count)
+        posted_channels = [x.args[0] for x in slack_client.post_chat_message.call_args_list]
+        # Announcement, list of FOMO users in the new channel, and a DM to the one user who isn't a member
+        self.assertEqual(["target", "CHANNELID1", "UFRED"], posted_channels)
+
+    def test_creator_is_fetched_while_the_channel_is_fetched(self):
+        creator_fetch_started = threading.Event()
+        slack_client = MagicMock()
+        slack_client.user_info.side_effect = lambda user_id: creator_fetch_started.set() or USER_INFO_SUCCESS
+        # The channel can only be fetched once the fetch of the creator has started
+        slack_client.channel_info.side_effect = lambda channel_id: \
+            creator_fetch_started.wait(5) and CHANNEL_INFO_SUCCESS_FUN
+        logger = MagicMock()
+
+        processor = Processor({"target": ["fun-"]}, slack_client, logger=logger)
+        processor.process_channel_event("create", CREATE_EVENT_FUN)
+
+        self.assertFalse(logger.error.called)
+        slack_client.user_info.assert_called_once_with("CREATORID2")
+        self.assertTrue(slack_client.post_chat_message.called)
+
+    def test_creator_is_fetched_again_if_the_event_was_wrong(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO_SUCCESS
+        slack_client.channel_info.return_value = CHANNEL_INFO_SUCCESS
+
+        processor = Processor({"target": ["dev-"]}, slack_client, logger=MagicMock())
+        processor.process_channel_event("create", CREATE_EVENT)
+
+        self.assertEqual(["CREATORID1", "USERID1"], [x.args[0] for x in slack_client.user_info.call_args_list])
+
+    def test_creator_is_fetched_after_the_channel_without_a_fan_out_executor(self):
+        calls = []
+        slack_client = MagicMock()
+        slack_client.user_info.side_effect = lambda user_id: calls.append("user_info") or USER_INFO_SUCCESS
+        slack_client.channel_info.side_effect = \
+            lambda channel_id: calls.append("channel_info") or CHANNEL_INFO_SUCCESS_FUN
+
+        processor = Processor({"target": ["fun-"]}, slack_client, logger=MagicMock(), fan_out_concurrency=1)
+        processor.process_channel_event("create", CREATE_EVENT_FUN)
+
+        self.assertEqual(["channel_info", "user_info"], calls)
+
+    def test_route(self):
+        slack_client = MagicMock()
+        prefixes = {"target1": ["dev-", "dev-so-"], "target2": ["dev-"], "target3": ["ops-"]}
+        processor = Processor(prefixes, slack_client)
+
+        route = processor.route("dev-so-trial-notify")
+        self.assertEqual(["dev-so-", "dev-"], route.prefixes)
+        self.assertEqual(["target1", "target2"], sorted(route.target_channels))
+        self.assertEqual([], route.interested_users)
+        self.assertEqual(["fun-"], processor.route("fun-dogs").prefixes)  # april fools prefixes are always included
+        self.assertEqual([], processor.route("biz-excel").prefixes)
 
     def test_jira_id_extraction(self):
         slack_client = MagicMock()
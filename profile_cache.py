@@ -0,0 +1,158 @@
+"""
+Cache the profiles of the users that create channels, so we don't have to call 'users.info' every time.
+"""
+import json
+import logging
+import threading
+
+import metrics
+from toolbox import nested_get
+from ttl_cache import TtlLruCache
+
+REDIS_KEY_USER_PROFILE = "user-profile:%s"
+
+# Profiles hardly ever change, but we don't want to show an old name or avatar for too long
+PROFILE_TTL_IN_SECONDS = 60 * 60
+
+# Each projected profile is a few hundred bytes, so this keeps the in-process cache well under 1MB
+PROFILE_CACHE_MAX_SIZE = 1000
+
+PROFILE_LOOKUPS = metrics.REGISTRY.counter("telltale_profile_cache_lookups_total",
+                                           "Lookups of user profiles, by where the profile was found",
+                                           ["outcome"])
+
+
+def project_profile(user):
+    """
+    Return only the parts of the given user that are needed to make notification messages
+    """
+    return {
+        "id": user.get("id"),
+        "tz_offset": user.get("tz_offset", 0),
+        "enterprise_user": {"id": nested_get(user, "enterprise_user", "id")},
+        "profile": {
+            "real_name_normalized": nested_get(user, "profile", "real_name_normalized"),
+            "display_name": nested_get(user, "profile", "display_name"),
+            "image_32": nested_get(user, "profile", "image_32"),
+        }
+    }
+
+
+class ProfileCache:
+    """
+    A two level cache in front of 'users.info': an in-process LRU cache, backed by redis (which is shared
+    between processes). Only the projected profile is cached.
+    """
+
+    def __init__(self, slack_client, redis_client, logger=None, max_size=PROFILE_CACHE_MAX_SIZE,
+                 ttl=PROFILE_TTL_IN_SECONDS):
+        self.slack_client = slack_client
+        self.redis_client = redis_client
+        self.logger = logger or logging.getLogger("ProfileCache")
+        self.ttl = ttl
+        self._local = TtlLruCache(max_size, ttl)
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def user_info(self, user_id):
+        """
+        Return the same structure as 'users.info', but the user only contains the projected profile
+        """
+        response = self._from_local(user_id) or self._from_redis(user_id, self.redis_client.get(
+            REDIS_KEY_USER_PROFILE % user_id))
+        if response:
+            return response
+
+        self._count_miss()
+        user_info = self.slack_client.user_info(user_id)
+        if not user_info or not user_info.get("ok"):
+            return user_info
+
+        (response, cached) = self._remember(user_id, user_info)
+        self.redis_client.set(REDIS_KEY_USER_PROFILE % user_id, cached, ex=self.ttl)
+        return response
+
+    def _from_local(self, user_id):
+        profile = self._local.get(user_id)
+        if profile:
+            PROFILE_LOOKUPS.inc(outcome="local_hit")
+            with self._lock:
+                self.local_hits += 1
+            return {"ok": True, "user": profile}
+        return None
+
+    def _from_redis(self, user_id, cached):
+        if cached:
+            try:
+                profile = json.loads(cached)
+                PROFILE_LOOKUPS.inc(outcome="redis_hit")
+                with self._lock:
+                    self.redis_hits += 1
+                self._local.put(user_id, profile)
+                return {"ok": True, "user": profile}
+            except:
+                self.logger.exception("failed to load profile of %s from redis", user_id, exc_info=True)
+        return None
+
+    def _count_miss(self):
+        PROFILE_LOOKUPS.inc(outcome="miss")
+        with self._lock:
+            self.misses += 1
+
+    def _remember(self, user_id, user_info):
+        """
+        Remember the projected profile from the given response of 'users.info' in the in-process cache.
+        Return the response to give to the caller, and the value to store in redis.
+        """
+        profile = project_profile(user_info.get("user"))
+        self._local.put(user_id, profile)
+        return {"ok": True, "user": profile}, json.dumps(profile)
+
+    def invalidate(self, user_id):
+        """
+        Forget the profile of the given user (e.g. because they have changed it)
+        """
+        self._local.pop(user_id)
+        self.redis_client.delete(REDIS_KEY_USER_PROFILE % user_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._local),
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+            }
+
+
+class AsyncProfileCache:
+    """
+    The same cache as the given ProfileCache (sharing its in-process cache), for asyncio callers.
+    The given slack and redis clients are the asyncio ones.
+    """
+
+    def __init__(self, profile_cache, slack_client, redis_client):
+        self.profile_cache = profile_cache
+        self.slack_client = slack_client
+        self.redis_client = redis_client
+
+    async def user_info(self, user_id):
+        """
+        Return the same structure as 'users.info', but the user only contains the projected profile
+        """
+        cache = self.profile_cache
+        response = cache._from_local(user_id) or cache._from_redis(user_id, await self.redis_client.get(
+            REDIS_KEY_USER_PROFILE % user_id))
+        if response:
+            return response
+
+        cache._count_miss()
+        user_info = await self.slack_client.user_info(user_id)
+        if not user_info or not user_info.get("ok"):
+            return user_info
+
+        (response, cached) = cache._remember(user_id, user_info)
+        await self.redis_client.set(REDIS_KEY_USER_PROFILE % user_id, cached, ex=cache.ttl)
+        return response
@@ -0,0 +1,105 @@
+import asyncio
+import unittest
+from mock import MagicMock
+
+from in_memory_redis import InMemoryRedis
+from async_store import AsyncStore
+from profile_cache import PROFILE_LOOKUPS, AsyncProfileCache, ProfileCache
+
+USER_INFO = {
+    "ok": True,
+    "user": {
+        "id": "USERID1",
+        "name": "phillip.piper",
+        "tz_offset": 36000,
+        "profile": {
+            "display_name": "phillip.piper",
+            "email": "phillip.piper@thetradedesk.com",
+            "image_32": "https://avatars.slack-edge.com/32.jpg",
+            "image_1024": "https://avatars.slack-edge.com/1024.jpg",
+            "real_name_normalized": "Phillip Piper",
+        },
+    }
+}
+
+
+class TestProfileCache(unittest.TestCase):
+
+    def test_profile_is_projected_and_cached(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO
+        cache = ProfileCache(slack_client, InMemoryRedis(), logger=MagicMock())
+        (local_hits, misses) = (PROFILE_LOOKUPS.value(outcome="local_hit"), PROFILE_LOOKUPS.value(outcome="miss"))
+
+        first = cache.user_info("USERID1")
+        second = cache.user_info("USERID1")
+
+        self.assertEqual(first, second)
+        self.assertEqual(1, slack_client.user_info.call_count)
+        self.assertEqual("Phillip Piper", first["user"]["profile"]["real_name_normalized"])
+        self.assertEqual(36000, first["user"]["tz_offset"])
+        self.assertNotIn("email", first["user"]["profile"])
+        self.assertEqual({"size": 1, "local_hits": 1, "redis_hits": 0, "misses": 1}, cache.stats())
+        self.assertEqual(local_hits + 1, PROFILE_LOOKUPS.value(outcome="local_hit"))
+        self.assertEqual(misses + 1, PROFILE_LOOKUPS.value(outcome="miss"))
+
+    def test_redis_is_shared_between_caches(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO
+        redis = InMemoryRedis()
+        ProfileCache(slack_client, redis, logger=MagicMock()).user_info("USERID1")
+
+        other_cache = ProfileCache(slack_client, redis, logger=MagicMock())
+        other_cache.user_info("USERID1")
+
+        self.assertEqual(1, slack_client.user_info.call_count)
+        self.assertEqual(1, other_cache.stats()["redis_hits"])
+
+    def test_failures_are_not_cached(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = {"ok": False, "error": "user_not_found"}
+        cache = ProfileCache(slack_client, InMemoryRedis(), logger=MagicMock())
+
+        self.assertFalse(cache.user_info("USERID1")["ok"])
+        self.assertFalse(cache.user_info("USERID1")["ok"])
+        self.assertEqual(2, slack_client.user_info.call_count)
+
+    def test_invalidate(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO
+        cache = ProfileCache(slack_client, InMemoryRedis(), logger=MagicMock())
+        cache.user_info("USERID1")
+
+        cache.invalidate("USERID1")
+        cache.user_info("USERID1")
+
+        self.assertEqual(2, slack_client.user_info.call_count)
+
+
+class TestAsyncProfileCache(unittest.TestCase):
+
+    def test_profile_is_cached_for_both_caches(self):
+        calls = []
+
+        class AsyncSlackClient:
+            async def user_info(self, user_id):
+                calls.append(user_id)
+                return USER_INFO
+
+        redis = InMemoryRedis()
+        cache = ProfileCache(MagicMock(), redis, logger=MagicMock())
+        async_cache = AsyncProfileCache(cache, AsyncSlackClient(), AsyncStore(redis, inline=True))
+
+        first = asyncio.run(async_cache.user_info("USERID1"))
+        second = cache.user_info("USERID1")
+
+        self.assertEqual(first, second)
+        self.assertEqual(["USERID1"], calls)
+        self.assertEqual("Phillip Piper", first["user"]["profile"]["real_name_normalized"])
+        self.assertNotIn("email", first["user"]["profile"])
+        self.assertIsNotNone(redis.get("user-profile:USERID1"))
+        self.assertEqual({"size": 1, "local_hits": 1, "redis_hits": 0, "misses": 1}, cache.stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Measure the memory used by the in-process cache of seen channel ids, and how fast it answers.
+
+    > python seen_channels_bench.py [number_of_ids]
+
+The Processor uses a RotatingSet (two generations of plain sets). TtlLruCache, which keeps an expiry time and
+the order of use for every key, and a single set, which never forgets anything, are shown for comparison.
+The memory includes the channel id strings themselves.
+"""
+import sys
+import time
+import tracemalloc
+
+from processor import SEEN_CHANNELS_TTL_IN_SECONDS
+from ttl_cache import RotatingSet, TtlLruCache
+
+
+def measure(label, count, make, add):
+    tracemalloc.start()
+    (before, _) = tracemalloc.get_traced_memory()
+    container = make()
+    for i in range(count):
+        add(container, "C%08X" % i)
+    (after, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ids = ["C%08X" % i for i in range(count)]
+    start = time.perf_counter()
+    hits = sum(1 for channel_id in ids if channel_id in container)
+    elapsed = time.perf_counter() - start
+    print("%-14s %10.1f MB %10.0f bytes/id %10.2f us/lookup %10d hits" % (
+        label, (after - before) / 1e6, (after - before) / count, elapsed * 1e6 / count, hits))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("%d channel ids" % count)
+    # Big enough that the rotating set doesn't rotate during the measurement
+    measure("RotatingSet", count, lambda: RotatingSet(count * 4, SEEN_CHANNELS_TTL_IN_SECONDS),
+            lambda seen, channel_id: seen.add(channel_id))
+    measure("TtlLruCache", count, lambda: TtlLruCache(count, SEEN_CHANNELS_TTL_IN_SECONDS),
+            lambda cache, channel_id: cache.put(channel_id, True))
+    measure("set", count, set, lambda ids, channel_id: ids.add(channel_id))
+
+
+if __name__ == "__main__":
+    main()
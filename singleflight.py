@@ -0,0 +1,153 @@
+"""
+Collapse concurrent identical calls into one.
+
+When several threads ask for the same thing at the same time (e.g. the info of a channel that several duplicate
+events are about), only the first thread makes the call. The others wait for it, and share its result.
+AsyncSingleFlight does the same for coroutines.
+
+RedisSingleFlight does the same for processes that share a redis, using a lock in redis. Followers in other
+processes can't be handed the result directly, so the call should store its result somewhere they can find it.
+"""
+import asyncio
+import threading
+import time
+import uuid
+
+import metrics
+
+COALESCED_CALLS = metrics.REGISTRY.counter("telltale_coalesced_calls_total",
+                                           "Calls that waited for an identical call that was already in flight",
+                                           ["name"])
+
+# The result that AsyncSingleFlight gives followers when the leader is cancelled, so they can try again
+_CANCELLED = object()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Make sure that only one call for each key is in flight at once (in this process)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Return fn(*args, **kwargs), unless a call with the same key is already in flight, in which case wait
+        for that call and return its result (or raise its exception)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            COALESCED_CALLS.inc(name=self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    The same as SingleFlight, for coroutines running on one asyncio event loop
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> asyncio.Future
+
+    async def do(self, key, fn, *args, **kwargs):
+        """
+        Return await fn(*args, **kwargs), unless a call with the same key is already in flight, in which case wait
+        for that call and return its result (or raise its exception).
+
+        If the call that is being waited for is cancelled, the followers aren't: one of them makes the call instead.
+        """
+        call = self._calls.get(key)
+        while call is not None:
+            COALESCED_CALLS.inc(name=self.name)
+            result = await asyncio.shield(call)
+            if result is not _CANCELLED:
+                return result
+            call = self._calls.get(key)
+
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn(*args, **kwargs)
+            call.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            call.set_result(_CANCELLED)
+            raise
+        except BaseException as e:
+            call.set_exception(e)
+            # If nobody else was waiting, don't complain that the exception was never retrieved
+            call.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+
+class RedisSingleFlight:
+    """
+    Make sure that only one call for each key is in flight at once, across all the processes that share a redis.
+
+    The lock expires after ttl seconds, in case the process that holds it dies. It is released by checking that
+    it is still ours and then deleting it, which isn't atomic, so the ttl should be much longer than the call.
+    """
+
+    def __init__(self, name, redis_client, ttl=10 * 60, wait_seconds=60, poll_seconds=0.5, sleep=time.sleep):
+        self.name = name
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.wait_seconds = wait_seconds
+        self.poll_seconds = poll_seconds
+        self._sleep = sleep
+
+    def do(self, key, fn, when_done=None):
+        """
+        Return fn(), unless another process is already making the call with the same key. In that case, wait
+        (up to wait_seconds) for it to finish, then return when_done() (e.g. to read the result that the call
+        stored), or None.
+        """
+        lock_key = "lock:%s:%s" % (self.name, key)
+        token = uuid.uuid4().hex
+        if self.redis_client.set(lock_key, token, ex=self.ttl, nx=True):
+            try:
+                return fn()
+            finally:
+                if _decode(self.redis_client.get(lock_key)) == token:
+                    self.redis_client.delete(lock_key)
+
+        COALESCED_CALLS.inc(name=self.name)
+        deadline = time.monotonic() + self.wait_seconds
+        while self.redis_client.get(lock_key) is not None and time.monotonic() < deadline:
+            self._sleep(self.poll_seconds)
+        return when_done() if when_done else None
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
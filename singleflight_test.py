@@ -0,0 +1,201 @@
+import asyncio
+import threading
+import time
+import unittest
+from mock import MagicMock
+
+from async_slack_client_wrapper import AsyncSlackClientWrapper
+from in_memory_redis import InMemoryRedis
+from singleflight import COALESCED_CALLS, AsyncSingleFlight, RedisSingleFlight, SingleFlight
+from slack_client_wrapper import SlackClientWrapper
+
+
+def wait_for_followers(name, count, before):
+    """
+    Wait until the given number of calls are waiting for an identical call
+    """
+    deadline = time.monotonic() + 5
+    while COALESCED_CALLS.value(name=name) < before + count and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def run_in_threads(count, fn):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fn())) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        flights = SingleFlight("test_coalesced")
+        before = COALESCED_CALLS.value(name="test_coalesced")
+
+        def fetch(channel_id):
+            wait_for_followers("test_coalesced", 4, before)
+            return {"ok": True, "id": channel_id}
+
+        fn = MagicMock(side_effect=fetch)
+
+        results = run_in_threads(5, lambda: flights.do("C1", fn, "C1"))
+
+        self.assertEqual(1, fn.call_count)
+        self.assertEqual([{"ok": True, "id": "C1"}] * 5, results)
+        self.assertEqual({}, flights._calls)
+
+    def test_calls_after_the_first_has_finished_are_made_again(self):
+        flights = SingleFlight("test")
+        fn = MagicMock(return_value=1)
+
+        flights.do("C1", fn)
+        flights.do("C1", fn)
+        flights.do("C2", fn)
+
+        self.assertEqual(3, fn.call_count)
+
+    def test_followers_get_the_exception(self):
+        flights = SingleFlight("test_exception")
+        before = COALESCED_CALLS.value(name="test_exception")
+
+        def fail():
+            wait_for_followers("test_exception", 1, before)
+            raise ValueError("slack is down")
+
+        def call():
+            try:
+                flights.do("C1", fail)
+            except ValueError as e:
+                return e
+
+        errors = run_in_threads(2, call)
+
+        self.assertEqual(2, len([x for x in errors if isinstance(x, ValueError)]))
+
+    def test_wrapper_coalesces_channel_info(self):
+        before = COALESCED_CALLS.value(name="slack")
+
+        def conversations_info(channel):
+            wait_for_followers("slack", 2, before)
+            return MagicMock(data={"ok": True, "channel": {"id": channel}})
+
+        client = MagicMock()
+        client.conversations_info.side_effect = conversations_info
+        wrapper = SlackClientWrapper(client, MagicMock(), MagicMock(call=lambda method, fn, **kwargs: fn()))
+
+        results = run_in_threads(3, lambda: wrapper.channel_info("C1"))
+
+        self.assertEqual(1, client.conversations_info.call_count)
+        self.assertEqual([{"ok": True, "channel": {"id": "C1"}}] * 3, results)
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        flights = AsyncSingleFlight("test_async")
+        calls = []
+
+        async def fetch(channel):
+            calls.append(channel)
+            await asyncio.sleep(0.01)
+            return {"id": channel}
+
+        async def fetch_all():
+            return await asyncio.gather(*[flights.do("C1", fetch, "C1") for _ in range(3)])
+
+        self.assertEqual([{"id": "C1"}] * 3, asyncio.run(fetch_all()))
+        self.assertEqual(["C1"], calls)
+        self.assertEqual({}, flights._calls)
+
+    def test_followers_get_the_exception(self):
+        flights = AsyncSingleFlight("test_async_exception")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("slack is down")
+
+        async def fetch_all():
+            return await asyncio.gather(*[flights.do("C1", fail) for _ in range(2)], return_exceptions=True)
+
+        errors = asyncio.run(fetch_all())
+
+        self.assertEqual(2, len([x for x in errors if isinstance(x, ValueError)]))
+
+    def test_follower_is_not_cancelled_with_the_leader(self):
+        flights = AsyncSingleFlight("test_async_cancel")
+        calls = []
+
+        async def fetch(channel):
+            calls.append(channel)
+            await asyncio.sleep(0.01)
+            return {"id": channel}
+
+        async def cancel_the_leader():
+            leader = asyncio.ensure_future(flights.do("C1", fetch, "C1"))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flights.do("C1", fetch, "C1"))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual({"id": "C1"}, asyncio.run(cancel_the_leader()))
+        self.assertEqual(["C1", "C1"], calls)  # the follower made the call again
+        self.assertEqual({}, flights._calls)
+
+    def test_async_wrapper_coalesces_channel_info(self):
+        client = MagicMock()
+        calls = []
+
+        async def conversations_info(channel):
+            calls.append(channel)
+            await asyncio.sleep(0.01)
+            return MagicMock(data={"ok": True, "channel": {"id": channel}})
+
+        async def call(method, fn, **kwargs):
+            return await fn()
+
+        client.conversations_info.side_effect = lambda channel: conversations_info(channel)
+        wrapper = AsyncSlackClientWrapper(client, MagicMock(), MagicMock(call=call))
+
+        async def fetch_all():
+            return await asyncio.gather(*[wrapper.channel_info("C1") for _ in range(3)])
+
+        self.assertEqual([{"ok": True, "channel": {"id": "C1"}}] * 3, asyncio.run(fetch_all()))
+        self.assertEqual(["C1"], calls)
+
+
+class TestRedisSingleFlight(unittest.TestCase):
+
+    def test_leader_runs_and_releases_the_lock(self):
+        redis = InMemoryRedis()
+        flights = RedisSingleFlight("sync", redis)
+
+        self.assertEqual("done", flights.do("users", lambda: "done"))
+        self.assertEqual("again", flights.do("users", lambda: "again"))
+        self.assertIsNone(redis.get("lock:sync:users"))
+
+    def test_follower_waits_for_the_other_process(self):
+        redis = InMemoryRedis()
+        redis.set("lock:sync:users", "another process", ex=60)
+        sleep = MagicMock(side_effect=lambda seconds: redis.delete("lock:sync:users"))
+        flights = RedisSingleFlight("sync", redis, sleep=sleep)
+        fn = MagicMock()
+
+        self.assertEqual("stored", flights.do("users", fn, when_done=lambda: "stored"))
+
+        self.assertFalse(fn.called)
+        self.assertEqual(1, sleep.call_count)
+
+    def test_follower_gives_up_waiting(self):
+        redis = InMemoryRedis()
+        redis.set("lock:sync:users", "another process", ex=60)
+        flights = RedisSingleFlight("sync", redis, wait_seconds=0)
+
+        self.assertIsNone(flights.do("users", MagicMock()))
+
+
+if __name__ == '__main__':
+    unittest.main()
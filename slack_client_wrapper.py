@@ -1,72 +1,141 @@
-import json
 import toolbox
+from singleflight import SingleFlight
+from slack_dispatcher import SlackDispatcher
+from structured_log import StructuredLogger
+
+# The number of users fetched by each call to 'users.list'. Slack recommends no more than 200
+USERS_PAGE_SIZE = 200
+
+
+class SlackClientError(Exception):
+    """
+    Slack answered a call, but said that it failed. The error is Slack's error code (e.g. "invalid_cursor")
+    """
+
+    def __init__(self, method, error):
+        super().__init__("'%s' failed: %s" % (method, error))
+        self.error = error
 
 
 class SlackClientWrapper:
     """
     This class is a wrapper around the raw slack client provided by Slack.
     It principally allows calls to Slack to be mocked out.
+
+    All calls go through a dispatcher that keeps them within Slack's rate limits. Concurrent requests for the info
+    of the same channel or user are made only once, and share the response.
     """
 
-    def __init__(self, client, logger=None):
+    def __init__(self, client, logger=None, dispatcher=None):
         self.client = client
         self.logger = logger or toolbox.null_logger()
+        self.log = StructuredLogger(self.logger)
+        self.dispatcher = dispatcher or SlackDispatcher(logger)
+        self._flights = SingleFlight("slack")
 
     def channel_info(self, channel_id):
-        self.logger.info("calling 'conversations.info': %s", channel_id)
-        resp = self.client.conversations_info(channel=channel_id)
-        return resp.data if resp else None
+        return self._flights.do(("conversations.info", channel_id), self._channel_info, channel_id)
 
     def user_info(self, user_id):
-        self.logger.info("calling 'users.info': %s", user_id)
-        resp = self.client.users_info(user=user_id)
+        return self._flights.do(("users.info", user_id), self._user_info, user_id)
+
+    def _channel_info(self, channel_id):
+        self.log.sample("calling slack", method="conversations.info", channel=channel_id)
+        resp = self.dispatcher.call("conversations.info", lambda: self.client.conversations_info(channel=channel_id))
+        return resp.data if resp else None
+
+    def _user_info(self, user_id):
+        self.log.sample("calling slack", method="users.info", user=user_id)
+        resp = self.dispatcher.call("users.info", lambda: self.client.users_info(user=user_id))
+        return resp.data if resp else None
+
+    def user_by_email(self, email):
+        # Only the user name: the whole email address is personal data that doesn't belong in the logs
+        self.log.sample("calling slack", method="users.lookupByEmail", user=email.partition("@")[0])
+        resp = self.dispatcher.call("users.lookupByEmail", lambda: self.client.users_lookupByEmail(email=email))
         return resp.data if resp else None
 
     def users(self):
-        self.logger.info("calling 'users.list'")
-        response = self.client.users_list()
-        users = []
-        while response.get("ok"):
-            users.extend(response.get("members"))
-            next_cursor = toolbox.nested_get(response.data, "response_metadata", "next_cursor")
-            if next_cursor:
-                response = self.client.users_list(cursor=next_cursor)
-            else:
-                break
+        """
+        Return every user in the workspace (just their name and id). For big workspaces, use users_pages() instead.
+        """
+        users = [user for (page, _) in self.users_pages() for user in page]
         self.logger.info("found %d users", len(users))
         return users
 
+    def users_pages(self, cursor=None, limit=USERS_PAGE_SIZE):
+        """
+        Yield each page of 'users.list', starting at the given cursor, as a tuple of (users, cursor of the next page).
+        Each user only has its name and id. The cursor of the last page is None.
+        """
+        while True:
+            self.logger.info("calling 'users.list' (cursor: %s)", cursor)
+            try:
+                response = self.dispatcher.call("users.list",
+                                                lambda: self.client.users_list(cursor=cursor, limit=limit))
+            except Exception as e:
+                # slack's WebClient raises SlackApiError, with the response, when the answer isn't ok
+                error = _slack_error(e)
+                if error is None:
+                    raise
+                raise SlackClientError("users.list", error) from e
+            if not response.get("ok"):
+                raise SlackClientError("users.list", response.get("error"))
+            users = [{"name": user.get("name"), "id": user.get("id")} for user in response.get("members") or []]
+            cursor = toolbox.nested_get(response.data, "response_metadata", "next_cursor") or None
+            yield (users, cursor)
+            if not cursor:
+                break
+
     def post_chat_message(self, channel_id, text=None, attachments=[], blocks=None, as_user=False):
-        self.logger.info("sending to %s: text=%s, attachments=%s, blocks=%s", channel_id, text, json.dumps(attachments),
-                         json.dumps(blocks))
-        return self.client.api_call(
-            api_method="chat.postMessage",
-            json={
-                'channel': channel_id,
-                'text': text,
-                'unfurl_media': True,
-                'as_user': as_user,
-                'attachments': attachments or None,
-                'blocks': blocks
-            }
-        )
+        self.log.sample("calling slack", method="chat.postMessage", channel=channel_id, text=text,
+                        attachments=attachments, blocks=blocks)
+        body = post_message_body(channel_id, text, attachments, blocks, as_user)
+        return self.dispatcher.call("chat.postMessage", lambda: self.client.api_call(
+            api_method="chat.postMessage", json=body), channel=channel_id)
 
     def update_chat_message(self, channel_id, ts, text=None, attachments=[], blocks=None):
-        self.logger.info("updating msg %s/%s: text=%s, attachments=%s, blocks=%s", channel_id, ts, text,
-                         json.dumps(attachments), json.dumps(blocks))
-        return self.client.api_call(
-            api_method="chat.update",
-            json={
-                'channel': channel_id,
-                'ts': ts,
-                'parse': "full",
-                'link_names': True,
-                'unfurl_media': True,
-                'text': text,
-                'attachments': attachments or None,
-                'blocks': blocks
-            }
-        )
+        self.log.sample("calling slack", method="chat.update", channel=channel_id, ts=ts, text=text,
+                        attachments=attachments, blocks=blocks)
+        body = update_message_body(channel_id, ts, text, attachments, blocks)
+        return self.dispatcher.call("chat.update", lambda: self.client.api_call(
+            api_method="chat.update", json=body), channel=channel_id)
+
+
+def post_message_body(channel_id, text=None, attachments=None, blocks=None, as_user=False):
+    """
+    Return the body of a 'chat.postMessage' request (for both the synchronous and the asyncio wrappers)
+    """
+    return {
+        'channel': channel_id,
+        'text': text,
+        'unfurl_media': True,
+        'as_user': as_user,
+        'attachments': attachments or None,
+        'blocks': blocks
+    }
+
 
+def update_message_body(channel_id, ts, text=None, attachments=None, blocks=None):
+    """
+    Return the body of a 'chat.update' request (for both the synchronous and the asyncio wrappers)
+    """
+    return {
+        'channel': channel_id,
+        'ts': ts,
+        'parse': "full",
+        'link_names': True,
+        'unfurl_media': True,
+        'text': text,
+        'attachments': attachments or None,
+        'blocks': blocks
+    }
 
 
+def _slack_error(e):
+    """
+    Return the error code in the response of a SlackApiError, or None if the exception isn't one
+    """
+    response = getattr(e, "response", None)
+    error = response.get("error") if callable(getattr(response, "get", None)) else None
+    return error if isinstance(error, str) else None
@@ -0,0 +1,366 @@
+"""
+Keep calls to the Slack Web API within Slack's rate limits, and retry calls that fail for transient reasons.
+
+See https://api.slack.com/docs/rate-limits
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Slack's rate limit tiers, in calls per minute
+TIER_1 = 1
+TIER_2 = 20
+TIER_3 = 50
+TIER_4 = 100
+
+METHOD_TIERS = {
+    "chat.update": TIER_3,
+    "conversations.info": TIER_3,
+    "users.info": TIER_4,
+    "users.list": TIER_2,
+    "users.lookupByEmail": TIER_3,
+}
+
+# chat.postMessage has its own special limit: about one message per second, per channel,
+# with short bursts allowed. There is also a workspace wide limit of several hundred per minute.
+SPECIAL_METHOD_RATES = {
+    "chat.postMessage": 300,
+}
+PER_CHANNEL_METHODS = {"chat.postMessage"}
+PER_CHANNEL_RATE_PER_SECOND = 1.0
+PER_CHANNEL_BURST = 3
+
+MAX_RETRIES = 3
+BACKOFF_BASE_IN_SECONDS = 0.5
+BACKOFF_MAX_IN_SECONDS = 30
+
+SLACK_CALLS = metrics.REGISTRY.counter("telltale_slack_api_calls_total", "Calls to the Slack Web API, by method and outcome",
+                                       ["method", "outcome"])
+SLACK_SECONDS = metrics.REGISTRY.histogram("telltale_slack_api_seconds",
+                                           "Latency of calls to the Slack Web API (excluding waits for rate limits)",
+                                           ["method"])
+SLACK_RETRIES = metrics.REGISTRY.counter("telltale_slack_api_retries_total",
+                                         "Calls to the Slack Web API that were retried, by method and reason",
+                                         ["method", "reason"])
+
+
+class TokenBucket:
+    """
+    A classic token bucket: tokens are added at a fixed rate, up to the capacity of the bucket.
+    Each call takes one token.
+    """
+
+    def __init__(self, rate_per_second, capacity, clock=time.monotonic):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._blocked_until = 0.0
+
+    def remaining(self):
+        """
+        Return the number of calls that could be made right now
+        """
+        self._refill()
+        return 0 if self._clock() < self._blocked_until else int(self._tokens)
+
+    def take(self):
+        """
+        Take a token if one is available.
+
+        :return: 0 if a token was taken, otherwise the number of seconds until one will be available
+        """
+        self._refill()
+        now = self._clock()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate_per_second
+
+    def is_idle(self):
+        """
+        Return True if the bucket is full and not blocked, so a new bucket would be just the same
+        """
+        self._refill()
+        return self._tokens >= self.capacity and self._clock() >= self._blocked_until
+
+    def give_back(self):
+        """
+        Return a token that was taken but not used
+        """
+        self._tokens = min(self.capacity, self._tokens + 1)
+
+    def block(self, seconds):
+        """
+        Slack has told us to back off. Don't hand out any tokens for the given number of seconds.
+        """
+        self._tokens = 0.0
+        self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+
+class RateLimits:
+    """
+    The token buckets of each Slack method (and of each channel, for chat.postMessage), and counts of the calls made.
+    Slack's limits are per app, so every dispatcher of the app should share one RateLimits.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}  # method -> bucket
+        self._channel_buckets = OrderedDict()  # "method:channel" -> bucket, least recently used first
+        self.queued = 0
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    def stats(self):
+        """
+        Return the number of calls waiting for their turn, counts of calls, and the remaining budget of each method
+        (but not of each channel)
+        """
+        with self._lock:
+            return {
+                "queued": self.queued,
+                "calls": self.calls,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "remaining": {name: bucket.remaining() for (name, bucket) in self._buckets.items()},
+            }
+
+    def buckets_for(self, method, channel):
+        """
+        Return the buckets that a call to the given method (in the given channel) takes a token from
+        """
+        buckets = [self._bucket(method)]
+        if channel and method in PER_CHANNEL_METHODS:
+            buckets.append(self._bucket("%s:%s" % (method, channel)))
+        return buckets
+
+    def take_tokens(self, buckets, is_queued):
+        """
+        Take a token from every one of the buckets, or from none of them.
+
+        :return: 0 if the tokens were taken, otherwise the number of seconds to wait before trying again
+        """
+        with self._lock:
+            waits = [bucket.take() for bucket in buckets]
+            if not any(waits):
+                return 0
+            # Put back any tokens that were taken, so that we don't use them while we wait for the others
+            for (bucket, wait) in zip(buckets, waits):
+                if not wait:
+                    bucket.give_back()
+            if not is_queued:
+                self.queued += 1
+            return max(waits)
+
+    def done_waiting(self):
+        with self._lock:
+            self.queued -= 1
+
+    def count_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def count_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def block(self, buckets, seconds):
+        """
+        Slack has told us to back off: don't hand out tokens from any of the buckets for the given number of seconds
+        """
+        with self._lock:
+            self.rate_limited += 1
+            for bucket in buckets:
+                bucket.block(seconds)
+
+    def _bucket(self, name):
+        with self._lock:
+            if ":" in name:
+                return self._channel_bucket(name)
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                per_minute = METHOD_TIERS.get(name) or SPECIAL_METHOD_RATES.get(name) or TIER_3
+                bucket = self._buckets[name] = TokenBucket(per_minute / 60.0, per_minute, self._clock)
+            return bucket
+
+    def _channel_bucket(self, name):
+        """
+        Return the bucket of one channel. There is no end to new channels (and DMs), so the buckets that have gone
+        unused for long enough to refill are forgotten.
+        """
+        buckets = self._channel_buckets
+        bucket = buckets.pop(name, None)
+        while buckets and next(iter(buckets.values())).is_idle():
+            buckets.popitem(last=False)
+        if bucket is None:
+            bucket = TokenBucket(PER_CHANNEL_RATE_PER_SECOND, PER_CHANNEL_BURST, self._clock)
+        buckets[name] = bucket
+        return bucket
+
+
+class SlackDispatcher:
+    """
+    Every call to Slack goes through this dispatcher, which:
+     - waits until the rate limit of the method (and of the channel, for chat.postMessage) allows the call
+     - honours the Retry-After header when Slack says we've been rate limited (HTTP 429)
+     - retries transient failures (connection problems, HTTP 5xx) with jittered exponential backoff
+
+    Dispatchers that are given the same rate_limits share their budgets (and counts).
+    """
+
+    def __init__(self, logger=None, max_retries=MAX_RETRIES, clock=time.monotonic, sleep=time.sleep,
+                 rate_limits=None):
+        self.logger = logger or logging.getLogger("SlackDispatcher")
+        self.max_retries = max_retries
+        self._sleep = sleep
+        self.rate_limits = rate_limits if rate_limits is not None else RateLimits(clock)
+
+    def call(self, method, fn, channel=None):
+        """
+        Call the given function, which makes a call to the given Slack API method
+        """
+        buckets = self.rate_limits.buckets_for(method, channel)
+        attempt = 0
+        while True:
+            self._wait_for_tokens(method, buckets)
+            start = time.perf_counter()
+            try:
+                self.rate_limits.count_call()
+                result = fn()
+                self._record(method, start, "ok")
+                return result
+            except Exception as e:
+                self._record(method, start, "error")
+                delay = self._before_retry(method, buckets, e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                if delay:
+                    self._sleep(delay)
+
+    def stats(self):
+        """
+        Return the number of calls waiting for their turn, counts of calls, and the remaining budget of each method
+        """
+        return self.rate_limits.stats()
+
+    def _wait_for_tokens(self, method, buckets):
+        is_queued = False
+        try:
+            while True:
+                wait = self.rate_limits.take_tokens(buckets, is_queued)
+                if not wait:
+                    return
+                is_queued = True
+                self.logger.debug("waiting %.2f seconds to call '%s'", wait, method)
+                self._sleep(wait)
+        finally:
+            if is_queued:
+                self.rate_limits.done_waiting()
+
+    def _record(self, method, start, outcome):
+        SLACK_SECONDS.observe(time.perf_counter() - start, method=method)
+        SLACK_CALLS.inc(method=method, outcome=outcome)
+
+    def _before_retry(self, method, buckets, error, attempt):
+        """
+        Return how long to wait before retrying the call that failed with the given error, or None if it shouldn't
+        be retried
+        """
+        delay = self._retry_delay(method, buckets, error, attempt)
+        if delay is None or attempt >= self.max_retries:
+            return None
+        self.rate_limits.count_retry()
+        is_rate_limited = getattr(getattr(error, "response", None), "status_code", None) == 429
+        SLACK_RETRIES.inc(method=method, reason="rate_limited" if is_rate_limited else "transient")
+        self.logger.warning("retrying '%s' in %.2f seconds (attempt %d): %s", method, delay, attempt + 1, error)
+        return delay
+
+    def _retry_delay(self, method, buckets, error, attempt):
+        """
+        Return how long to wait before retrying after the given error, or None if the call shouldn't be retried
+        """
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+        if status_code == 429:
+            headers = getattr(response, "headers", None) or {}
+            retry_after = headers.get("Retry-After") or headers.get("retry-after")
+            delay = float(retry_after) if retry_after else self._backoff(attempt)
+            # Blocking the buckets makes this call (and any others like it) wait before trying again
+            self.rate_limits.block(buckets, delay)
+            self.logger.warning("'%s' was rate limited by slack. Retry after %.2f seconds", method, delay)
+            return 0
+
+        if (status_code and status_code >= 500) or \
+                (response is None and isinstance(error, (ConnectionError, TimeoutError, OSError))):
+            return self._backoff(attempt)
+
+        return None
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(BACKOFF_MAX_IN_SECONDS, BACKOFF_BASE_IN_SECONDS * (2 ** attempt)))
+
+
+class AsyncSlackDispatcher(SlackDispatcher):
+    """
+    The same as SlackDispatcher, for asyncio: the function returns an awaitable, and waiting for the rate limits
+    (or before a retry) doesn't block the event loop. The rate limits are shared by all the calls on the loop, and
+    with any SlackDispatcher that is given the same rate_limits.
+    """
+
+    def __init__(self, logger=None, max_retries=MAX_RETRIES, clock=time.monotonic, sleep=asyncio.sleep,
+                 rate_limits=None):
+        super().__init__(logger, max_retries, clock, sleep, rate_limits)
+
+    async def call(self, method, fn, channel=None):
+        """
+        Await the given function, which makes a call to the given Slack API method
+        """
+        buckets = self.rate_limits.buckets_for(method, channel)
+        attempt = 0
+        while True:
+            await self._wait_for_tokens(method, buckets)
+            start = time.perf_counter()
+            try:
+                self.rate_limits.count_call()
+                result = await fn()
+                self._record(method, start, "ok")
+                return result
+            except Exception as e:
+                self._record(method, start, "error")
+                delay = self._before_retry(method, buckets, e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                if delay:
+                    await self._sleep(delay)
+
+    async def _wait_for_tokens(self, method, buckets):
+        is_queued = False
+        try:
+            while True:
+                wait = self.rate_limits.take_tokens(buckets, is_queued)
+                if not wait:
+                    return
+                is_queued = True
+                self.logger.debug("waiting %.2f seconds to call '%s'", wait, method)
+                await self._sleep(wait)
+        finally:
+            if is_queued:
+                self.rate_limits.done_waiting()
@@ -0,0 +1,151 @@
+import asyncio
+import unittest
+from mock import MagicMock
+
+from slack_dispatcher import AsyncSlackDispatcher, SlackDispatcher, TokenBucket
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+
+
+class FakeSlackError(Exception):
+
+    def __init__(self, status_code, headers=None):
+        super().__init__("status %d" % status_code)
+        self.response = MagicMock(status_code=status_code, headers=headers or {})
+
+
+class TestSlackDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.dispatcher = SlackDispatcher(MagicMock(), clock=self.clock, sleep=self.clock.sleep)
+
+    def test_messages_to_one_channel_are_spaced_out(self):
+        for i in range(5):
+            self.dispatcher.call("chat.postMessage", lambda: "ok", channel="C1")
+            self.dispatcher.call("chat.postMessage", lambda: "ok", channel="C2")
+
+        # A burst of 3 is allowed, then one message per second per channel
+        self.assertEqual(2.0, round(self.clock.now - 1000.0, 6))
+        self.assertEqual(10, self.dispatcher.stats()["calls"])
+        self.assertEqual(0, self.dispatcher.stats()["queued"])
+
+    def test_idle_channel_buckets_are_forgotten(self):
+        for i in range(100):
+            self.dispatcher.call("chat.postMessage", lambda: "ok", channel="C%d" % i)
+        self.clock.now += 5
+        self.dispatcher.call("chat.postMessage", lambda: "ok", channel="C1")
+
+        self.assertEqual(["chat.postMessage:C1"], list(self.dispatcher.rate_limits._channel_buckets))
+        self.assertEqual(["chat.postMessage"], list(self.dispatcher.stats()["remaining"]))
+
+    def test_rate_limited_call_honours_retry_after(self):
+        fn = MagicMock(side_effect=[FakeSlackError(429, {"Retry-After": "7"}), "ok"])
+
+        self.assertEqual("ok", self.dispatcher.call("conversations.info", fn))
+
+        self.assertEqual(2, fn.call_count)
+        self.assertEqual([7.0], self.clock.sleeps)
+        self.assertEqual(1, self.dispatcher.stats()["rate_limited"])
+
+    def test_transient_errors_are_retried_then_raised(self):
+        fn = MagicMock(side_effect=ConnectionError("connection reset"))
+
+        with self.assertRaises(ConnectionError):
+            self.dispatcher.call("users.info", fn)
+
+        self.assertEqual(4, fn.call_count)
+        self.assertEqual(3, self.dispatcher.stats()["retries"])
+
+    def test_other_errors_are_not_retried(self):
+        fn = MagicMock(side_effect=FakeSlackError(200))
+
+        with self.assertRaises(FakeSlackError):
+            self.dispatcher.call("users.info", fn)
+
+        self.assertEqual(1, fn.call_count)
+
+    def test_token_bucket_refills(self):
+        bucket = TokenBucket(rate_per_second=2, capacity=2, clock=self.clock)
+
+        self.assertEqual([0, 0], [bucket.take(), bucket.take()])
+        self.assertEqual(0.5, bucket.take())
+        self.clock.now += 0.5
+        self.assertEqual(1, bucket.remaining())
+
+
+class TestAsyncSlackDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.dispatcher = AsyncSlackDispatcher(MagicMock(), clock=self.clock, sleep=self.clock.async_sleep)
+
+    def test_messages_to_one_channel_are_spaced_out(self):
+        async def ok():
+            return "ok"
+
+        async def send_all():
+            for i in range(5):
+                await self.dispatcher.call("chat.postMessage", ok, channel="C1")
+
+        asyncio.run(send_all())
+
+        # A burst of 3 is allowed, then one message per second
+        self.assertEqual(2.0, round(self.clock.now - 1000.0, 6))
+        self.assertEqual(5, self.dispatcher.stats()["calls"])
+
+    def test_rate_limited_call_honours_retry_after(self):
+        responses = [FakeSlackError(429, {"Retry-After": "7"}), "ok"]
+
+        async def fn():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.assertEqual("ok", asyncio.run(self.dispatcher.call("conversations.info", fn)))
+
+        self.assertEqual([7.0], self.clock.sleeps)
+        self.assertEqual(1, self.dispatcher.stats()["rate_limited"])
+
+    def test_budget_is_shared_with_the_synchronous_dispatcher(self):
+        dispatcher = SlackDispatcher(MagicMock(), clock=self.clock, sleep=self.clock.sleep,
+                                     rate_limits=self.dispatcher.rate_limits)
+
+        async def ok():
+            return "ok"
+
+        for i in range(3):
+            dispatcher.call("chat.postMessage", lambda: "ok", channel="C1")
+        asyncio.run(self.dispatcher.call("chat.postMessage", ok, channel="C1"))
+
+        # The burst of 3 was used up by the synchronous dispatcher
+        self.assertEqual(1.0, round(self.clock.now - 1000.0, 6))
+        self.assertEqual(4, dispatcher.stats()["calls"])
+
+    def test_other_errors_are_not_retried(self):
+        fn = MagicMock(side_effect=FakeSlackError(200))
+
+        with self.assertRaises(FakeSlackError):
+            asyncio.run(self.dispatcher.call("users.info", fn))
+
+        self.assertEqual(1, fn.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+"""
+A file backed store with the same interface as InMemoryRedis, for deployments that don't have Redis.
+
+Unlike InMemoryRedis, it remembers which channels have been announced across restarts, and it can
+be shared by all the worker processes on the same machine.
+"""
+import sqlite3
+import threading
+import time
+
+from in_memory_redis import InMemoryPipeline
+
+# The maximum number of expired keys that are deleted by each write
+PURGE_BATCH_SIZE = 100
+
+# The fields of a hash are stored in kv_hash. The hash itself has an (empty) row in kv, which holds its expiry time,
+# so deleting or replacing that row also deletes its fields, and renaming it renames them.
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)",
+    "CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at) WHERE expires_at IS NOT NULL",
+    "CREATE TABLE IF NOT EXISTS kv_hash (key TEXT NOT NULL REFERENCES kv (key) ON DELETE CASCADE ON UPDATE CASCADE, "
+    "field TEXT NOT NULL, value BLOB NOT NULL, PRIMARY KEY (key, field))",
+]
+
+
+class SqliteRedis:
+    """
+    This class implements the subset of the redis-py interface that this app uses, on top of a SQLite database.
+
+    The database uses write-ahead logging, so readers never block the writer, and commits don't wait for
+    the disk (a crash of the machine -- not just the process -- might lose the last few writes).
+
+    Expired keys are never returned. They are deleted a few at a time by later writes.
+
+    A key can't be used as both a string and a hash.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM kv WHERE expires_at IS NULL OR expires_at > ?",
+                                      (self._clock(),)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, key):
+        """
+        Return the value associate with the given key, or None if it doesn't exist.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                                     (key, self._clock())).fetchone()
+            return row[0] if row else None
+
+    def mget(self, keys):
+        """
+        Return the values associated with each of the given keys (None for keys that don't exist)
+        """
+        with self._lock:
+            return [self.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        """
+        Set the given key to have the given value
+
+        :param ex: If given, the time to live for the key (in seconds)
+        :param nx: If true, only set the key if it doesn't already exist
+        :return: Return true if key is set to the value, None otherwise (just like redis)
+        """
+        with self._transaction():
+            now = self._clock()
+            self._purge_expired(now)
+            if nx and self.get(key) is not None:
+                return None
+            self._conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                               (key, value, now + ex if ex else None))
+            return True
+
+    def setnx(self, key, value):
+        """
+        Set the given key to have the given value IFF the given key doesn't already exist.
+        """
+        return bool(self.set(key, value, nx=True))
+
+    def delete(self, *keys):
+        """
+        Remove the given keys
+
+        :return: The number of keys that were removed
+        """
+        with self._transaction():
+            return len([key for key in keys if self.get(key) is not None and
+                        self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))])
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        """
+        Set fields of the hash stored at the given name (creating it if needed)
+
+        :param key: If given, the field to set to value
+        :param mapping: If given, a dict of more fields and their values
+        :return: The number of fields that were added (just like redis)
+        """
+        fields = dict(mapping or {})
+        if key is not None:
+            fields[key] = value
+        with self._transaction():
+            now = self._clock()
+            self._purge_expired(now)
+            if self.get(name) is None:
+                self._conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, '', NULL)", (name,))
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO kv_hash (key, field, value) VALUES (?, ?, ?)",
+                                   [(name, field, field_value) for (field, field_value) in fields.items()])
+            added = self._conn.total_changes - before
+            self._conn.executemany("UPDATE kv_hash SET value = ? WHERE key = ? AND field = ?",
+                                   [(field_value, name, field) for (field, field_value) in fields.items()])
+            return added
+
+    def hget(self, name, key):
+        """
+        Return the value of the given field of the hash stored at the given name, or None if it doesn't exist
+        """
+        return self.hmget(name, [key])[0]
+
+    def hmget(self, name, keys, *args):
+        """
+        Return the values of the given fields of the hash stored at the given name (None for fields that don't exist)
+
+        :param keys: List of fields. More fields can be given as extra arguments (just like redis-py)
+        """
+        fields = list(keys) + list(args)
+        with self._lock:
+            if self.get(name) is None:
+                return [None] * len(fields)
+            values = {}
+            # Stay well within SQLite's limit on the number of parameters of a statement
+            for i in range(0, len(fields), 500):
+                chunk = fields[i:i + 500]
+                values.update(self._conn.execute(
+                    "SELECT field, value FROM kv_hash WHERE key = ? AND field IN (%s)" % ",".join("?" * len(chunk)),
+                    [name] + chunk).fetchall())
+            return [values.get(field) for field in fields]
+
+    def hgetall(self, name):
+        """
+        Return a dict of all the fields of the hash stored at the given name (empty if it doesn't exist)
+        """
+        with self._lock:
+            if self.get(name) is None:
+                return {}
+            return dict(self._conn.execute("SELECT field, value FROM kv_hash WHERE key = ?", (name,)).fetchall())
+
+    def rename(self, src, dst):
+        """
+        Rename the key src to dst, replacing dst if it exists. The time to live of src goes with it (just like redis)
+
+        :return: True, or raise KeyError if src doesn't exist
+        """
+        with self._transaction():
+            if self.get(src) is None:
+                raise KeyError("no such key: %s" % src)
+            if src != dst:
+                self._conn.execute("DELETE FROM kv WHERE key = ?", (dst,))
+                self._conn.execute("UPDATE kv SET key = ? WHERE key = ?", (dst, src))
+            return True
+
+    def expire(self, key, ttl):
+        """
+        Set the time to live for the given key (in seconds)
+
+        :return: True if the key exists and its time to live was set
+        """
+        with self._transaction():
+            now = self._clock()
+            cursor = self._conn.execute(
+                "UPDATE kv SET expires_at = ? WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (now + ttl, key, now))
+            return cursor.rowcount > 0
+
+    def ttl(self, key):
+        """
+        Return the number of seconds until the given key expires.
+
+        :return: -2 if the key doesn't exist, -1 if it doesn't expire (just like redis)
+        """
+        with self._lock:
+            now = self._clock()
+            row = self._conn.execute("SELECT expires_at FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                                     (key, now)).fetchone()
+            if not row:
+                return -2
+            return -1 if row[0] is None else max(0, int(round(row[0] - now)))
+
+    def pipeline(self, transaction=True):
+        """
+        Return an object that queues commands and runs them all, in a single transaction, when execute() is called
+        """
+        return InMemoryPipeline(self)
+
+    def _transaction(self):
+        return _Transaction(self)
+
+    def _purge_expired(self, now):
+        self._conn.execute("DELETE FROM kv WHERE key IN "
+                           "(SELECT key FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ? LIMIT ?)",
+                           (now, PURGE_BATCH_SIZE))
+
+
+class _Transaction:
+    """
+    Hold the lock and an immediate (write) transaction. Transactions can be nested: only the outermost one commits.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        store = self.store
+        store._lock.acquire()
+        if store._transaction_depth == 0:
+            store._conn.execute("BEGIN IMMEDIATE")
+        store._transaction_depth += 1
+        return store
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        store = self.store
+        try:
+            store._transaction_depth -= 1
+            if store._transaction_depth == 0:
+                store._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            store._lock.release()
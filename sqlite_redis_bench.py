@@ -0,0 +1,55 @@
+"""
+Benchmark the throughput of SqliteRedis.
+
+    > python sqlite_redis_bench.py [number_of_keys]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlite_redis import SqliteRedis
+
+CHANNEL_INFO_TTL_IN_SECONDS = 60 * (24 * 60 * 60)
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print("%-40s %10.0f ops/sec  (%.2f seconds)" % (label, count / elapsed, elapsed))
+
+
+def pipelined(store, keys, batch_size=100):
+    for i in range(0, len(keys), batch_size):
+        pipeline = store.pipeline()
+        for key in keys[i:i + batch_size]:
+            pipeline.set(key, "1", ex=CHANNEL_INFO_TTL_IN_SECONDS, nx=True)
+        pipeline.execute()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    keys = ["channel:C%08d" % i for i in range(count)]
+    directory = tempfile.mkdtemp()
+    try:
+        store = SqliteRedis(os.path.join(directory, "bench.db"))
+        timed("set(nx=True, ex=...) new keys", count,
+              lambda: [store.set(key, "1", ex=CHANNEL_INFO_TTL_IN_SECONDS, nx=True) for key in keys])
+        timed("set(nx=True, ex=...) existing keys", count,
+              lambda: [store.set(key, "1", ex=CHANNEL_INFO_TTL_IN_SECONDS, nx=True) for key in keys])
+        timed("get", count, lambda: [store.get(key) for key in keys])
+        store.close()
+
+        store = SqliteRedis(os.path.join(directory, "bench-pipelined.db"))
+        timed("pipelined set(nx=True, ex=...) x100", count, lambda: pipelined(store, keys))
+        store.close()
+
+        timed("reopen and count", 1, lambda: len(SqliteRedis(os.path.join(directory, "bench.db"))))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock
+
+from processor import Processor
+from processor_test import CHANNEL_INFO_SUCCESS, CREATE_EVENT, USER_INFO_SUCCESS
+from sqlite_redis import SqliteRedis
+
+
+class TestSqliteRedis(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "store.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_values_survive_restart(self):
+        store = SqliteRedis(self.path)
+        self.assertTrue(store.set("channel:C1", "1537991036", ex=60, nx=True))
+        store.close()
+
+        store = SqliteRedis(self.path)
+        self.assertIsNone(store.set("channel:C1", "1537991036", ex=60, nx=True))
+        self.assertEqual("1537991036", store.get("channel:C1"))
+        store.close()
+
+    def test_processor_writes_to_a_new_database(self):
+        slack_client = MagicMock()
+        slack_client.user_info.return_value = USER_INFO_SUCCESS
+        slack_client.channel_info.return_value = CHANNEL_INFO_SUCCESS
+        store = SqliteRedis(self.path)
+
+        Processor({"target": ["dev-"]}, slack_client, store, logger=MagicMock()).process_channel_event(
+            "create", CREATE_EVENT)
+        store.close()
+
+        store = SqliteRedis(self.path)
+        self.assertIsNotNone(store.get("channel:CHANNELID1"))
+        store.close()
+
+    def test_keys_expire(self):
+        now = [1000.0]
+        store = SqliteRedis(self.path, clock=lambda: now[0])
+        store.set("short", "1", ex=10)
+        store.set("forever", b"2")
+
+        self.assertEqual(10, store.ttl("short"))
+        self.assertEqual(-1, store.ttl("forever"))
+        now[0] += 10
+        self.assertEqual([None, b"2"], store.mget(["short", "forever"]))
+        self.assertTrue(store.setnx("short", "again"))
+        self.assertEqual(2, len(store))
+        store.close()
+
+    def test_delete_and_pipeline(self):
+        store = SqliteRedis(self.path)
+        store.set("a", "1")
+
+        (value, deleted, was_set) = store.pipeline().get("a").delete("a", "missing").set("b", "2").execute()
+
+        self.assertEqual(("1", 1, True), (value, deleted, was_set))
+        self.assertEqual([None, "2"], store.mget(["a", "b"]))
+        self.assertFalse(store.expire("a", 10))
+        store.close()
+
+    def test_hash(self):
+        now = [1000.0]
+        store = SqliteRedis(self.path, clock=lambda: now[0])
+
+        self.assertEqual(2, store.hset("users", mapping={"fred.hole": "UFRED", "joe.bloggs": "UJOE"}))
+        self.assertEqual(0, store.hset("users", "fred.hole", "UFRED2"))
+        self.assertEqual(["UFRED2", None, "UJOE"], store.hmget("users", ["fred.hole", "no.body"], "joe.bloggs"))
+        self.assertEqual("UJOE", store.hget("users", "joe.bloggs"))
+        self.assertEqual([None], store.hmget("missing", ["fred.hole"]))
+
+        # An expired hash starts again empty, and deleting a hash deletes its fields
+        store.expire("users", 10)
+        now[0] += 10
+        self.assertEqual(1, store.hset("users", "boss.man", "UBOSS"))
+        self.assertEqual([None, "UBOSS"], store.hmget("users", ["fred.hole", "boss.man"]))
+        self.assertEqual(1, store.delete("users"))
+        self.assertEqual(0, store._conn.execute("SELECT COUNT(*) FROM kv_hash").fetchone()[0])
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
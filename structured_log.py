@@ -0,0 +1,146 @@
+"""
+Structured logging that costs (almost) nothing when the record isn't written.
+
+    log = StructuredLogger(logging.getLogger("Processor"))
+    log.info("announcing", channel=channel_id, creator=creator_id)
+    log.sample("calling slack", method="users.info")   # only a fraction of these are written
+
+The fields are only serialised if a handler actually writes the record, so it is safe to pass large payloads
+(e.g. attachments) as fields. Records are written as compact key=value pairs, or as one JSON object per line
+if JsonFormatter is used. Every record includes the id of the Slack event being processed (see event_context),
+so all the records about one event can be found together.
+"""
+import contextvars
+import json
+import logging
+import random
+import time
+import zlib
+from contextlib import contextmanager
+
+# The id of the slack event that is currently being processed.
+# Work passed to the WorkQueue or fanned out to other threads carries this id with it.
+_event_id = contextvars.ContextVar("event_id", default=None)
+
+# Fraction of the records passed to StructuredLogger.sample() that are written (see configure)
+_sample_rate = 1.0
+
+
+def configure(sample_rate=1.0):
+    """
+    Set the fraction of high volume (sampled) records that are written. 1 means write them all.
+    """
+    global _sample_rate
+    _sample_rate = max(0.0, min(1.0, sample_rate))
+
+
+@contextmanager
+def event_context(event_id):
+    """
+    Tag every record that is logged inside the with statement with the given event id
+    """
+    token = _event_id.set(event_id)
+    try:
+        yield
+    finally:
+        _event_id.reset(token)
+
+
+def current_event_id():
+    return _event_id.get()
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return json.dumps(value) if not value or any(c in value for c in ' ="\n') else value
+    if value is None or isinstance(value, (bool, int, float)):
+        return json.dumps(value)
+    return json.dumps(value, separators=(",", ":"), default=repr)
+
+
+class StructuredMessage:
+    """
+    The message of a log record. It is only turned into text when a handler writes the record.
+    """
+
+    def __init__(self, message, fields, event_id):
+        self.message = message
+        self.fields = fields
+        self.event_id = event_id
+
+    def as_dict(self):
+        values = {"message": self.message}
+        if self.event_id:
+            values["event_id"] = self.event_id
+        values.update(self.fields)
+        return values
+
+    def __str__(self):
+        pairs = [("event_id", self.event_id)] if self.event_id else []
+        pairs.extend(self.fields.items())
+        return " ".join([self.message] + ["%s=%s" % (key, _format_value(value)) for (key, value) in pairs])
+
+
+class StructuredLogger:
+    """
+    Wraps a standard logger, adding key=value fields and sampling to its records
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def debug(self, message, **fields):
+        self._log(logging.DEBUG, "debug", message, fields)
+
+    def info(self, message, **fields):
+        self._log(logging.INFO, "info", message, fields)
+
+    def warning(self, message, **fields):
+        self._log(logging.WARNING, "warning", message, fields)
+
+    def error(self, message, **fields):
+        self._log(logging.ERROR, "error", message, fields)
+
+    def sample(self, message, **fields):
+        """
+        Log a high volume record at INFO level, but only for the configured fraction of events.
+
+        The decision is made per event id, so either all or none of the sampled records about an event are written.
+        """
+        if _sample_rate < 1.0 and not self._is_sampled(_event_id.get()):
+            return
+        self._log(logging.INFO, "info", message, fields)
+
+    def _log(self, level, method_name, message, fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        getattr(self.logger, method_name)(StructuredMessage(message, fields, _event_id.get()))
+
+    @staticmethod
+    def _is_sampled(event_id):
+        if event_id:
+            return zlib.crc32(event_id.encode("utf-8")) % 10000 < _sample_rate * 10000
+        return random.random() < _sample_rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Write each record as a single line of JSON. Fields of structured records become keys of the object.
+    """
+
+    def format(self, record):
+        values = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + ".%03dZ" % record.msecs,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.thread,
+        }
+        if isinstance(record.msg, StructuredMessage):
+            values.update(record.msg.as_dict())
+        else:
+            values["message"] = record.getMessage()
+            if _event_id.get():
+                values["event_id"] = _event_id.get()
+        if record.exc_info:
+            values["exception"] = self.formatException(record.exc_info)
+        return json.dumps(values, separators=(",", ":"), default=repr)
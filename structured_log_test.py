@@ -0,0 +1,103 @@
+import json
+import logging
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from mock import MagicMock
+
+import structured_log
+from structured_log import JsonFormatter, StructuredLogger, event_context
+from toolbox import fan_out
+from work_queue import WorkQueue
+
+
+class Expensive:
+    """
+    Counts how many times it is serialised
+    """
+    serialised = 0
+
+    def __repr__(self):
+        Expensive.serialised += 1
+        return "expensive"
+
+
+class TestStructuredLog(unittest.TestCase):
+
+    def setUp(self):
+        self.records = []
+        self.logger = logging.getLogger("structured_log_test")
+        self.logger.handlers = []
+        self.logger.propagate = False
+        handler = logging.Handler()
+        handler.emit = lambda record: self.records.append(handler.format(record))
+        self.logger.addHandler(handler)
+        self.logger.setLevel(logging.INFO)
+        Expensive.serialised = 0
+
+    def tearDown(self):
+        structured_log.configure(1.0)
+
+    def test_fields_are_written_as_key_values(self):
+        log = StructuredLogger(self.logger)
+        with event_context("Ev123"):
+            log.info("announcing", channel="C1", name="has space", members=["U1", "U2"])
+
+        self.assertEqual(['announcing event_id=Ev123 channel=C1 name="has space" members=["U1","U2"]'], self.records)
+
+    def test_filtered_records_are_not_serialised(self):
+        log = StructuredLogger(self.logger)
+        log.debug("payload", payload={"x": Expensive()})
+        self.assertEqual([], self.records)
+        self.assertEqual(0, Expensive.serialised)
+
+        log.info("payload", payload={"x": Expensive()})
+        self.assertEqual(1, Expensive.serialised)
+
+    def test_sampling_keeps_or_drops_whole_events(self):
+        structured_log.configure(0.5)
+        log = StructuredLogger(self.logger)
+        for i in range(200):
+            with event_context("Ev%d" % i):
+                log.sample("first")
+                log.sample("second")
+
+        self.assertTrue(50 < len(self.records) / 2 < 150)
+        firsts = [x.split("=")[1] for x in self.records if x.startswith("first")]
+        seconds = [x.split("=")[1] for x in self.records if x.startswith("second")]
+        self.assertEqual(firsts, seconds)
+
+    def test_errors_are_never_sampled(self):
+        structured_log.configure(0.0)
+        log = StructuredLogger(self.logger)
+        log.sample("dropped")
+        log.error("kept")
+        self.assertEqual(["kept"], self.records)
+
+    def test_event_id_follows_work_onto_other_threads(self):
+        seen = []
+        work_queue = WorkQueue(workers=1, logger=MagicMock())
+        executor = ThreadPoolExecutor(2)
+        with event_context("Ev1"):
+            work_queue.submit(lambda: seen.append(structured_log.current_event_id()))
+            fan_out(executor, lambda _: seen.append(structured_log.current_event_id()), [1, 2])
+        work_queue.shutdown(timeout=5)
+
+        self.assertEqual(["Ev1"] * 3, seen)
+        self.assertIsNone(structured_log.current_event_id())
+
+    def test_json_formatter(self):
+        self.logger.handlers[0].setFormatter(JsonFormatter())
+        log = StructuredLogger(self.logger)
+        with event_context("Ev1"):
+            log.info("announcing", channel="C1")
+            self.logger.info("plain %s", "message")
+
+        first = json.loads(self.records[0])
+        self.assertEqual(("announcing", "Ev1", "C1", "INFO"),
+                         (first["message"], first["event_id"], first["channel"], first["level"]))
+        second = json.loads(self.records[1])
+        self.assertEqual(("plain message", "Ev1"), (second["message"], second["event_id"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 """
 Utilities that almost every Python system needs
 """
+import contextvars
 import logging
 
 
@@ -24,8 +25,33 @@ def ordered_distinct(collection):
     return [x for x in collection if x not in seen and (seen.add(x) or True)]
 
 
+def fan_out(executor, fn, items, logger=None):
+    """
+    Call fn(item) for every item, concurrently if an executor is given.
+    A failure of one call is logged, but doesn't affect the others.
+    Each call runs in a copy of the caller's context, so context variables (like the logged event id) carry over.
+
+    :return: List of results, in the same order as the items (None for calls that failed)
+    """
+    def isolated(item):
+        try:
+            return fn(item)
+        except Exception:
+            (logger or logging.getLogger()).exception("fan out call failed for %r", item)
+            return None
+
+    items = list(items)
+    if not executor or len(items) <= 1:
+        return [isolated(x) for x in items]
+    contexts = [contextvars.copy_context() for _ in items]
+    return list(executor.map(lambda context, item: context.run(isolated, item), contexts, items))
+
+
 def null_logger():
     """
     Return a logger that does nothing
     """
-    return logging.getLogger("NullLogger").addHandler(logging.NullHandler())
+    logger = logging.getLogger("NullLogger")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return logger
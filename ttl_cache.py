@@ -0,0 +1,109 @@
+"""
+Small, thread-safe, in-process caches with a maximum size and a time to live.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TtlLruCache:
+    """
+    Remember up to max_size values for ttl seconds. When full, the least recently used value is discarded.
+    """
+
+    def __init__(self, max_size=1000, ttl=60 * 60, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expiry time, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key):
+        """
+        Return the value for the given key, or None if it isn't in the cache or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[1] if entry else None
+
+
+class RotatingSet:
+    """
+    Remember keys for a time horizon, using much less memory than TtlLruCache.
+
+    Keys are added to the current generation (a plain set). When the current generation is half the horizon old,
+    or holds half of max_size keys, the previous generation is discarded and the current one takes its place.
+    So a key is remembered for at least half the horizon (unless max_size is reached), and no more than max_size
+    keys are ever held. A key that is found in the previous generation is moved to the current one.
+    """
+
+    def __init__(self, max_size=100000, horizon=60 * 60, clock=time.monotonic):
+        self.max_size = max_size
+        self.horizon = horizon
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._current = set()
+        self._previous = set()
+        self._rotate_at = clock() + horizon / 2.0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._current) + len(self._previous)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._rotate_if_needed()
+            if key in self._current:
+                return True
+            if key in self._previous:
+                self._previous.discard(key)
+                self._add(key)
+                return True
+            return False
+
+    def add(self, key):
+        with self._lock:
+            self._rotate_if_needed()
+            self._add(key)
+
+    def _add(self, key):
+        self._current.add(key)
+        if len(self._current) >= self.max_size / 2.0:
+            self._rotate()
+
+    def _rotate_if_needed(self):
+        now = self._clock()
+        if now >= self._rotate_at:
+            # If the current generation is already too old to keep as the previous generation, forget everything
+            is_stale = now >= self._rotate_at + self.horizon / 2.0
+            self._rotate()
+            if is_stale:
+                self._previous = set()
+
+    def _rotate(self):
+        (self._previous, self._current) = (self._current, set())
+        self._rotate_at = self._clock() + self.horizon / 2.0
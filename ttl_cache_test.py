@@ -0,0 +1,72 @@
+import unittest
+
+from ttl_cache import RotatingSet, TtlLruCache
+
+
+class TestTtlLruCache(unittest.TestCase):
+
+    def test_least_recently_used_is_discarded(self):
+        cache = TtlLruCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual([1, None, 3], [cache.get(x) for x in "abc"])
+
+    def test_entries_expire(self):
+        now = [1000.0]
+        cache = TtlLruCache(ttl=10, clock=lambda: now[0])
+        cache.put("a", 1)
+        now[0] += 9
+        self.assertEqual(1, cache.get("a"))
+        now[0] += 1
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, len(cache))
+
+
+class TestRotatingSet(unittest.TestCase):
+
+    def test_keys_are_remembered_for_the_horizon(self):
+        now = [1000.0]
+        seen = RotatingSet(max_size=100, horizon=10, clock=lambda: now[0])
+        seen.add("a")
+        now[0] += 5
+        seen.add("b")
+        self.assertTrue("a" in seen and "b" in seen)  # "a" is moved to the current generation
+
+        now[0] += 5
+        self.assertTrue("a" in seen and "b" in seen)
+        now[0] += 10
+        self.assertFalse("a" in seen or "b" in seen)
+
+    def test_unused_keys_are_forgotten(self):
+        now = [1000.0]
+        seen = RotatingSet(max_size=100, horizon=10, clock=lambda: now[0])
+        seen.add("a")
+        for _ in range(2):
+            now[0] += 5
+            seen.add("b")
+
+        self.assertNotIn("a", seen)
+        self.assertIn("b", seen)
+
+    def test_size_is_bounded(self):
+        seen = RotatingSet(max_size=10, horizon=1000)
+        for i in range(100):
+            seen.add(i)
+
+        self.assertLessEqual(len(seen), 10)
+        self.assertIn(99, seen)
+        self.assertNotIn(0, seen)
+
+    def test_everything_is_forgotten_after_a_quiet_period(self):
+        now = [1000.0]
+        seen = RotatingSet(max_size=100, horizon=10, clock=lambda: now[0])
+        seen.add("a")
+        now[0] += 10
+        self.assertNotIn("a", seen)
+
+
+if __name__ == '__main__':
+    unittest.main()
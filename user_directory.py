@@ -0,0 +1,267 @@
+"""
+Resolve slack user names to user ids, without loading every user in the workspace.
+"""
+import logging
+import threading
+import time
+
+import user_table
+from singleflight import RedisSingleFlight, SingleFlight
+from user_sync import REDIS_KEY_USER_MAP, USER_MAP_TTL_IN_SECONDS, UserSync
+
+# Individual user names that have been resolved
+REDIS_KEY_USER_NAME = "user-name:%s"
+
+# Names that aren't in the workspace are not looked for again for this long, so that every event about a channel
+# that a missing FOMO user is interested in doesn't repeat the whole search. New users arrive by 'team_join' anyway.
+MISSING_USER_TTL_IN_SECONDS = 5 * 60
+
+
+class UserDirectory:
+    """
+    This class maps slack user names (e.g. "phillip.piper") to user ids.
+
+    Only the names that are asked for are resolved. Each name is looked up:
+     - in memory
+     - in redis
+     - via 'users.lookupByEmail', if we know the email domain of the workspace
+     - and, only if all else fails, by loading the full 'users.list' into redis (see user_sync.py)
+
+    If user_table_path is given, the full list is kept in a user table at that path (see user_table.py), which is
+    shared by all the worker processes on this machine. Only the first worker to need it has to load it.
+
+    Once a name is known, it is kept up to date by 'user_change' and 'team_join' events.
+    Names that are definitely not in the workspace are remembered as missing for a few minutes.
+    Entries that are older than the TTL are still used, but are refreshed in the background.
+    """
+
+    def __init__(self, slack_client, redis_client, logger=None, email_domain=None, ttl=USER_MAP_TTL_IN_SECONDS,
+                 user_table_path=None, sync_seconds=None):
+        self.slack_client = slack_client
+        self.redis_client = redis_client
+        self.logger = logger or logging.getLogger("UserDirectory")
+        self.email_domain = email_domain
+        self.ttl = ttl
+        self.user_table_path = user_table_path
+        self.user_sync = UserSync(slack_client, redis_client, self.logger, ttl=ttl, max_seconds=sync_seconds)
+        # Only one thread, in only one process, loads the list of users at a time
+        self._sync_flight = SingleFlight("user_sync")
+        self._redis_sync_flight = RedisSingleFlight("user_sync", redis_client, wait_seconds=sync_seconds or 60)
+        self._lock = threading.Lock()
+        self._entries = {}  # name -> (user_id, time when resolved)
+        self._missing = {}  # name -> time when it was found to be missing
+        self._wanted = set()  # every name that we have been asked to resolve
+        self._refreshing = set()
+
+    def resolve(self, names):
+        """
+        Return a map of user name to user id for the given names. Names that can't be found are not included.
+        """
+        now = time.time()
+        found = {}
+        missing = []
+        stale = []
+        with self._lock:
+            self._wanted.update(names)
+            for name in names:
+                entry = self._entries.get(name)
+                if not entry:
+                    if now - self._missing.get(name, 0) > MISSING_USER_TTL_IN_SECONDS:
+                        missing.append(name)
+                    continue
+                found[name] = entry[0]
+                if now - entry[1] > self.ttl:
+                    stale.append(name)
+
+        if missing:
+            found.update(self._fetch(missing))
+        if stale:
+            self._refresh_in_background(stale)
+        return found
+
+    def warm_up(self, names, background=True):
+        """
+        Resolve the given names, so they are ready when needed
+        """
+        if not background:
+            self.resolve(names)
+            return
+        thread = threading.Thread(target=self.resolve, args=(list(names),), name="UserDirectoryWarmUp", daemon=True)
+        thread.start()
+
+    def update_user(self, user):
+        """
+        Update the directory from the user given in a 'user_change' or 'team_join' event.
+
+        Only names that we've been asked about are remembered.
+        """
+        name = (user or {}).get("name")
+        user_id = (user or {}).get("id")
+        if not name or not user_id or name not in self._wanted:
+            return False
+
+        if user.get("deleted"):
+            self.logger.info("user %s/%s has been deleted", name, user_id)
+            with self._lock:
+                self._entries.pop(name, None)
+            self.redis_client.delete(REDIS_KEY_USER_NAME % name)
+            return True
+
+        self.logger.info("user %s/%s has been updated", name, user_id)
+        self._remember({name: user_id})
+        return True
+
+    def _refresh_in_background(self, names):
+        with self._lock:
+            names = [x for x in names if x not in self._refreshing]
+            self._refreshing.update(names)
+        if not names:
+            return
+
+        def refresh():
+            try:
+                self._fetch(names, use_cache=False)
+            except Exception:
+                self.logger.exception("failed to refresh users: %s", names)
+            finally:
+                with self._lock:
+                    self._refreshing.difference_update(names)
+
+        threading.Thread(target=refresh, name="UserDirectoryRefresh", daemon=True).start()
+
+    def _fetch(self, names, use_cache=True):
+        """
+        Find the user ids of the given names, trying the cheapest sources first
+        """
+        start = time.time()
+        cached = self._fetch_from_redis(names) if use_cache else {}
+        self._remember(cached, store=False)
+        if len(cached) == len(names):
+            self.logger.info("resolved %d users from redis in %.2f seconds", len(cached), time.time() - start)
+            return cached
+
+        fetched = self._lookup_by_email([x for x in names if x not in cached])
+        still_missing = [x for x in names if x not in cached and x not in fetched]
+        if still_missing:
+            from_user_map = self._fetch_from_user_map(still_missing)
+            if from_user_map is not None:
+                fetched.update(from_user_map)
+                self._remember_missing([x for x in still_missing if x not in from_user_map])
+        self._remember(fetched)
+
+        self.logger.info("resolved %d of %d users in %.2f seconds", len(cached) + len(fetched), len(names),
+                         time.time() - start)
+        return dict(cached, **fetched)
+
+    def _fetch_from_redis(self, names):
+        user_ids = self.redis_client.mget([REDIS_KEY_USER_NAME % name for name in names])
+        return {name: _decode(user_id) for (name, user_id) in zip(names, user_ids) if user_id}
+
+    def _lookup_by_email(self, names):
+        """
+        Slack can find a single user by their email address. If names are the same as the email address, use that.
+        """
+        if not self.email_domain:
+            return {}
+
+        found = {}
+        for name in names:
+            try:
+                response = self.slack_client.user_by_email("%s@%s" % (name, self.email_domain))
+            except Exception as e:
+                self.logger.warning("failed to look up user %s by email: %s", name, e)
+                continue
+            user = response.get("user") if response and response.get("ok") else None
+            if user and user.get("name") == name:
+                found[name] = user.get("id")
+        return found
+
+    def _fetch_from_user_map(self, names):
+        """
+        Find the given names in the map of all slack usernames to user ids. Only if there is no map (in the shared
+        table or in redis), fetch the list of all users from slack. This is slow for big workspaces, so it's a last
+        resort.
+
+        Return None if there is no map, because the list of users couldn't be loaded
+        """
+        start = time.time()
+
+        # Another worker may have already built the shared table
+        if self.user_table_path:
+            table = user_table.open_if_fresh(self.user_table_path, self.ttl)
+            if table is not None:
+                self.logger.info("opened table of %d users in %.2f seconds", len(table), time.time() - start)
+                return {name: table[name] for name in names if name in table}
+
+        # Only fetch the names that we need from the hash in redis, not the whole map
+        found = self._fetch_from_user_hash(names)
+        if found is not None:
+            self.logger.info("found %d of %d users in redis in %.2f seconds", len(found), len(names),
+                             time.time() - start)
+            return found
+
+        # The cache has failed us. Spend the time to load the list of users from slack
+        if not self._sync_flight.do("users", self._sync_users):
+            return None
+        return self._fetch_from_user_hash(names)
+
+    def _sync_users(self):
+        """
+        Load the list of users into redis, unless another process is already doing that, in which case wait for it.
+        Return True if the list is ready.
+        """
+        def sync():
+            if not self.user_sync.run():
+                return False
+            if self.user_table_path:
+                self._write_user_table()
+            return True
+
+        return self._redis_sync_flight.do("users", sync,
+                                          when_done=lambda: self.redis_client.ttl(REDIS_KEY_USER_MAP) != -2)
+
+    def _fetch_from_user_hash(self, names):
+        """
+        Return a map of the given names to user ids, from the hash of all users in redis.
+        Return None if there is no hash.
+        """
+        (user_ids, ttl) = self.redis_client.pipeline(transaction=False) \
+            .hmget(REDIS_KEY_USER_MAP, names).ttl(REDIS_KEY_USER_MAP).execute()
+        if ttl == -2:
+            return None
+        return {name: _decode(user_id) for (name, user_id) in zip(names, user_ids) if user_id}
+
+    def _write_user_table(self):
+        """
+        Write the hash of all users to the table that is shared by all the worker processes
+        """
+        user_map = self.redis_client.hgetall(REDIS_KEY_USER_MAP)
+        try:
+            user_table.build(self.user_table_path, {_decode(name): _decode(user_id)
+                                                    for (name, user_id) in user_map.items()})
+        except OSError:
+            self.logger.exception("failed to write the user table to %s", self.user_table_path)
+
+    def _remember_missing(self, names):
+        if names:
+            self.logger.info("these users are not in the workspace: %s", names)
+        now = time.time()
+        with self._lock:
+            for name in names:
+                self._missing[name] = now
+
+    def _remember(self, name_to_id, store=True):
+        now = time.time()
+        with self._lock:
+            for (name, user_id) in name_to_id.items():
+                self._entries[name] = (user_id, now)
+                self._missing.pop(name, None)
+        if store and name_to_id:
+            pipeline = self.redis_client.pipeline(transaction=False)
+            for (name, user_id) in name_to_id.items():
+                pipeline.set(REDIS_KEY_USER_NAME % name, user_id, ex=self.ttl)
+            pipeline.execute()
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
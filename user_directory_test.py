@@ -0,0 +1,174 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock
+
+from in_memory_redis import InMemoryRedis
+from singleflight import COALESCED_CALLS
+from slack_client_wrapper import SlackClientError
+from singleflight_test import run_in_threads, wait_for_followers
+from user_directory import UserDirectory, REDIS_KEY_USER_MAP
+
+ALL_USERS = [
+    {"name": "fred.hole", "id": "UFRED"},
+    {"name": "joe.bloggs", "id": "UJOE"},
+    {"name": "boss.man", "id": "UBOSS"},
+]
+
+
+def users_pages(*pages):
+    """
+    Return a fake SlackClientWrapper.users_pages that yields the given pages of users
+    """
+    def fake_users_pages(cursor=None):
+        start = int(cursor or 0)
+        for (i, page) in enumerate(pages[start:], start):
+            yield (page, str(i + 1) if i + 1 < len(pages) else None)
+    return MagicMock(side_effect=fake_users_pages)
+
+
+class TestUserDirectory(unittest.TestCase):
+
+    def test_resolve_falls_back_to_users_list(self):
+        slack_client = MagicMock()
+        slack_client.users_pages = users_pages(ALL_USERS[:2], ALL_USERS[2:])
+        redis = InMemoryRedis()
+        directory = UserDirectory(slack_client, redis, logger=MagicMock())
+
+        self.assertEqual({"fred.hole": "UFRED"}, directory.resolve(["fred.hole", "no.body"]))
+        self.assertEqual({"fred.hole": "UFRED"}, directory.resolve(["fred.hole"]))
+
+        self.assertEqual(1, slack_client.users_pages.call_count)
+        self.assertEqual("UFRED", redis.get("user-name:fred.hole"))
+        self.assertEqual(["UJOE", "UBOSS"], redis.hmget(REDIS_KEY_USER_MAP, ["joe.bloggs", "boss.man"]))
+
+    def test_missing_names_are_not_looked_for_again(self):
+        slack_client = MagicMock()
+        slack_client.users_pages = users_pages(ALL_USERS)
+        slack_client.user_by_email.return_value = {"ok": False, "error": "users_not_found"}
+        redis = InMemoryRedis()
+        redis.mget = MagicMock(wraps=redis.mget)
+        directory = UserDirectory(slack_client, redis, logger=MagicMock(), email_domain="example.com")
+
+        self.assertEqual({}, directory.resolve(["no.body"]))
+        slack_calls = len(slack_client.mock_calls)
+        redis_calls = redis.mget.call_count
+
+        self.assertEqual({}, directory.resolve(["no.body"]))
+
+        self.assertEqual(slack_calls, len(slack_client.mock_calls))
+        self.assertEqual(redis_calls, redis.mget.call_count)
+
+        # ...unless they join the workspace
+        directory.update_user({"name": "no.body", "id": "UNOBODY"})
+        self.assertEqual({"no.body": "UNOBODY"}, directory.resolve(["no.body"]))
+
+    def test_failed_users_list_resolves_nothing(self):
+        slack_client = MagicMock()
+        slack_client.users_pages.side_effect = SlackClientError("users.list", "internal_error")
+        logger = MagicMock()
+        directory = UserDirectory(slack_client, InMemoryRedis(), logger=logger)
+
+        self.assertEqual({}, directory.resolve(["fred.hole"]))
+
+        self.assertTrue(logger.error.called)
+
+    def test_only_the_names_that_are_needed_are_fetched(self):
+        slack_client = MagicMock()
+        slack_client.users_pages = users_pages(*[[{"name": "user%d" % i, "id": "U%d" % i} for i in range(j, j + 200)]
+                                                 for j in range(0, 1000, 200)])
+        redis = InMemoryRedis()
+        redis.hmget = MagicMock(wraps=redis.hmget)
+        directory = UserDirectory(slack_client, redis, logger=MagicMock())
+
+        self.assertEqual({"user999": "U999"}, directory.resolve(["user999"]))
+        self.assertEqual(1000, len(redis.hgetall(REDIS_KEY_USER_MAP)))
+
+        # Another process only fetches the names that it needs
+        other_directory = UserDirectory(MagicMock(), redis, logger=MagicMock())
+        self.assertEqual({"user7": "U7"}, other_directory.resolve(["user7", "no.body"]))
+        redis.hmget.assert_called_with(REDIS_KEY_USER_MAP, ["user7", "no.body"])
+
+    def test_unfinished_sync_is_resumed(self):
+        slack_client = MagicMock()
+        slack_client.users_pages = users_pages(ALL_USERS[:1], ALL_USERS[1:2], ALL_USERS[2:])
+        directory = UserDirectory(slack_client, InMemoryRedis(), logger=MagicMock(), sync_seconds=0)
+
+        # Each attempt only has time for one page
+        self.assertEqual({}, directory.resolve(["boss.man"]))
+        self.assertEqual({}, directory.resolve(["boss.man"]))
+        self.assertEqual({"boss.man": "UBOSS"}, directory.resolve(["boss.man"]))
+
+        self.assertEqual([None, "1", "2"], [x[0][0] for x in slack_client.users_pages.call_args_list])
+
+    def test_concurrent_misses_load_users_once(self):
+        before = COALESCED_CALLS.value(name="user_sync")
+        slack_client = MagicMock()
+        pages = users_pages(ALL_USERS)
+
+        def slow_users_pages(cursor=None):
+            wait_for_followers("user_sync", 2, before)
+            return pages(cursor)
+
+        slack_client.users_pages.side_effect = slow_users_pages
+        directory = UserDirectory(slack_client, InMemoryRedis(), logger=MagicMock())
+
+        results = run_in_threads(3, lambda: directory.resolve(["boss.man"]))
+
+        self.assertEqual([{"boss.man": "UBOSS"}] * 3, results)
+        self.assertEqual(1, slack_client.users_pages.call_count)
+
+    def test_resolve_from_redis_without_calling_slack(self):
+        slack_client = MagicMock()
+        redis = InMemoryRedis()
+        redis.set("user-name:joe.bloggs", b"UJOE")
+        redis.hset(REDIS_KEY_USER_MAP, mapping={"boss.man": "UBOSS"})
+        directory = UserDirectory(slack_client, redis, logger=MagicMock())
+
+        self.assertEqual({"joe.bloggs": "UJOE", "boss.man": "UBOSS"}, directory.resolve(["joe.bloggs", "boss.man"]))
+
+        self.assertFalse(slack_client.users_pages.called)
+
+    def test_resolve_by_email(self):
+        slack_client = MagicMock()
+        slack_client.user_by_email.return_value = {"ok": True, "user": {"name": "boss.man", "id": "UBOSS"}}
+        directory = UserDirectory(slack_client, InMemoryRedis(), logger=MagicMock(), email_domain="mycompany.com")
+
+        self.assertEqual({"boss.man": "UBOSS"}, directory.resolve(["boss.man"]))
+
+        slack_client.user_by_email.assert_called_with("boss.man@mycompany.com")
+        self.assertFalse(slack_client.users_pages.called)
+
+    def test_update_user_only_remembers_wanted_names(self):
+        slack_client = MagicMock()
+        slack_client.users_pages = users_pages([])
+        directory = UserDirectory(slack_client, InMemoryRedis(), logger=MagicMock())
+        self.assertEqual({}, directory.resolve(["new.starter"]))
+
+        self.assertFalse(directory.update_user({"name": "someone.else", "id": "UELSE"}))
+        self.assertTrue(directory.update_user({"name": "new.starter", "id": "UNEW"}))
+        self.assertEqual({"new.starter": "UNEW"}, directory.resolve(["new.starter"]))
+
+        self.assertTrue(directory.update_user({"name": "new.starter", "id": "UNEW", "deleted": True}))
+        self.assertEqual({}, directory.resolve(["new.starter"]))
+
+    def test_users_list_is_shared_through_the_user_table(self):
+        directory_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory_path)
+        path = os.path.join(directory_path, "users.table")
+        slack_client = MagicMock()
+        slack_client.users_pages = users_pages(ALL_USERS)
+        directory = UserDirectory(slack_client, InMemoryRedis(), logger=MagicMock(), user_table_path=path)
+        self.assertEqual({"fred.hole": "UFRED"}, directory.resolve(["fred.hole"]))
+
+        # Another worker, with its own redis cache, reads the table rather than calling slack
+        other_slack_client = MagicMock()
+        other_directory = UserDirectory(other_slack_client, InMemoryRedis(), logger=MagicMock(), user_table_path=path)
+
+        self.assertEqual({"joe.bloggs": "UJOE"}, other_directory.resolve(["joe.bloggs", "no.body"]))
+        self.assertFalse(other_slack_client.users_pages.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Compare the cold start cost of finding the FOMO users in the map of all users, stored either as one json string
+(as it used to be) or as a hash (as it is now).
+
+    > python user_map_bench.py [--users 100000] [--fomo-users 50] [--redis-url redis://localhost:6379/15]
+
+With the json string, every cold start fetches and parses the whole map. With the hash, only the names that are
+needed are fetched (with HMGET), so the cost depends on the number of FOMO users, not the size of the workspace.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from in_memory_redis import InMemoryRedis
+from sqlite_redis import SqliteRedis
+from slack_client_wrapper import USERS_PAGE_SIZE
+from user_sync import REDIS_KEY_USER_MAP, UserSync
+
+JSON_KEY = "map_user_name_to_id"
+
+
+class FakeSlackClient:
+    """
+    Yields pages of users, like SlackClientWrapper.users_pages, without calling slack
+    """
+
+    def __init__(self, users):
+        self.users = [{"name": name, "id": user_id} for (name, user_id) in users.items()]
+
+    def users_pages(self, cursor=None):
+        start = int(cursor or 0)
+        for i in range(start, len(self.users), USERS_PAGE_SIZE):
+            end = i + USERS_PAGE_SIZE
+            yield (self.users[i:end], str(end) if end < len(self.users) else None)
+
+
+def timed(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def from_json(store, names):
+    user_map = json.loads(store.get(JSON_KEY))
+    return {name: user_map[name] for name in names if name in user_map}
+
+
+def from_hash(store, names):
+    return {name: user_id for (name, user_id) in zip(names, store.hmget(REDIS_KEY_USER_MAP, names)) if user_id}
+
+
+def bench(label, store, users, names):
+    sync = UserSync(FakeSlackClient(users), store)
+    (write_json, _) = timed(lambda: store.set(JSON_KEY, json.dumps(users), ex=60), repeat=1)
+    (write_hash, _) = timed(sync.run, repeat=1)
+    (read_json, found_json) = timed(lambda: from_json(store, names))
+    (read_hash, found_hash) = timed(lambda: from_hash(store, names))
+    assert found_json == found_hash
+    print("%-10s %12.1f %12.1f %14.2f %14.2f" % (label, write_json * 1e3, write_hash * 1e3, read_json * 1e3,
+                                                 read_hash * 1e3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare storing the user map as json or as a hash")
+    parser.add_argument("--users", type=int, default=100000, help="users in the workspace")
+    parser.add_argument("--fomo-users", type=int, default=50, help="user names to look up")
+    parser.add_argument("--redis-url", help="also run against this redis (e.g. redis://localhost:6379/15)")
+    args = parser.parse_args()
+
+    users = {"user.name%d" % i: "U%08X" % i for i in range(args.users)}
+    names = random.sample(list(users), args.fomo_users)
+    print("%d users, looking up %d of them" % (args.users, args.fomo_users))
+    print("%-10s %12s %12s %14s %14s" % ("", "write json", "sync hash", "cold read json", "cold read hash"))
+    print("%-10s %12s %12s %14s %14s" % ("", "ms", "ms", "ms", "ms"))
+
+    bench("in-memory", InMemoryRedis(), users, names)
+    directory = tempfile.mkdtemp()
+    try:
+        bench("sqlite", SqliteRedis(os.path.join(directory, "bench.db")), users, names)
+    finally:
+        shutil.rmtree(directory)
+    if args.redis_url:
+        import redis
+        store = redis.Redis.from_url(args.redis_url, decode_responses=True)
+        bench("redis", store, users, names)
+        store.delete(JSON_KEY, REDIS_KEY_USER_MAP)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Load the map of every user name to user id from 'users.list' into redis, a page at a time.
+
+Big workspaces have many pages of users, and loading them can be throttled, or be cut short (e.g. by AWS Lambda's
+hard timeout). So after each page, the users that have been loaded so far and the cursor of the next page are
+checkpointed in redis. A sync that doesn't finish is resumed from its checkpoint by the next sync, in this process
+or another one. Only one page is held in memory at a time.
+"""
+import logging
+import time
+
+from slack_client_wrapper import SlackClientError
+
+# The completed map of user names to ids. This is a hash, so the names that are needed can be fetched
+# without fetching the whole map. (It used to be a single json string, called "map_user_name_to_id")
+REDIS_KEY_USER_MAP = "user_name_to_id"
+
+# The users loaded so far by a sync that hasn't finished, and the cursor of the next page that it needs
+REDIS_KEY_SYNC_USERS = "user_name_to_id:syncing"
+REDIS_KEY_SYNC_CURSOR = "user_name_to_id:sync_cursor"
+
+# How long is the map of users used before it is loaded again?
+USER_MAP_TTL_IN_SECONDS = 24 * 60 * 60
+
+# How long is an unfinished sync remembered? Slack's cursors don't last forever
+SYNC_CHECKPOINT_TTL_IN_SECONDS = 60 * 60
+
+# The errors that mean the checkpointed cursor can't be used, so the sync has to start again
+CURSOR_ERRORS = {"invalid_cursor", "cursor_expired"}
+
+
+class UserSync:
+    """
+    This class loads every user in the workspace into the REDIS_KEY_USER_MAP hash.
+
+    The map is only replaced once every page has been loaded, so readers never see part of a map.
+    """
+
+    def __init__(self, slack_client, redis_client, logger=None, ttl=USER_MAP_TTL_IN_SECONDS, max_seconds=None):
+        self.slack_client = slack_client
+        self.redis_client = redis_client
+        self.logger = logger or logging.getLogger("UserSync")
+        self.ttl = ttl
+        self.max_seconds = max_seconds
+
+    def run(self):
+        """
+        Load the users, starting where the last unfinished sync stopped. Stop after max_seconds (if given),
+        leaving a checkpoint for the next sync. Return True if the sync finished.
+
+        If Slack fails, the checkpoint is kept for the next sync, unless it is Slack's cursor that has failed.
+        """
+        start = time.time()
+        cursor = self.redis_client.get(REDIS_KEY_SYNC_CURSOR)
+        cursor = cursor.decode() if isinstance(cursor, bytes) else cursor
+        if cursor:
+            self.logger.info("resuming the sync of users from cursor %s", cursor)
+        else:
+            self.redis_client.delete(REDIS_KEY_SYNC_USERS)
+
+        pages = 0
+        try:
+            for (users, cursor) in self.slack_client.users_pages(cursor):
+                pages += 1
+                self._checkpoint(users, cursor)
+                if not cursor:
+                    break
+                if self.max_seconds is not None and time.time() - start >= self.max_seconds:
+                    self.logger.warning("stopped the sync of users after %d pages in %.2f seconds, at cursor %s",
+                                        pages, time.time() - start, cursor)
+                    return False
+        except SlackClientError as e:
+            self.logger.error("the sync of users failed after %d pages: %s", pages, e)
+            if e.error in CURSOR_ERRORS:
+                self.redis_client.delete(REDIS_KEY_SYNC_USERS, REDIS_KEY_SYNC_CURSOR)
+            return False
+
+        self._publish()
+        self.logger.info("synced users (%d pages) in %.2f seconds", pages, time.time() - start)
+        return True
+
+    def _checkpoint(self, users, cursor):
+        """
+        Add the given page of users to the users loaded so far, and remember where the next page starts,
+        in a single transaction
+        """
+        pipeline = self.redis_client.pipeline()
+        name_to_id = {user["name"]: user["id"] for user in users if user.get("name") and user.get("id")}
+        if name_to_id:
+            pipeline.hset(REDIS_KEY_SYNC_USERS, mapping=name_to_id)
+            pipeline.expire(REDIS_KEY_SYNC_USERS, SYNC_CHECKPOINT_TTL_IN_SECONDS)
+        if cursor:
+            pipeline.set(REDIS_KEY_SYNC_CURSOR, cursor, ex=SYNC_CHECKPOINT_TTL_IN_SECONDS)
+        else:
+            pipeline.delete(REDIS_KEY_SYNC_CURSOR)
+        pipeline.execute()
+
+    def _publish(self):
+        """
+        Replace the map of users with the users that have just been loaded
+        """
+        if self.redis_client.ttl(REDIS_KEY_SYNC_USERS) == -2:
+            self.logger.warning("the sync of users found no users")
+            return
+        pipeline = self.redis_client.pipeline()
+        pipeline.rename(REDIS_KEY_SYNC_USERS, REDIS_KEY_USER_MAP)
+        pipeline.expire(REDIS_KEY_USER_MAP, self.ttl)
+        pipeline.execute()
@@ -0,0 +1,109 @@
+import unittest
+from mock import MagicMock
+
+from in_memory_redis import InMemoryRedis
+from slack_client_wrapper import SlackClientWrapper, SlackClientError
+from slack_dispatcher import SlackDispatcher
+from user_sync import REDIS_KEY_SYNC_CURSOR, REDIS_KEY_SYNC_USERS, REDIS_KEY_USER_MAP, UserSync
+
+ALL_USERS = [{"name": "user%d" % i, "id": "U%d" % i, "profile": {"real_name": "User %d" % i}} for i in range(5)]
+
+
+class FakeResponse(dict):
+
+    @property
+    def data(self):
+        return self
+
+
+def users_list(fail_at=None, error="internal_error"):
+    """
+    Return a fake WebClient.users_list that pages through ALL_USERS, two at a time, and fails (with the given
+    error) when asked for the given cursor
+    """
+    def fake_users_list(cursor=None, limit=None):
+        start = int(cursor or 0)
+        if start == fail_at:
+            return FakeResponse(ok=False, error=error)
+        end = start + 2
+        return FakeResponse(ok=True, members=ALL_USERS[start:end],
+                            response_metadata={"next_cursor": str(end) if end < len(ALL_USERS) else ""})
+    return MagicMock(side_effect=fake_users_list)
+
+
+class TestUserSync(unittest.TestCase):
+
+    def make_wrapper(self, client):
+        return SlackClientWrapper(client, MagicMock(), SlackDispatcher(MagicMock(), max_retries=0))
+
+    def test_users_pages_only_keeps_names_and_ids(self):
+        client = MagicMock()
+        client.users_list = users_list()
+        wrapper = self.make_wrapper(client)
+
+        pages = list(wrapper.users_pages())
+
+        self.assertEqual([2, 2, 1], [len(users) for (users, _) in pages])
+        self.assertEqual(["2", "4", None], [cursor for (_, cursor) in pages])
+        self.assertEqual({"name": "user4", "id": "U4"}, pages[2][0][0])
+
+    def test_sync_publishes_the_whole_map(self):
+        client = MagicMock()
+        client.users_list = users_list()
+        redis = InMemoryRedis()
+        redis.hset(REDIS_KEY_USER_MAP, mapping={"old.user": "UOLD"})
+
+        self.assertTrue(UserSync(self.make_wrapper(client), redis, MagicMock(), ttl=60).run())
+
+        self.assertEqual({"user%d" % i: "U%d" % i for i in range(5)}, redis.hgetall(REDIS_KEY_USER_MAP))
+        self.assertEqual(60, redis.ttl(REDIS_KEY_USER_MAP))
+        self.assertEqual([None, None], redis.mget([REDIS_KEY_SYNC_USERS, REDIS_KEY_SYNC_CURSOR]))
+
+    def test_failed_sync_is_resumed_from_its_checkpoint(self):
+        client = MagicMock()
+        client.users_list = users_list(fail_at=4)
+        redis = InMemoryRedis()
+        sync = UserSync(self.make_wrapper(client), redis, MagicMock())
+
+        self.assertFalse(sync.run())
+
+        self.assertEqual("4", redis.get(REDIS_KEY_SYNC_CURSOR))
+        self.assertEqual(4, len(redis.hgetall(REDIS_KEY_SYNC_USERS)))
+        self.assertEqual({}, redis.hgetall(REDIS_KEY_USER_MAP))  # readers never see part of a map
+
+        client.users_list = users_list()
+        self.assertTrue(sync.run())
+
+        self.assertEqual(5, len(redis.hgetall(REDIS_KEY_USER_MAP)))
+        self.assertEqual(["4"], [x[1]["cursor"] for x in client.users_list.call_args_list])
+
+    def test_expired_cursor_starts_the_sync_again(self):
+        client = MagicMock()
+        client.users_list = users_list(fail_at=2, error="invalid_cursor")
+        redis = InMemoryRedis()
+        sync = UserSync(self.make_wrapper(client), redis, MagicMock(), max_seconds=0)
+        self.assertFalse(sync.run())  # stops after the first page...
+        self.assertEqual("2", redis.get(REDIS_KEY_SYNC_CURSOR))
+
+        self.assertFalse(sync.run())  # ...and Slack no longer accepts its cursor
+
+        self.assertEqual([None, None], redis.mget([REDIS_KEY_SYNC_USERS, REDIS_KEY_SYNC_CURSOR]))
+        client.users_list = users_list()
+        sync.max_seconds = None
+        self.assertTrue(sync.run())
+        self.assertEqual(None, client.users_list.call_args_list[0][1]["cursor"])
+
+    def test_slack_api_errors_are_reported_with_their_code(self):
+        error = Exception("The request to the Slack API failed.")
+        error.response = FakeResponse(ok=False, error="cursor_expired")
+        client = MagicMock()
+        client.users_list.side_effect = error
+
+        with self.assertRaises(SlackClientError) as raised:
+            list(self.make_wrapper(client).users_pages("2"))
+
+        self.assertEqual("cursor_expired", raised.exception.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
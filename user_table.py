@@ -0,0 +1,111 @@
+"""
+A read-only map of slack user names to user ids, stored in a file that is shared by every worker process.
+
+The file is a sorted table that is memory mapped and searched in place, so the map is built once (by whichever
+worker needs it first) and then read without parsing or copying it. The pages are shared through the operating
+system's page cache, so each worker only pays for the few pages that its lookups touch.
+
+The layout of the file is:
+ - a 16 byte header: MAGIC, then the number of users as a little-endian uint32, then 4 unused bytes
+ - the offset of each record, as little-endian uint32s, in the order of the user names (compared as utf-8 bytes)
+ - the records themselves: "<name>\t<user id>\n"
+"""
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+MAGIC = b"TTUSERS1"
+_HEADER = struct.Struct("<8sII")
+_OFFSET = struct.Struct("<I")
+
+
+def build(path, name_to_id):
+    """
+    Write the given map of user names to ids to a table at the given path.
+
+    The table is written to a temporary file and then moved into place, so readers never see a partial table,
+    and a table that is already mapped by another process is left intact.
+    """
+    entries = sorted((name.encode(), user_id.encode()) for (name, user_id) in name_to_id.items()
+                     if name and user_id)
+    offsets = []
+    records = []
+    position = _HEADER.size + _OFFSET.size * len(entries)
+    for (name, user_id) in entries:
+        record = b"%s\t%s\n" % (name, user_id)
+        offsets.append(position)
+        records.append(record)
+        position += len(record)
+
+    (fd, temp_path) = tempfile.mkstemp(prefix=os.path.basename(path), dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, len(entries), 0))
+            f.write(b"".join(_OFFSET.pack(x) for x in offsets))
+            f.write(b"".join(records))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def open_if_fresh(path, max_age):
+    """
+    Open the table at the given path, if it exists and was built less than max_age seconds ago.
+    Otherwise, return None.
+    """
+    try:
+        if time.time() - os.stat(path).st_mtime > max_age:
+            return None
+        return UserTable(path)
+    except (OSError, ValueError):
+        return None
+
+
+class UserTable:
+    """
+    A memory mapped table of user names to user ids. Names are found by binary search.
+
+    This supports the parts of the dict interface that the UserDirectory uses.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self._count, _) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError("%s is not a user table" % path)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        user_id = self.get(name)
+        if user_id is None:
+            raise KeyError(name)
+        return user_id
+
+    def get(self, name, default=None):
+        key = name.encode()
+        (low, high) = (0, self._count)
+        while low < high:
+            middle = (low + high) // 2
+            (start,) = _OFFSET.unpack_from(self._mmap, _HEADER.size + _OFFSET.size * middle)
+            tab = self._mmap.find(b"\t", start)
+            candidate = self._mmap[start:tab]
+            if candidate == key:
+                return self._mmap[tab + 1:self._mmap.find(b"\n", tab)].decode()
+            if candidate < key:
+                low = middle + 1
+            else:
+                high = middle
+        return default
+
+    def close(self):
+        self._mmap.close()
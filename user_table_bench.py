@@ -0,0 +1,54 @@
+"""
+Compare the ways that a worker process can get the map of every user name to id.
+
+    > python user_table_bench.py [number_of_users]
+
+"json" is what each worker did before: parse the map that was cached in redis, and keep its own dict.
+"table" opens the user table that the first worker built (see user_table.py). The table is read in place,
+so the memory shown for it is only what python allocates; the file itself is shared through the page cache.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import user_table
+
+
+def measure(label, load, names):
+    tracemalloc.start()
+    start = time.perf_counter()
+    user_map = load()
+    load_seconds = time.perf_counter() - start
+    (allocated, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    found = sum(1 for name in names if name in user_map)
+    lookup_seconds = time.perf_counter() - start
+    print("%-8s %10.1f ms to load %10.1f MB held %10.2f us/lookup %8d found" % (
+        label, load_seconds * 1e3, allocated / 1e6, lookup_seconds * 1e6 / len(names), found))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    users = {"user.name%d" % i: "U%08X" % i for i in range(count)}
+    names = random.sample(list(users), 50) + ["no.body"]
+    blob = json.dumps(users)
+    path = os.path.join(tempfile.mkdtemp(), "users.table")
+    start = time.perf_counter()
+    user_table.build(path, users)
+    print("%d users: %.1f MB of json, %.1f MB table built in %.1f ms" % (
+        count, len(blob) / 1e6, os.path.getsize(path) / 1e6, (time.perf_counter() - start) * 1e3))
+
+    measure("json", lambda: json.loads(blob), names)
+    measure("table", lambda: user_table.UserTable(path), names)
+    os.unlink(path)
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
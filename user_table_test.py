@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import user_table
+from user_table import UserTable
+
+
+class TestUserTable(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "users.table")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        names = {"user%04d" % i: "U%04d" % i for i in range(1000)}
+        names["zoë.ünicode"] = "UZOE"
+        user_table.build(self.path, names)
+
+        table = UserTable(self.path)
+
+        self.assertEqual(1001, len(table))
+        for (name, user_id) in names.items():
+            self.assertEqual(user_id, table[name])
+        self.assertIn("user0500", table)
+        self.assertNotIn("user", table)
+        self.assertNotIn("user9999", table)
+        self.assertIsNone(table.get("aardvark"))
+        self.assertRaises(KeyError, lambda: table["zzz"])
+        table.close()
+
+    def test_empty_table(self):
+        user_table.build(self.path, {})
+
+        table = UserTable(self.path)
+
+        self.assertEqual(0, len(table))
+        self.assertNotIn("fred.hole", table)
+
+    def test_rebuilding_leaves_open_tables_intact(self):
+        user_table.build(self.path, {"fred.hole": "UFRED"})
+        old_table = UserTable(self.path)
+
+        user_table.build(self.path, {"joe.bloggs": "UJOE"})
+
+        self.assertEqual("UFRED", old_table["fred.hole"])
+        self.assertEqual("UJOE", UserTable(self.path)["joe.bloggs"])
+        self.assertEqual(["users.table"], os.listdir(self.directory))
+
+    def test_open_if_fresh(self):
+        self.assertIsNone(user_table.open_if_fresh(self.path, 60))
+
+        user_table.build(self.path, {"fred.hole": "UFRED"})
+        self.assertEqual("UFRED", user_table.open_if_fresh(self.path, 60)["fred.hole"])
+
+        os.utime(self.path, (0, 0))
+        self.assertIsNone(user_table.open_if_fresh(self.path, 60))
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, "wb") as f:
+            f.write(b"{\"fred.hole\": \"UFRED\"}")
+
+        self.assertRaises(ValueError, UserTable, self.path)
+        self.assertIsNone(user_table.open_if_fresh(self.path, 60))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+A small bounded work queue serviced by a pool of background threads.
+
+Slack expects events to be acknowledged within 3 seconds. Processing a channel event can take
+much longer than that (several Slack API calls, plus waiting for the channel's purpose), so the
+event handlers just put the work onto this queue and return immediately.
+"""
+import contextvars
+import logging
+import queue
+import threading
+import time
+
+# Sentinel placed on the queue to tell a worker thread to exit
+_STOP = object()
+
+
+class WorkQueue:
+    """
+    A bounded queue of callables, executed by a fixed number of worker threads.
+
+    If the number of workers is zero, submitted work is executed immediately on the calling thread.
+    This is useful for unit tests and for hosting environments (like Lambda) that freeze the process
+    as soon as the response has been sent.
+    """
+
+    def __init__(self, workers=4, max_size=1000, logger=None, name="WorkQueue"):
+        self.logger = logger or logging.getLogger(name)
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_size)
+        self._threads = []
+        self._is_shutdown = False
+        self.rejected = 0
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name="%s-%d" % (name, i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue the given function to be executed on a worker thread.
+        The function runs in a copy of the caller's context (e.g. the id of the event being logged).
+
+        :return: True if the work was accepted, False if the queue was full or shut down
+        """
+        if self._is_shutdown:
+            self.logger.error("work queue is shut down. Rejected %s", getattr(fn, "__name__", fn))
+            self.rejected += 1
+            return False
+
+        context = contextvars.copy_context()
+        if not self.workers:
+            self._execute(context, fn, args, kwargs)
+            return True
+
+        try:
+            self._queue.put_nowait((context, fn, args, kwargs))
+            return True
+        except queue.Full:
+            self.logger.error("work queue is full (%d items). Rejected %s", self.depth(), getattr(fn, "__name__", fn))
+            self.rejected += 1
+            return False
+
+    def schedule(self, delay, fn, *args, **kwargs):
+        """
+        Queue the given function to be executed on a worker thread after the given number of seconds.
+        """
+        timer = threading.Timer(delay, contextvars.copy_context().run, (self.submit, fn) + args, kwargs)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def depth(self):
+        """
+        Return the number of work items waiting to be executed
+        """
+        return self._queue.qsize()
+
+    def shutdown(self, timeout=None):
+        """
+        Stop accepting new work, wait for all queued work to finish, and then stop the worker threads.
+
+        :param timeout: Maximum number of seconds to wait for the queue to drain. None means wait forever.
+        :return: True if all the work was completed
+        """
+        if self._is_shutdown:
+            return True
+        self._is_shutdown = True
+        self.logger.info("shutting down work queue: %d items still queued", self.depth())
+
+        deadline = None if timeout is None else time.time() + timeout
+        for _ in self._threads:
+            # Stop markers go to the back of the queue, so everything already queued is completed first
+            try:
+                self._queue.put(_STOP, timeout=None if deadline is None else max(0.0, deadline - time.time()))
+            except queue.Full:
+                break  # the queue is still full at the deadline, so the workers can't all be told to stop
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.time()))
+
+        drained = not any(thread.is_alive() for thread in self._threads)
+        if not drained:
+            self.logger.error("work queue did not drain in time: %d items abandoned", self.depth())
+        return drained
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                (context, fn, args, kwargs) = item
+                self._execute(context, fn, args, kwargs)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, context, fn, args, kwargs):
+        try:
+            context.run(fn, *args, **kwargs)
+        except Exception:
+            self.logger.exception("work item %s failed", getattr(fn, "__name__", fn))
@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+from mock import MagicMock
+
+from work_queue import WorkQueue
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def test_zero_workers_runs_inline(self):
+        work = MagicMock()
+        work_queue = WorkQueue(workers=0, logger=MagicMock())
+
+        self.assertTrue(work_queue.submit(work, "create", {"x": 1}))
+
+        work.assert_called_once_with("create", {"x": 1})
+
+    def test_shutdown_drains_queue(self):
+        results = []
+        work_queue = WorkQueue(workers=2, logger=MagicMock())
+        for i in range(20):
+            work_queue.submit(results.append, i)
+
+        self.assertTrue(work_queue.shutdown(timeout=5))
+
+        self.assertEqual(list(range(20)), sorted(results))
+        self.assertFalse(work_queue.submit(results.append, 99))
+
+    def test_full_queue_rejects_work(self):
+        release = threading.Event()
+        logger = MagicMock()
+        work_queue = WorkQueue(workers=1, max_size=1, logger=logger)
+        work_queue.submit(release.wait)  # occupies the only worker...
+        while work_queue.depth():
+            pass
+        work_queue.submit(release.wait)  # ...fills the queue...
+
+        self.assertFalse(work_queue.submit(release.wait))  # ...so this has nowhere to go
+
+        self.assertEqual(1, work_queue.rejected)
+        self.assertTrue(logger.error.called)
+        release.set()
+        work_queue.shutdown(timeout=5)
+
+    def test_shutdown_of_full_queue_gives_up_at_the_deadline(self):
+        release = threading.Event()
+        work_queue = WorkQueue(workers=1, max_size=1, logger=MagicMock())
+        work_queue.submit(release.wait)
+        while work_queue.depth():
+            pass
+        work_queue.submit(release.wait)
+
+        start = time.monotonic()
+        self.assertFalse(work_queue.shutdown(timeout=0.1))
+
+        self.assertLess(time.monotonic() - start, 2)
+        release.set()
+
+    def test_failing_work_does_not_kill_worker(self):
+        logger = MagicMock()
+        results = []
+        work_queue = WorkQueue(workers=1, logger=logger)
+        work_queue.submit(lambda: 1 / 0)
+        work_queue.submit(results.append, "still alive")
+        work_queue.shutdown(timeout=5)
+
+        self.assertTrue(logger.exception.called)
+        self.assertEqual(["still alive"], results)
+
+
+if __name__ == '__main__':
+    unittest.main()